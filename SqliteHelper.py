@@ -1,26 +1,180 @@
-import sqlite3
+import sqlite3, threading, time
+from collections import namedtuple
+from contextlib import contextmanager
+import migrations
+from normalize import book_key, normalize_key
+import duplicates
+import book_stats
+from book_stats import STATS_CATEGORIES
+from query_cache import written_table
+
+RowChange = namedtuple("RowChange", ["table", "operation", "row_id", "columns"])
+RowChange.__doc__ = """Row-level change reported to listeners after a write is committed.
+
+    table (string) - table that was written ("books" or "calendar")
+    operation (string) - "insert", "update", "delete", or "reload" after a bulk write (row_id is None)
+    row_id (int) - id of the row that changed
+    columns (tuple) - names of the columns whose value changed (all columns for inserts and deletes)
+"""
+
+BookSnapshot = namedtuple("BookSnapshot", ["operation", "rows"])
+BookSnapshot.__doc__ = """Books as they were before a bulk delete or edit, returned so the change can be undone.
+
+    operation (string) - "delete" or "update"
+    rows (list of tuples) - the books' BOOK_SNAPSHOT_COLUMNS values before the change
+"""
+
+CommitStats = namedtuple("CommitStats", ["commits", "seconds", "rollbacks"])
+CommitStats.__doc__ = """Totals for every commit made through a SqliteHelper, across all threads.
+
+    commits (int) - number of transactions committed
+    seconds (float) - time spent inside COMMIT, which is where SQLite writes and syncs the journal
+    rollbacks (int) - number of transactions rolled back
+"""
+
+BOOK_INSERT = "INSERT INTO books (title, author, rating, genre, series, notes, title_norm, author_norm) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+BOOK_SNAPSHOT_COLUMNS = ("id", "title", "author", "rating", "genre", "series", "notes", "title_norm", "author_norm")
+BULK_EDIT_COLUMNS = ("rating", "genre", "series", "notes") #title and author cannot be changed after a book is added
+BULK_CHUNK = 500 #ids per IN (...) list, well under SQLite's limit on bound parameters
+
+FILTER_CATEGORIES = ("author", "rating", "genre", "series")
+
+NOTIFY_TABLES = {
+    "books": ("title", "author", "rating", "genre", "series", "notes"),
+    "calendar": ("date", "title", "author", "archived"),
+}
+
+#Connection settings. WAL lets readers on other connections keep reading while a write commits, and with
+#synchronous=NORMAL a commit only appends to the WAL file; the fsync happens at checkpoints. cache_size is
+#negative so it is read as KiB. statement_cache is the number of compiled statements kept per connection.
+PROFILES = {
+    "desktop": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16384, #16 MiB
+        "mmap_size": 64 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 1000,
+        "busy_timeout": 5000,
+        "statement_cache": 128,
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -262144, #256 MiB, so index pages are not spilled half way through a large import
+        "mmap_size": 256 * 1024 * 1024,
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000, #fewer, larger checkpoints while the import runs
+        "busy_timeout": 30000,
+        "statement_cache": 32,
+    },
+}
+
+PROFILE_PRAGMAS = ("journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store", "wal_autocheckpoint", "busy_timeout")
 
 class SqliteHelper:
     """Creates connection to database and facilitates sqlite queries to create and modify the user's data.
 
+    Every thread that uses the helper gets its own connection and cursor, opened with the helper's profile
+    the first time the thread touches conn or cursor, so a reader on one thread never shares a cursor
+    with a writer on another. Change events are also collected per thread. The helper keeps a list of the
+    connections it has opened so close_all() can close them from any thread.
+
+    With a QueryCache enabled, select() and sort_items() are answered from it when the same query has run since
+    the last commit that wrote one of its tables (see query_cache.py).
+
     METHODS:
-        __init__(self, name = None)
-            Accepts a database name to initialize the database connection and cursor, and call the open() method
+        __init__(self, name = None, profile = "desktop")
+            Accepts a database name and connection profile, and calls the open() method
 
-        open(self, name)
+        open(self, name, profile = None)
             Attempts to connect to the database with the passed-in name and if it does not exist, the database will be created
+
+        connection(self)
+            Returns the calling thread's connection, opening it the first time the thread asks
+
+        apply_profile(self, profile)
+            Applies the pragmas of a profile in PROFILES to the calling thread's connection and returns the previous profile
+
+        close(self)
+            Closes the calling thread's connection
+
+        close_all(self)
+            Closes the connections of every thread, for a helper that is being discarded
             
+        migrate(self)
+            Brings the database schema up to date and installs the change triggers; called once at startup
+
         create_table(self)
             Creates the books table if it does not already exist
         
         create_calendar_table(self)
             Creates the calendar table if it does not already exist
 
-        create_filter_table(self)
-            Creates the filter table if it does not already exist
+
+        create_change_triggers(self, table)
+            Creates temporary triggers that record row-level changes to the table for this connection
+
+        record_change(self, table, operation, row_id, columns)
+            Called from the temporary triggers for every changed row; the change is held until the write is committed
+
+        add_listener(self, listener)
+            Registers a callable that receives the list of RowChange events after every committed write
+
+        remove_listener(self, listener)
+            Unregisters a callable added with add_listener()
+
+        dispatch_changes(self)
+            Sends the changes recorded since the last commit to every listener
+
+        notify_reload(self, table)
+            Tells every listener that the table changed too much to patch row by row
+
+        transaction(self)
+            Context manager that groups writes into one commit; nested uses become savepoints
+
+        commit(self)
+            Commits the calling thread's transaction and records how long it took
+
+        rollback(self)
+            Rolls back the calling thread's transaction and drops the change events recorded in it
+
+        commit_stats(self)
+            Returns a CommitStats with the number of commits and the time spent in them
+
+        enable_instrumentation(self, stats)
+            Starts recording the time, rows and parameters of every query in a QueryStats
+
+        disable_instrumentation(self)
+            Stops recording queries and returns the QueryStats that was in use
+
+        explain(self, query, parameters = ())
+            Returns the EXPLAIN QUERY PLAN steps for a query without running it
+
+        enable_cache(self, cache)
+            Starts answering select() and sort_items() from a QueryCache
+
+        disable_cache(self)
+            Stops using the result cache and returns the QueryCache that was in use
+
+        mark_written(self, query)
+            Notes the table a write statement changes, so the cached results that read it are dropped on commit
   
         insert(self, query, inserts) 
-            Executes the insert query with parameterized statements
+            Executes the insert query with parameterized statements and notifies listeners of the inserted rows
+
+        insert_many(self, query, rows)
+            Executes the insert query once per row with executemany, in one transaction
+
+        insert_book(self, book, typed_title = None)
+            Inserts one book with its normalized title and author keys and duplicate signatures, and returns its id
+
+        find_duplicates(self, title, author)
+            Returns the ids of books whose normalized title and author match
+
+        fetch_rows(self, method, query, parameters)
+            Runs a select for select() and sort_items(), using the result cache when one is enabled
 
         select(self, query): 
             Executes the select query without parameterized statements
@@ -29,42 +183,253 @@ class SqliteHelper:
             Executes the select query with parameterized statements
         
         update(self, query, updates): 
-            Executes the update query with parameterized statements
+            Executes the update query with parameterized statements and notifies listeners of the updated rows
+
+        update_many(self, query, rows)
+            Executes the update query once per row with executemany, in one transaction
 
         delete(self, query)
-            Executes the delete query without parameterized statements
+            Executes the delete query without parameterized statements and notifies listeners of the deleted rows
+
+        delete_many(self, query, rows)
+            Executes the parameterized delete query once per row with executemany, in one transaction
+
+        book_rows(self, book_ids)
+            Returns the BOOK_SNAPSHOT_COLUMNS values of the books with the given ids, in id order
+
+        delete_books(self, book_ids)
+            Deletes books in one transaction and returns a BookSnapshot that restore_books() can put back
+
+        update_books(self, book_ids, values)
+            Sets the same rating, genre, series or notes on many books in one transaction and returns a BookSnapshot
+
+        restore_books(self, snapshot)
+            Undoes delete_books() or update_books() by writing the books in a BookSnapshot back in one transaction
+
+        reminders_between(self, first_date, last_date, archived = False, limit = None, descending = False)
+            Returns the reminders dated from first_date to last_date, earliest first (latest first if descending)
+
+        archive_reminders(self, reminder_ids, archived = True)
+            Marks reminders as archived (or back to active) in one transaction
+
+        book_totals(self)
+            Returns the number of books and their average rating, read from the book_stats summary
+
+        category_stats(self, category, limit = None, by_count = True)
+            Returns the (value, books, average rating) rows of one category from the book_stats summary
+
+        rebuild_stats(self)
+            Recomputes the book_stats summary from the books table and returns the number of rows
+
+        check_stats(self)
+            Returns the book_stats rows that do not match the books table
+
+        unique_keys(self)
+            Returns True if the (title_norm, author_norm) index is UNIQUE
+
+        duplicate_keys(self)
+            Returns the books that share title_norm/author_norm keys while their index is not UNIQUE
+
+        restore_unique_keys(self)
+            Makes the (title_norm, author_norm) index UNIQUE again once no books share their keys
+
+        match_expression(text)
+            Turns the user's search text into an FTS5 query that matches every word as a prefix
+
+        search(self, text, limit = 50)
+            Returns the books that best match the search text, most relevant first
+
+        search_condition(text)
+            Returns the parameterized sqlite condition that limits a books query to the search matches
+
+        filter_condition(category, data)
+            Returns the parameterized sqlite condition that matches the user's filter
 
         filter_items(self, category, data)
-            SQLite query to insert data into results table based on user's filter
+            Yields the books that match the user's filter, reading them from the database as they are consumed
+
+        keyset_query(table, columns, order = "id", key = None, forward = True, page_size = 256, where = "", parameters = (), descending = False)
+            Builds the query for the page of rows next to a (sort value, id) key
+
+        keyset_page(self, table, columns, order = "id", key = None, forward = True, page_size = 256, where = "", parameters = (), descending = False)
+            Returns the page of rows after (forward) or before (backward) a (sort value, id) key, in display order
     """
 
-    def __init__(self, name = None):
-        """Accepts a database name to initialize the database connection and cursor, and call the open() method.
+    def __init__(self, name = None, profile = "desktop"):
+        """Accepts a database name and connection profile, and calls the open() method.
 
         Parameters: 
             name (string) - default is None or user can pass in a database name
+            profile (string) - name of the connection settings in PROFILES ("desktop" or "bulk-load")
+
+        Raises ValueError if the profile is not in PROFILES
         """
         
-        self.conn = None
-        self.cursor = None 
+        if profile not in PROFILES:
+            raise ValueError("Unknown connection profile " + repr(profile))
+
+        self.name = None
+        self.profile = profile
+        self.local = threading.local()
+        self.listeners = []
+        self.track_changes = True #bulk writers turn this off and call notify_reload() instead
+        self.triggers_ready = False #set once migrate() has run, so connections opened later get the change triggers too
+        self.stats_lock = threading.Lock()
+        self.commits = 0
+        self.commit_seconds = 0.0
+        self.rollbacks = 0
+        self.query_stats = None #QueryStats while instrumentation is enabled; the query methods only time themselves when it is set
+        self.cache = None #QueryCache while result caching is enabled
+        self.connections = [] #every thread's open connection, for close_all()
+        self.connections_lock = threading.Lock()
+        self.generation = 0 #bumped by close_all(); a thread whose connection is from an older generation opens a new one
 
         if name: 
             self.open(name) 
 
-    def open(self, name): 
+    @property
+    def conn(self):
+        """The calling thread's connection"""
+
+        return self.connection()
+
+    @property
+    def cursor(self):
+        """The calling thread's shared cursor"""
+
+        self.connection()
+        return getattr(self.local, "cursor", None)
+
+    @property
+    def pending_changes(self):
+        """Changes recorded on the calling thread's connection since its last commit"""
+
+        return self.local.__dict__.setdefault("pending_changes", [])
+
+    @pending_changes.setter
+    def pending_changes(self, changes):
+        self.local.pending_changes = changes
+
+    @property
+    def written_tables(self):
+        """Tables written on the calling thread's connection since its last commit, while the result cache is enabled"""
+
+        return self.local.__dict__.setdefault("written_tables", set())
+
+    def open(self, name, profile = None): 
         """Attempts to connect to the database with the passed-in name and if it does not exist, the database will be created.
+        The calling thread's connection is opened straight away; other threads open theirs when they first use the helper.
+
+        Parameters:
+            name (string) - database file name
+            profile (string) - name of the connection settings in PROFILES; the helper's profile when None
 
         Raises sqlite3.Error
             Failed to connect to database
         """
         
+        if profile is not None:
+            if profile not in PROFILES:
+                raise ValueError("Unknown connection profile " + repr(profile))
+            self.profile = profile
+
+        self.close()
+        self.name = name
         try: 
-            self.conn = sqlite3.connect(name)
-            self.cursor = self.conn.cursor()
-            print(sqlite3.version)
+            self.connection()
         except sqlite3.Error as e:
             print("Failed to connect to database")
 
+    def connection(self):
+        """Returns the calling thread's connection, opening it the first time the thread asks.
+
+        New connections get the helper's profile, the record_change function used by the change triggers,
+        and the change triggers themselves once migrate() has run.
+
+        Returns sqlite3.Connection, or None if no database has been opened
+        """
+
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.generation != self.generation:
+            conn = None #closed by close_all()
+        if conn is None and self.name is not None:
+            #each connection is only used by the thread that opened it; check_same_thread is off so close_all() may close it
+            conn = sqlite3.connect(self.name, cached_statements = PROFILES[self.profile]["statement_cache"], check_same_thread = False)
+            with self.connections_lock:
+                self.connections.append(conn)
+                self.local.generation = self.generation
+            self.local.conn = conn
+            self.local.cursor = conn.cursor()
+            conn.create_function("record_change", 4, self.record_change)
+            self.apply_profile(self.profile)
+
+            if self.triggers_ready:
+                for table in NOTIFY_TABLES:
+                    self.create_change_triggers(table)
+        return conn
+
+    def apply_profile(self, profile):
+        """Applies the pragmas of a profile in PROFILES to the calling thread's connection and returns the previous profile.
+
+        journal_mode is stored in the database file; the other settings only last as long as the connection.
+        The statement cache size is fixed when the connection is opened, so it is not changed here.
+
+        Parameters:
+            profile (string) - name of the connection settings, e.g. "bulk-load" around a large import
+
+        Raises ValueError if the profile is not in PROFILES
+        """
+
+        if profile not in PROFILES:
+            raise ValueError("Unknown connection profile " + repr(profile))
+
+        previous = getattr(self.local, "profile", self.profile)
+        settings = PROFILES[profile]
+        c = self.conn.cursor()
+        for pragma in PROFILE_PRAGMAS:
+            c.execute("PRAGMA %s = %s" % (pragma, settings[pragma]))
+        self.local.profile = profile
+        return previous
+
+    def close(self):
+        """Closes the calling thread's connection; the next use of the helper on this thread opens a new one"""
+
+        conn = getattr(self.local, "conn", None)
+        if conn is not None and self.local.generation == self.generation:
+            with self.connections_lock:
+                if conn in self.connections:
+                    self.connections.remove(conn)
+            conn.close()
+        self.local.conn = None
+        self.local.cursor = None
+
+    def close_all(self):
+        """Closes the connections of every thread, for a helper that is being discarded (e.g. evicted from a LibraryPool).
+
+        The caller must make sure no thread is using the helper. A thread that uses it afterwards opens a new connection.
+        """
+
+        with self.connections_lock:
+            connections = self.connections
+            self.connections = []
+            self.generation += 1
+        for conn in connections:
+            conn.close()
+        self.local.conn = None
+        self.local.cursor = None
+
+    def migrate(self):
+        """Brings the database schema up to date and installs the change triggers; called once at startup.
+
+        Returns the schema version (PRAGMA user_version) after the migrations have run
+        """
+
+        version = migrations.migrate(self)
+        for table in NOTIFY_TABLES:
+            self.create_change_triggers(table)
+        self.triggers_ready = True
+        return version
+
     def create_table(self): 
         """Creates the books table if it does not already exist."""
        
@@ -78,6 +443,7 @@ class SqliteHelper:
             series TEXT NOT NULL,
             notes TEXT NOT NULL            
             )""") 
+        self.create_change_triggers("books")
 
     def create_calendar_table(self):
         """Creates the calendar table if it does not already exist."""
@@ -89,20 +455,238 @@ class SqliteHelper:
             title TEXT NOT NULL,
             author TEXT NOT NULL            
             )""") 
+        self.create_change_triggers("calendar")
+
+    def create_change_triggers(self, table):
+        """Creates temporary triggers that record row-level changes to the table for this connection.
+
+        The triggers live in the temp schema, so they never reach the database file and other programs
+        that open booklist.db are not affected. For updates, only the columns whose value changed are reported.
+
+        Parameters:
+            table (string) - one of the tables in NOTIFY_TABLES
+        """
 
-    def create_filter_table(self): 
-        """Creates the filter table if it does not already exist."""
+        columns = NOTIFY_TABLES[table]
+        all_columns = "'" + ",".join(columns) + "'"
+        changed_columns = " || ".join("CASE WHEN OLD.{0} IS NOT NEW.{0} THEN '{0},' ELSE '' END".format(column) for column in columns)
 
         c = self.cursor
-        c.execute("""CREATE TABLE IF NOT EXISTS results (
-            id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            author TEXT NOT NULL,
-            rating INTEGER NOT NULL,
-            genre TEXT NOT NULL,
-            series TEXT NOT NULL,
-            notes TEXT NOT NULL            
-            )""") 
+        c.execute("""CREATE TEMP TRIGGER IF NOT EXISTS {0}_insert_notify AFTER INSERT ON main.{0}
+            BEGIN SELECT record_change('{0}', 'insert', NEW.id, {1}); END""".format(table, all_columns))
+        c.execute("""CREATE TEMP TRIGGER IF NOT EXISTS {0}_update_notify AFTER UPDATE ON main.{0}
+            BEGIN SELECT record_change('{0}', 'update', NEW.id, rtrim({1}, ',')); END""".format(table, changed_columns))
+        c.execute("""CREATE TEMP TRIGGER IF NOT EXISTS {0}_delete_notify AFTER DELETE ON main.{0}
+            BEGIN SELECT record_change('{0}', 'delete', OLD.id, {1}); END""".format(table, all_columns))
+
+    def record_change(self, table, operation, row_id, columns):
+        """Called from the temporary triggers for every changed row; the change is held until the write is committed."""
+
+        if self.cache is not None:
+            self.written_tables.add(table) #also during bulk writes, which do not track changes
+        if not self.track_changes:
+            return
+
+        columns = tuple(column for column in columns.split(",") if column)
+        if operation == "update" and len(columns) == 0:
+            return #row was written with identical values
+        self.pending_changes.append(RowChange(table, operation, row_id, columns))
+
+    def add_listener(self, listener):
+        """Registers a callable that receives the list of RowChange events after every committed write.
+
+        Parameters:
+            listener (callable) - called as listener(changes)
+        """
+
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Unregisters a callable added with add_listener()."""
+
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def dispatch_changes(self):
+        """Sends the changes recorded since the last commit to every listener."""
+
+        changes = self.pending_changes
+        self.pending_changes = []
+
+        if len(changes) > 0:
+            for listener in list(self.listeners):
+                listener(changes)
+
+    def notify_reload(self, table):
+        """Tells every listener that the table changed too much to patch row by row.
+
+        Sends a single RowChange with operation "reload" and no row id. Used after bulk writes, where
+        recording one event per row would hold the whole batch in memory.
+
+        Parameters:
+            table (string) - table that was written
+        """
+
+        self.pending_changes = [RowChange(table, "reload", None, NOTIFY_TABLES.get(table, ()))]
+        self.dispatch_changes()
+
+    @contextmanager
+    def transaction(self):
+        """Context manager that groups writes into one commit; nested uses become savepoints.
+
+        The outermost block starts the transaction with BEGIN IMMEDIATE, so the write lock is taken up front
+        instead of failing half way through, and commits when the block ends. A block inside it is a
+        SAVEPOINT: if it raises, only its own writes (and their change events) are rolled back, and the
+        exception carries on to the caller. Listeners hear about the changes once, after the outermost commit.
+        insert(), update(), delete() and their _many variants join the transaction instead of committing.
+
+            with helper.transaction():
+                helper.insert_many(query, rows)
+                helper.update(query, values)
+
+        Raises whatever the block raised, after rolling back to the start of the block
+        """
+
+        depth = getattr(self.local, "depth", 0)
+        conn = self.conn
+
+        if depth == 0:
+            self.pending_changes = []
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            self.local.depth = 1
+            try:
+                yield self
+            except:
+                self.local.depth = 0
+                self.rollback()
+                raise
+            self.local.depth = 0
+            self.commit()
+            self.dispatch_changes()
+            return
+
+        savepoint = "sp_%d" % depth
+        mark = len(self.pending_changes)
+        conn.execute("SAVEPOINT " + savepoint)
+        self.local.depth = depth + 1
+        try:
+            yield self
+        except:
+            conn.execute("ROLLBACK TO " + savepoint)
+            conn.execute("RELEASE " + savepoint)
+            del self.pending_changes[mark:]
+            raise
+        finally:
+            self.local.depth = depth
+        conn.execute("RELEASE " + savepoint)
+
+    def commit(self):
+        """Commits the calling thread's transaction and records how long it took.
+
+        In WAL mode with synchronous=NORMAL most of the time is spent appending to the WAL file; the rest
+        is the fsync at checkpoints. Does nothing inside a transaction() block, which commits when it ends.
+        """
+
+        if getattr(self.local, "depth", 0) > 0:
+            return
+
+        conn = self.conn
+        if not conn.in_transaction:
+            return
+
+        started = time.perf_counter()
+        conn.commit()
+        elapsed = time.perf_counter() - started
+        with self.stats_lock:
+            self.commits += 1
+            self.commit_seconds += elapsed
+
+        written = self.local.__dict__.pop("written_tables", None)
+        if written and self.cache is not None:
+            self.cache.invalidate(written)
+
+    def rollback(self):
+        """Rolls back the calling thread's transaction and drops the change events recorded in it"""
+
+        self.conn.rollback()
+        self.pending_changes = []
+        self.local.__dict__.pop("written_tables", None)
+        with self.stats_lock:
+            self.rollbacks += 1
+
+    def commit_stats(self):
+        """Returns a CommitStats with the number of commits and the time spent in them (all threads)"""
+
+        with self.stats_lock:
+            return CommitStats(self.commits, self.commit_seconds, self.rollbacks)
+
+    def enable_instrumentation(self, stats):
+        """Starts recording the time, rows and parameters of every query in a QueryStats (see query_stats.py).
+
+        Covers select(), sort_items(), filter_items(), insert(), update(), delete() and their _many variants on
+        every thread. Times include fetching the rows and, for writes outside a transaction() block, the commit.
+
+        Parameters:
+            stats (QueryStats) - collector for the timings; may be shared by several helpers
+        """
+
+        self.query_stats = stats
+
+    def disable_instrumentation(self):
+        """Stops recording queries and returns the QueryStats that was in use (None if instrumentation was off)"""
+
+        stats = self.query_stats
+        self.query_stats = None
+        return stats
+
+    def enable_cache(self, cache):
+        """Starts answering select() and sort_items() from a QueryCache (see query_cache.py).
+
+        The cache is cleared first, since writes made while it was not in use were not seen. It must only be
+        used by this helper: its keys do not include the database.
+
+        Parameters:
+            cache (QueryCache) - holds the results and their per-table generations
+        """
+
+        cache.clear()
+        self.cache = cache
+
+    def disable_cache(self):
+        """Stops using the result cache and returns the QueryCache that was in use (None if caching was off)"""
+
+        cache = self.cache
+        self.cache = None
+        return cache
+
+    def mark_written(self, query):
+        """Notes the table a write statement changes, so the cached results that read it are dropped on commit.
+
+        Writes to books and calendar are also noted by the change triggers; this covers the other tables.
+        """
+
+        if self.cache is not None:
+            table = written_table(query)
+            if table is not None:
+                self.written_tables.add(table)
+
+    def explain(self, query, parameters = ()):
+        """Returns the EXPLAIN QUERY PLAN steps for a query without running it, e.g. to check an index is used.
+
+        Returns list of strings, indented by depth in the plan
+        """
+
+        from query_stats import query_plan #only needed when a plan is asked for
+        return query_plan(self.conn, query, parameters)
+
+    def record_query(self, method, query, parameters, started, rows):
+        """Hands one execution to the QueryStats; only called while instrumentation is enabled"""
+
+        stats = self.query_stats
+        if stats is not None:
+            stats.record(method, query, parameters, time.perf_counter() - started, rows, self.conn)
 
     def insert(self, query, inserts): 
         """Executes the insert query.
@@ -112,9 +696,90 @@ class SqliteHelper:
             inserts (tuple) - items to be inserted into parameterized sqlite statement
         """
 
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.execute(query, inserts)
+            rows = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("insert", query, inserts, started, rows)
+
+    def insert_many(self, query, rows):
+        """Executes the insert query once per row with executemany, in one transaction.
+
+        Parameters:
+            query (string) - sqlite query with parameterized statements
+            rows (iterable of tuples) - items for each insert
+        """
+
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.executemany(query, rows)
+            count = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("insert_many", query, None, started, count)
+
+    def insert_book(self, book, typed_title = None):
+        """Inserts one book with its normalized title and author keys and duplicate signatures, and returns its id.
+        The book and its signatures are committed together.
+
+        Parameters:
+            book (tuple) - (title, author, rating, genre, series, notes)
+            typed_title (string) - the title before clean_book_details() removed its punctuation, so the duplicate
+                                   signatures know where a subtitle starts; the cleaned title is used when None
+        """
+
         c = self.cursor
-        c.execute(query, inserts)
-        self.conn.commit()
+        with self.transaction():
+            c.execute(BOOK_INSERT, tuple(book) + book_key(book[0], book[1]))
+            book_id = c.lastrowid
+            duplicates.index_books(c, [(book_id, book[0] if typed_title is None else typed_title, book[1])])
+        return book_id
+
+    def find_duplicates(self, title, author):
+        """Returns the ids of books whose normalized title and author match.
+
+        The lookup uses the unique (title_norm, author_norm) index, so "The Shining!" by "stephen king"
+        matches "The Shining" by "Stephen King".
+
+        Returns list of (id,) tuples ([] if the book is not in the database)
+        """
+
+        return self.sort_items("SELECT id FROM books WHERE title_norm = ? AND author_norm = ?", book_key(title, author))
+
+    def fetch_rows(self, method, query, parameters):
+        """Runs a select for select() and sort_items(), using the result cache when one is enabled.
+
+        A thread inside a transaction reads past the cache, since it may see its own uncommitted writes.
+
+        Parameters:
+            method (string) - name the query is recorded under while instrumentation is enabled
+            query (string) - sqlite select query
+            parameters (tuple) - items for the parameterized statements; None for a query without any
+
+        Returns list of tuples ([] if no matches)
+        """
+
+        started = time.perf_counter()
+        rows = ticket = None
+        cache = self.cache
+        if cache is not None and not self.conn.in_transaction:
+            rows, ticket = cache.lookup(query, parameters)
+
+        if rows is None:
+            c = self.cursor
+            if parameters is None:
+                c.execute(query)
+            else:
+                c.execute(query, parameters)
+            rows = c.fetchall()
+            if ticket is not None:
+                cache.store(ticket, rows)
+
+        if self.query_stats is not None:
+            self.record_query(method, query, parameters, started, len(rows))
+        return rows
 
     def select(self, query): 
         """Executes the select query without parameterized statements.
@@ -123,9 +788,7 @@ class SqliteHelper:
             query (string) - sqlite query without parameterized statements
         """
 
-        c = self.cursor
-        c.execute(query)
-        return c.fetchall() #returns a list ([] if no matches)
+        return self.fetch_rows("select", query, None)
 
     def sort_items(self, query, comparisons): 
         """Executes the select query with parameterized statements.
@@ -135,9 +798,7 @@ class SqliteHelper:
             comparisons (tuple) - items to be inserted into parameterized sqlite statement
         """
 
-        c = self.cursor
-        c.execute(query, comparisons)
-        return c.fetchall() #returns a list ([] if no matches)
+        return self.fetch_rows("sort_items", query, comparisons)
 
     def update(self, query, updates): 
         """Executes the update query with parameterized statements.
@@ -147,9 +808,29 @@ class SqliteHelper:
             updates (tuple) - items to be inserted into parameterized sqlite statement
         """
 
-        c = self.cursor
-        c.execute(query, updates)
-        self.conn.commit() 
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.execute(query, updates)
+            rows = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("update", query, updates, started, rows)
+
+    def update_many(self, query, rows):
+        """Executes the update query once per row with executemany, in one transaction.
+
+        Parameters:
+            query (string) - sqlite query with parameterized statements
+            rows (iterable of tuples) - items for each update
+        """
+
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.executemany(query, rows)
+            count = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("update_many", query, None, started, count)
 
     def delete(self, query): 
         """Executes the delete query without parameterized statements.
@@ -158,18 +839,382 @@ class SqliteHelper:
             query (string) - sqlite query without parameterized statements
         """
 
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.execute(query)
+            rows = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("delete", query, None, started, rows)
+
+    def delete_many(self, query, rows):
+        """Executes the parameterized delete query once per row with executemany, in one transaction.
+
+        Parameters:
+            query (string) - sqlite query with parameterized statements, e.g. "DELETE FROM books WHERE id = ?"
+            rows (iterable of tuples) - items for each delete
+        """
+
+        started = time.perf_counter()
+        with self.transaction():
+            self.mark_written(query)
+            self.cursor.executemany(query, rows)
+            count = self.cursor.rowcount
+        if self.query_stats is not None:
+            self.record_query("delete_many", query, None, started, count)
+
+    def book_rows(self, book_ids):
+        """Returns the BOOK_SNAPSHOT_COLUMNS values of the books with the given ids, in id order.
+
+        The ids are read BULK_CHUNK at a time; ids without a book are skipped.
+
+        Parameters:
+            book_ids (iterable of ints) - ids of the books to read
+        """
+
+        book_ids = sorted(set(int(book_id) for book_id in book_ids))
         c = self.cursor
-        c.execute(query)
-        self.conn.commit()
+        rows = []
+        for first in range(0, len(book_ids), BULK_CHUNK):
+            chunk = book_ids[first:first + BULK_CHUNK]
+            c.execute("SELECT " + ", ".join(BOOK_SNAPSHOT_COLUMNS) + " FROM books WHERE id IN (" + ", ".join("?" * len(chunk)) + ") ORDER BY id", chunk)
+            rows.extend(c.fetchall())
+        return rows
+
+    def delete_books(self, book_ids):
+        """Deletes books in one transaction and returns a BookSnapshot that restore_books() can put back.
+
+        The books are read first, inside the same transaction, so the snapshot holds exactly what was deleted.
+        Listeners hear about every deleted row after the single commit.
+
+        Parameters:
+            book_ids (iterable of ints) - ids of the books to delete
+        """
+
+        with self.transaction():
+            rows = self.book_rows(book_ids)
+            self.delete_many("DELETE FROM books WHERE id = ?", [(row[0],) for row in rows])
+        return BookSnapshot("delete", rows)
+
+    def update_books(self, book_ids, values):
+        """Sets the same rating, genre, series or notes on many books in one transaction and returns a BookSnapshot.
+
+        Parameters:
+            book_ids (iterable of ints) - ids of the books to change
+            values (dict) - new value for each column to set, e.g. {"genre": "Horror", "rating": 4}
+
+        Raises ValueError if a column is not in BULK_EDIT_COLUMNS or there is nothing to set
+        """
+
+        columns = [column for column in BULK_EDIT_COLUMNS if column in values]
+        if len(columns) == 0 or len(columns) != len(values):
+            raise ValueError("Only " + ", ".join(BULK_EDIT_COLUMNS) + " can be set on several books")
+
+        query = "UPDATE books SET " + ", ".join(column + " = ?" for column in columns) + " WHERE id = ?"
+        new_values = tuple(values[column] for column in columns)
+        with self.transaction():
+            rows = self.book_rows(book_ids)
+            self.update_many(query, [new_values + (row[0],) for row in rows])
+        return BookSnapshot("update", rows)
+
+    def restore_books(self, snapshot):
+        """Undoes delete_books() or update_books() by writing the books in a BookSnapshot back in one transaction.
+
+        Deleted books are inserted again with their old ids and duplicate signatures; edited books get their
+        old rating, genre, series and notes back.
+
+        Parameters:
+            snapshot (BookSnapshot) - returned by delete_books() or update_books()
+
+        Raises sqlite3.IntegrityError if a deleted book has been added again since, leaving the database unchanged
+        """
+
+        with self.transaction():
+            if snapshot.operation == "delete":
+                self.insert_many("INSERT INTO books (" + ", ".join(BOOK_SNAPSHOT_COLUMNS) + ") VALUES (" + ", ".join("?" * len(BOOK_SNAPSHOT_COLUMNS)) + ")",
+                    snapshot.rows)
+                duplicates.index_books(self.cursor, [row[:3] for row in snapshot.rows])
+            else:
+                self.update_many("UPDATE books SET " + ", ".join(column + " = ?" for column in BULK_EDIT_COLUMNS) + " WHERE id = ?",
+                    [tuple(row[3:7]) + (row[0],) for row in snapshot.rows])
+
+    def reminders_between(self, first_date, last_date, archived = False, limit = None, descending = False):
+        """Returns the reminders dated from first_date to last_date, earliest first (latest first if descending).
+
+        Reads a range of the (archived, date) index, so the cost depends on the size of the window,
+        not on how many reminders have ever been entered. A descending read walks the index backward, so
+        the latest reminders with a limit cost the same as the earliest.
+
+        Parameters:
+            first_date (string) - yyyy-MM-dd, inclusive ("" for no lower bound)
+            last_date (string) - yyyy-MM-dd, inclusive
+            archived (bool) - read the archived reminders instead of the active ones
+            limit (int) - maximum number of reminders returned; None for all of them
+            descending (bool) - latest date first
+
+        Returns list of (id, date, title, author) tuples
+        """
+
+        query = "SELECT id, date, title, author FROM calendar WHERE archived = ? AND date >= ? AND date <= ? ORDER BY " + (
+            "date DESC, id DESC" if descending else "date, id")
+        parameters = (int(archived), first_date, last_date)
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters += (limit,)
+        return self.sort_items(query, parameters)
+
+    def archive_reminders(self, reminder_ids, archived = True):
+        """Marks reminders as archived (or back to active) in one transaction.
+
+        Parameters:
+            reminder_ids (iterable of int) - ids of the reminders
+            archived (bool) - False to make archived reminders active again
+        """
+
+        self.update_many("UPDATE calendar SET archived = ? WHERE id = ?", [(int(archived), reminder_id) for reminder_id in reminder_ids])
+
+    def book_totals(self):
+        """Returns the number of books and their average rating, read from the book_stats summary.
+
+        Adds up the rating rows (one per distinct rating), so the cost does not depend on the number of books.
+
+        Returns tuple of (books, average rating rounded to 2 places, or None when there are no books)
+        """
+
+        books, rating_total = self.sort_items("SELECT TOTAL(books), TOTAL(rating_total) FROM book_stats WHERE category = ?", ("rating",))[0]
+        return int(books), round(rating_total / books, 2) if books else None
+
+    def category_stats(self, category, limit = None, by_count = True):
+        """Returns the (value, books, average rating) rows of one category from the book_stats summary.
+
+        Both orders are read straight from an index, so asking for the ten largest authors reads ten rows.
+
+        Parameters:
+            category (string) - one of STATS_CATEGORIES (author, genre, series or rating)
+            limit (int) - maximum number of rows; None for all of them
+            by_count (bool) - largest first (ties by value); False for value order
+
+        Raises ValueError if the category is not one of STATS_CATEGORIES
+        """
+
+        if category not in STATS_CATEGORIES:
+            raise ValueError("No statistics for " + repr(category))
+
+        query = ("SELECT value, books, ROUND(CAST(rating_total AS REAL) / books, 2) FROM book_stats WHERE category = ? ORDER BY " +
+            ("books DESC, value" if by_count else "value"))
+        parameters = (category,)
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters += (limit,)
+        return self.sort_items(query, parameters)
+
+    def rebuild_stats(self):
+        """Recomputes the book_stats summary from the books table in one transaction and returns the number of rows"""
+
+        with self.transaction():
+            if self.cache is not None:
+                self.written_tables.add("book_stats")
+            return book_stats.rebuild(self.cursor)
+
+    def check_stats(self):
+        """Returns a StatsMismatch for every book_stats row that does not match the books table; empty when they agree"""
+
+        return book_stats.check(self.conn.cursor())
+
+    def unique_keys(self):
+        """Returns True if the (title_norm, author_norm) index is UNIQUE, so the database itself refuses a second copy of a book.
+
+        The index is created without UNIQUE when the keys are added to a library that already has duplicates
+        (migrations.add_normalized_keys()).
+        """
+
+        c = self.conn.cursor()
+        c.execute("PRAGMA index_list(books)")
+        return any(row[1] == "idx_books_norm" and row[2] == 1 for row in c.fetchall())
+
+    def duplicate_keys(self):
+        """Returns the books that share title_norm/author_norm keys while their index is not UNIQUE.
+
+        Returns list of (title_norm, author_norm, list of ids) tuples; empty when the index is UNIQUE
+        """
+
+        if self.unique_keys():
+            return []
+        rows = self.select("""SELECT title_norm, author_norm, group_concat(id) FROM books
+            GROUP BY title_norm, author_norm HAVING COUNT(*) > 1 ORDER BY title_norm, author_norm""")
+        return [(title_norm, author_norm, sorted(int(book_id) for book_id in ids.split(","))) for title_norm, author_norm, ids in rows]
+
+    def restore_unique_keys(self):
+        """Makes the (title_norm, author_norm) index UNIQUE again once no books share their keys.
+
+        Returns True if the index was rebuilt, False if it was already UNIQUE or duplicates remain
+        """
+
+        if self.unique_keys() or len(self.duplicate_keys()) > 0:
+            return False
+        with self.transaction():
+            self.cursor.execute("DROP INDEX idx_books_norm")
+            self.cursor.execute("CREATE UNIQUE INDEX idx_books_norm ON books (title_norm, author_norm)")
+        return True
+
+    @staticmethod
+    def match_expression(text):
+        """Turns the user's search text into an FTS5 query that matches every word as a prefix.
+
+        Punctuation is dropped and each word is quoted, so text such as 'king "it' cannot break the FTS5
+        query syntax. "steph kin" becomes "steph"* "kin"*, which matches Stephen King. Single letters are
+        matched as whole words, since a one-letter prefix matches most of the library and cannot use the prefix index.
+
+        Returns the query string, or None if the text has no words in it
+        """
+
+        words = normalize_key(text).split()
+        if len(words) == 0:
+            return None
+        return " ".join('"' + word + '"' + ("*" if len(word) > 1 else "") for word in words)
+
+    def search(self, text, limit = 50):
+        """Returns the books that best match the search text, most relevant first.
+
+        Matches in the title count most, then author and series, then genre and notes (FTS5 bm25 weights).
+        Every match is ranked and only the best limit are joined to books, so a word as broad as "the" costs
+        one bm25 pass over its matches but never reads the rest of the library.
+
+        Parameters:
+            text (string) - words typed by the user; each one is matched as a prefix
+            limit (int) - maximum number of books returned
+
+        Returns list of (id, title, author, rating, genre, series, notes) tuples
+        """
+
+        expression = self.match_expression(text)
+        if expression is None:
+            return []
+
+        return self.sort_items("""SELECT b.id, b.title, b.author, b.rating, b.genre, b.series, b.notes
+            FROM (SELECT rowid, bm25(books_fts, 10.0, 5.0, 5.0, 1.0, 1.0) AS score FROM books_fts
+                WHERE books_fts MATCH ? ORDER BY score LIMIT ?) m
+            JOIN books b ON b.id = m.rowid
+            ORDER BY m.score""", (expression, limit))
+
+    @staticmethod
+    def search_condition(text):
+        """Returns the parameterized sqlite condition that limits a books query to the search matches.
+
+        Used by the main window's search box so the booklist model can keep reading the matches lazily.
+        Nothing is read from the database, so the GUI thread can build the condition without waiting for the worker.
+
+        Returns tuple of (condition string, parameters tuple), or ("", ()) if the text has no words in it
+        """
+
+        expression = SqliteHelper.match_expression(text)
+        if expression is None:
+            return "", ()
+        return "id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)", (expression,)
+
+    @staticmethod
+    def filter_condition(category, data):
+        """Returns the parameterized sqlite condition that matches the user's filter.
+
+        The category is checked against FILTER_CATEGORIES because column names cannot be bound as parameters;
+        the value is always bound, so the statement text is the same for every value and SQLite can reuse it.
+
+        Parameters:
+            category (string) - category chosen from radio button in filter wizard (author, rating, genre, or series)
+            data (string) - value selected from drop-down menu in filter wizard
+
+        Returns tuple of (condition string, parameters tuple)
+
+        Raises ValueError if the category is not one of FILTER_CATEGORIES
+        """
+
+        if category not in FILTER_CATEGORIES:
+            raise ValueError("Cannot filter on " + repr(category))
+        return category + " = ?", (data,)
 
     def filter_items(self, category, data):
-        """SQLite query to insert data into results table based on user's filter.
+        """Yields the books that match the user's filter, reading them from the database as they are consumed.
+
+        Uses its own cursor so the rows can be streamed while other queries run on the shared one.
 
         Parameters:
-            category (string) - category chosen from radio button in filter wizard (author, genre, rating, or notes)
+            category (string) - category chosen from radio button in filter wizard (author, rating, genre, or series)
             data (string) - value selected from drop-down menu in filter wizard
         """
 
-        c = self.cursor
-        query = "INSERT INTO results SELECT * FROM books WHERE "+ category + "= \"" + data +"\"" 
-        c.execute(query)
\ No newline at end of file
+        condition, parameters = self.filter_condition(category, data)
+        query = "SELECT id, title, author, rating, genre, series, notes FROM books WHERE " + condition + " ORDER BY id"
+        started = time.perf_counter()
+        count = 0
+        c = self.conn.cursor()
+        c.execute(query, parameters)
+        try:
+            for book in c:
+                count += 1
+                yield book
+        finally:
+            if self.query_stats is not None:
+                self.record_query("filter_items", query, parameters, started, count) #time includes the caller's work between rows
+
+    @staticmethod
+    def keyset_query(table, columns, order = "id", key = None, forward = True, page_size = 256, where = "", parameters = (), descending = False):
+        """Builds the query for the page of rows next to a (sort value, id) key.
+
+        Rows are sorted by (order, id), so every row has a unique position. A page after a key in the middle of
+        a run of equal sort values (e.g. all the 4-star books) is read as two index seeks joined with UNION ALL:
+        the rest of the run by id, then the rows with a greater sort value. Both stop after page_size rows, so
+        a page deep in a million-row list costs the same as the first one. A page read backward walks the
+        index in reverse; keyset_page() puts it back in display order.
+
+        Parameters:
+            table (string) - table to read
+            columns (tuple) - column names to select; must include the order column and id
+            order (string) - column the rows are sorted by; an index on it keeps every page a seek
+            key (tuple) - (sort value, id) of the row next to the page; None for the first (forward) or last (backward) page
+            forward (bool) - read the page after the key; False for the page before it
+            page_size (int) - number of rows in the page
+            where (string) - optional sqlite condition with parameterized statements
+            parameters (tuple) - items to be inserted into the parameterized condition
+            descending (bool) - the list is shown largest sort value first
+
+        Returns tuple of (query string, parameters tuple); rows come back in reading order
+        """
+
+        ascending = forward != descending #direction the index is walked in
+        compare = " > ?" if ascending else " < ?"
+        direction = "" if ascending else " DESC"
+        select = "SELECT " + ", ".join(columns) + " FROM " + table
+        filters = ["(" + where + ")"] if where else []
+        parameters = tuple(parameters)
+
+        def query_for(conditions, sort):
+            return select + (" WHERE " + " AND ".join(conditions) if conditions else "") + " ORDER BY " + sort + " LIMIT ?"
+
+        if order == "id":
+            if key is None:
+                return query_for(filters, "id" + direction), parameters + (page_size,)
+            return query_for(filters + ["id" + compare], "id" + direction), parameters + (key[1], page_size)
+
+        sort = order + direction + ", id" + direction
+        if key is None:
+            return query_for(filters, sort), parameters + (page_size,)
+
+        same_value = query_for(filters + [order + " = ?", "id" + compare], "id" + direction)
+        beyond_value = query_for(filters + [order + compare], sort)
+        query = "SELECT * FROM (" + same_value + ") UNION ALL SELECT * FROM (" + beyond_value + ") ORDER BY " + sort + " LIMIT ?"
+        return query, parameters + (key[0], key[1], page_size) + parameters + (key[0], page_size, page_size)
+
+    def keyset_page(self, table, columns, order = "id", key = None, forward = True, page_size = 256, where = "", parameters = (), descending = False):
+        """Returns the page of rows after (forward) or before (backward) a (sort value, id) key, in display order.
+
+        keyset_page("books", columns, "title", key = None, forward = False) is the last page of the list sorted by
+        title, read as quickly as the first. See keyset_query() for the parameters.
+
+        Returns list of tuples (fewer than page_size when the page reaches the start or end of the list)
+        """
+
+        query, query_parameters = self.keyset_query(table, columns, order, key, forward, page_size, where, parameters, descending)
+        rows = self.sort_items(query, query_parameters)
+        if not forward:
+            rows.reverse()
+        return rows
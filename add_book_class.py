@@ -1,37 +1,49 @@
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
-from shared import remove_punctuation, show_message
+from shared import clean_book_details, show_message
+from SqliteHelper import SqliteHelper
+from ui_cache import load_ui
 
 
 class AddBook(QtWidgets.QDialog):
     """Adds the new book in the booklist table.
     
     METHODS: 
-        __init__(self, window, helper)
+        __init__(self, window, worker)
             Loads the dialog window so the user can type in the details of the new book to add to the database table.
              
         open_add_form(self)
-            Opens a blank dialog form so they user can input book details and then runs a check for duplicate entries
+            Opens a blank dialog form so they user can input book details and then queues a check for duplicate entries
+
+        find_matches(self, helper, title, author)
+            Runs on the database worker; returns the exact duplicates and the similar books for the new entry
+
+        add_checked_book(self, matches)
+            Called with the result of find_matches(); adds the book unless it is a duplicate the user does not want
+
+        confirm_similar(self, matches)
+            Asks the user whether to add the book anyway when it looks like a book already in the list
         
         reset_form(self)
             Clears the dialog window form by changing all text categories (title, author, genre, series, notes) to empty strings and the integer category (rating) to 0
     """
 
-    def __init__(self, window, helper):
+    def __init__(self, window, worker):
         """Loads the dialog window so the user can type in the details of the new book to add to the database table.
 
         Parameters: 
             window: reference to the main screen created by MainWindow class
-            helper: reference to the sqlite object created by SqliteHelper class
+            worker: reference to the DatabaseWorker that owns the sqlite connection
         """
         super(AddBook, self).__init__()
-        uic.loadUi("book_details_form.ui", self) 
+        load_ui("book_details_form.ui", self) 
         self.window = window
-        self.helper = helper
+        self.worker = worker
+        self.library = window.library #only used from requests running on the worker thread
 
     def open_add_form(self):
-        """Opens a blank dialog form so they user can input book details and then runs a check for duplicate entries
+        """Opens a blank dialog form so they user can input book details and then queues a check for duplicate entries
         """
         self.buttonBox.rejected.connect(self.reject)
         self.buttonBox.accepted.connect(self.accept)
@@ -40,35 +52,64 @@ class AddBook(QtWidgets.QDialog):
         self.reset_form() 
         self.early_cancel = self.exec_() 
 
-        self.title = remove_punctuation(self.lineEdit.text()).title()
-        self.author = remove_punctuation(self.lineEdit_2.text()).title()
-        self.rating = self.spinBox.text()
-        self.genre = remove_punctuation(self.lineEdit_3.text().title())
-        self.series = remove_punctuation(self.lineEdit_4.text().title())
-        self.notes = self.lineEdit_5.text()
+        self.typed_title = self.lineEdit.text() #keeps the subtitle punctuation for the near-duplicate check
+        self.title, self.author, self.rating, self.genre, self.series, self.notes = clean_book_details(
+            self.typed_title, self.lineEdit_2.text(), self.spinBox.text(),
+            self.lineEdit_3.text(), self.lineEdit_4.text(), self.lineEdit_5.text())
 
         if self.early_cancel == QDialog.Rejected:
             self.close()
 
         elif self.title.strip(" ") != "" and self.author.strip(" ") != "":
             self.book = (self.title, self.author, int(self.rating), self.genre, self.series, self.notes)
-
-            self.toCheck = (self.title, self.author)
-            self.dupe_id = self.helper.sort_items("SELECT id FROM books WHERE title=$title AND author=$author", self.toCheck)
-
-            if len(self.dupe_id) == 0: #new entry is not a duplicate
-                self.helper.insert("INSERT INTO books (title, author, rating, genre, series, notes) VALUES (?, ?, ?, ?, ?, ?)", self.book)
-                self.window.refresh_data()
-
-            else: #duplicate exists 
-                self.simple_dupes_dialog = uic.loadUi("simple_duplicates_dialog.ui")
-                self.simple_dupes_dialog.OK_Button.clicked.connect(self.simple_dupes_dialog.close)
-                self.simple_dupes_dialog.exec_()
+            self.worker.submit(self.find_matches, self.typed_title, self.author, callback = self.add_checked_book)
 
         else: 
             show_message("Error", "Enter valid book details")   
             pass       
 
+    def find_matches(self, helper, title, author):
+        """Runs on the database worker; returns the exact duplicates and the similar books for the new entry.
+
+        Returns tuple of (list of duplicate ids, list of similar books from DuplicateIndex.find_similar())
+        """
+
+        return self.library.check_book(title, author)
+
+    def add_checked_book(self, matches):
+        """Called with the result of find_matches(); adds the book unless it is a duplicate the user does not want.
+
+        Parameters:
+            matches (tuple) - (duplicate ids, similar books) returned by find_matches()
+        """
+
+        self.dupe_id, self.similar = matches
+
+        if len(self.dupe_id) == 0: #new entry is not an exact duplicate
+            if len(self.similar) == 0 or self.confirm_similar(self.similar):
+                self.worker.submit(SqliteHelper.insert_book, self.book, self.typed_title) #main window is patched by the change listener
+
+        else: #duplicate exists 
+            self.simple_dupes_dialog = load_ui("simple_duplicates_dialog.ui")
+            self.simple_dupes_dialog.OK_Button.clicked.connect(self.simple_dupes_dialog.close)
+            self.simple_dupes_dialog.exec_()
+
+    def confirm_similar(self, matches):
+        """Asks the user whether to add the book anyway when it looks like a book already in the list
+        (a typo, a subtitle, or the author's names in a different order).
+
+        Parameters:
+            matches (list of tuples) - (score, id, title, author) from DuplicateIndex.find_similar()
+
+        Returns True if the user chose to add the book
+        """
+
+        listing = "\n".join("    " + title + " by " + author for score, book_id, title, author in matches[:3])
+        answer = QMessageBox.question(None, "Possible Duplicate",
+            "This book looks like one already in your list:\n\n" + listing + "\n\nAdd it anyway?",
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        return answer == QMessageBox.Yes
+
     def reset_form(self):
         """Clears the dialog window form by setting all text edits to empty strings and the spinbox to 0.
         """
@@ -0,0 +1,297 @@
+import argparse, datetime, json, os, platform, shutil, sqlite3, statistics, subprocess, sys, tempfile, time
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen") #must be set before the QApplication is created
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import QT_VERSION_STR
+from generate_library import generate_library, parse_count
+from mainwindow_class import MainWindow
+from add_book_class import AddBook
+from delete_book_class import DeleteBook
+from filter_book_class import FilterBook
+from startup_timer import StartupTimer
+from stats_dashboard import read_dashboard
+from query_cache import QueryCache
+
+"""Times the main window's database work on generated libraries and saves the results as JSON.
+
+Runs without a display (QT_QPA_PLATFORM=offscreen). Each library size is generated once into
+benchmark_data/ with generate_library.py and copied to a temporary file for every run, so the delete
+benchmark never changes the saved library. Each operation is timed from the call until the worker has
+delivered every result it queued, i.e. until the rows are in the models.
+
+    python benchmark.py --sizes 10k 100k
+    python benchmark.py --sizes 1M --repeat 3 --output after.json --compare before.json
+    python benchmark.py --sizes 100k --query-cache 32 --compare benchmark_results/<uncached run>.json
+
+Timings are in milliseconds. Use --compare with an earlier results file to print the change in the median
+of every operation; changes above the threshold are marked as regressions.
+
+FUNCTIONS:
+    run_benchmarks(sizes, repeat = 5, data_directory = "benchmark_data", seed = 1, cache_mb = None)
+        Runs every benchmark for each library size and returns the results dictionary
+
+    compare_results(old, new, threshold = 0.1)
+        Returns lines describing the change in median time between two results dictionaries
+"""
+
+SCENARIOS = ("load_data", "refresh_data", "scroll_10_windows", "sort_by_title", "jump_to_end", "duplicate_check_existing",
+    "duplicate_check_new", "facets_cold", "facets_warm", "filter_flow", "stats_dashboard", "delete")
+
+
+class BookBenchmark:
+    """Opens a MainWindow on one library and times its operations.
+
+    METHODS:
+        __init__(self, app, database, repeat, query_cache = None)
+            Opens the main window on the database and waits for the first rows
+
+        wait_idle(self)
+            Runs the event loop until the worker has finished every queued request and its results are delivered
+
+        measure(self, action, setup = None)
+            Times the action (plus the worker requests it queues) repeat times and returns the summary
+
+        run(self)
+            Runs every scenario in SCENARIOS and returns {scenario: summary}
+
+        close(self)
+            Closes the window and stops its worker
+    """
+
+    def __init__(self, app, database, repeat, query_cache = None):
+        """Opens the main window on the database and waits for the first rows.
+
+        Parameters:
+            app (QApplication) - application that runs the event loop
+            database (string) - database file (a copy; the delete benchmark removes books from it)
+            repeat (int) - number of times each operation is timed
+            query_cache (QueryCache) - result cache given to the window; None to run without one
+        """
+
+        self.app = app
+        self.repeat = repeat
+        self.startup = StartupTimer()
+        self.window = MainWindow(self.startup, database, query_cache = query_cache)
+        self.worker = self.window.worker
+        self.wait_idle()
+
+    def wait_idle(self):
+        """Runs the event loop until the worker has finished every queued request and its results are delivered.
+
+        Requests run in order, so a no-op request is finished once everything queued before it is. A second
+        round catches the reads queued by change events that were delivered during the first.
+        """
+
+        for round_number in range(2):
+            loop = QtCore.QEventLoop()
+            self.worker.submit(lambda helper: None, callback = lambda result: loop.quit())
+            loop.exec_()
+
+    def measure(self, action, setup = None):
+        """Times the action (plus the worker requests it queues) repeat times and returns the summary.
+
+        Parameters:
+            action (callable) - operation to time
+            setup (callable) - run (untimed) before every repetition
+
+        Returns dictionary of runs, min_ms, median_ms, mean_ms and max_ms
+        """
+
+        times = []
+        for repetition in range(self.repeat):
+            if setup is not None:
+                setup()
+                self.wait_idle()
+            started = time.perf_counter()
+            action()
+            self.wait_idle()
+            times.append((time.perf_counter() - started) * 1000)
+
+        return {
+            "runs": len(times),
+            "min_ms": round(min(times), 3),
+            "median_ms": round(statistics.median(times), 3),
+            "mean_ms": round(statistics.mean(times), 3),
+            "max_ms": round(max(times), 3),
+        }
+
+    def scroll(self):
+        """Reads the next ten windows of books, one after the other, as a user scrolling down would"""
+
+        for window_number in range(10):
+            self.window.book_model.fetchMore()
+            self.wait_idle()
+
+    def check_book(self, add_book, title, author):
+        """Queues the Add Book duplicate check for one book"""
+
+        self.worker.submit(add_book.find_matches, title, author, callback = lambda matches: None)
+
+    def filter_flow(self, filter_book):
+        """Runs the filter wizard as the user would: choose genre, wait for the values, pick the first one and show the table"""
+
+        filter_book.filter_wizard.RadioBtn_genre.setChecked(True)
+        filter_book.import_genre()
+        self.wait_idle()
+        filter_book.filter_wizard.comboBox.setCurrentIndex(0)
+        filter_book.build_table()
+
+    def select_first_book(self):
+        """Selects the first book in the booklist"""
+
+        self.window.booklist_db.setCurrentIndex(self.window.book_model.index(0, 1))
+
+    def run(self):
+        """Runs every scenario in SCENARIOS and returns {scenario: summary}"""
+
+        results = {}
+        results["load_data"] = self.measure(self.window.load_data)
+        results["refresh_data"] = self.measure(self.window.refresh_data)
+        results["scroll_10_windows"] = self.measure(self.scroll, self.window.load_data)
+        results["sort_by_title"] = self.measure(lambda: self.window.book_model.sort(1, QtCore.Qt.AscendingOrder),
+            lambda: self.window.book_model.sort(0, QtCore.Qt.AscendingOrder))
+        results["jump_to_end"] = self.measure(self.window.jump_to_end, self.window.jump_to_start)
+        self.window.book_model.sort(0, QtCore.Qt.AscendingOrder)
+        self.wait_idle()
+
+        add_book = AddBook(self.window, self.window.worker)
+        existing = self.window.book_model.row_data(0)
+        results["duplicate_check_existing"] = self.measure(lambda: self.check_book(add_book, existing[1], existing[2]))
+        results["duplicate_check_new"] = self.measure(lambda: self.check_book(add_book, "The Quiet Lanterns", "Brian Tailor"))
+
+        filter_book = FilterBook(self.window.worker)
+        categories = ("author", "rating", "genre", "series")
+        def load_facets():
+            for category in categories:
+                filter_book.facets.values(category, lambda values: None)
+                self.wait_idle()
+        results["facets_cold"] = self.measure(load_facets, filter_book.facets.cache.clear)
+        results["facets_warm"] = self.measure(load_facets)
+        results["filter_flow"] = self.measure(lambda: self.filter_flow(filter_book), filter_book.facets.cache.clear)
+        filter_book.filter_results.close()
+
+        results["stats_dashboard"] = self.measure(lambda: self.worker.submit(read_dashboard, callback = lambda stats: None))
+
+        delete_book = DeleteBook(self.window, self.window.worker)
+        results["delete"] = self.measure(delete_book.delete_book, self.select_first_book)
+
+        return results
+
+    def close(self):
+        """Closes the window and stops its worker"""
+
+        self.window.close()
+
+
+def library_file(data_directory, books, seed):
+    """Returns the generated library with the given number of books, generating it first if it does not exist"""
+
+    os.makedirs(data_directory, exist_ok = True)
+    path = os.path.join(data_directory, "library_%d_seed%d.db" % (books, seed))
+    if not os.path.exists(path):
+        print("Generating %d books into %s" % (books, path), file = sys.stderr)
+        generate_library(path, books, seed = seed)
+    return path
+
+def git_commit():
+    """Returns the short hash of the checked-out commit (with "-dirty" if there are uncommitted changes), or "unknown" """
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr = subprocess.DEVNULL, text = True).strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], stderr = subprocess.DEVNULL) != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def run_benchmarks(sizes, repeat = 5, data_directory = "benchmark_data", seed = 1, cache_mb = None):
+    """Runs every benchmark for each library size and returns the results dictionary.
+
+    Parameters:
+        sizes (list of int) - numbers of books
+        repeat (int) - number of times each operation is timed
+        data_directory (string) - folder for the generated libraries
+        seed (int) - random seed passed to generate_library()
+        cache_mb (float) - size of the query result cache in MiB; None to run without one
+
+    Returns dictionary with the commit, environment and {size: {"startup": phases, scenario: summary}}
+    """
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+    results = {
+        "commit": git_commit(),
+        "created": datetime.datetime.now().isoformat(timespec = "seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "qt": QT_VERSION_STR,
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "query_cache_mb": cache_mb,
+        "sizes": {},
+    }
+
+    for books in sizes:
+        source = library_file(data_directory, books, seed)
+        with tempfile.TemporaryDirectory() as scratch:
+            database = os.path.join(scratch, "booklist.db")
+            shutil.copyfile(source, database)
+
+            print("Benchmarking %d books" % books, file = sys.stderr)
+            query_cache = QueryCache(int(cache_mb * 1024 * 1024)) if cache_mb else None
+            benchmark = BookBenchmark(app, database, repeat, query_cache)
+            try:
+                size_results = {"startup": dict((phase, round(seconds * 1000, 3)) for phase, seconds in benchmark.startup.phases)}
+                size_results.update(benchmark.run())
+                if query_cache is not None:
+                    size_results["query_cache"] = query_cache.stats()._asdict()
+            finally:
+                benchmark.close()
+        results["sizes"][str(books)] = size_results
+    return results
+
+def compare_results(old, new, threshold = 0.1):
+    """Returns lines describing the change in median time between two results dictionaries.
+
+    Parameters:
+        old, new (dictionary) - results from run_benchmarks() (or loaded from its JSON files)
+        threshold (float) - relative slowdown above which a change is marked as a regression
+    """
+
+    lines = ["%-10s %-26s %12s %12s %9s" % ("books", "operation", old.get("commit", "old"), new.get("commit", "new"), "change")]
+    for books, scenarios in new["sizes"].items():
+        previous = old.get("sizes", {}).get(books, {})
+        for scenario in SCENARIOS:
+            if scenario not in scenarios or scenario not in previous:
+                continue
+            before = previous[scenario]["median_ms"]
+            after = scenarios[scenario]["median_ms"]
+            change = (after - before) / before if before > 0 else 0.0
+            lines.append("%-10s %-26s %12.2f %12.2f %+8.1f%%%s" % (books, scenario, before, after, change * 100,
+                "  REGRESSION" if change > threshold else ""))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark MyBookMgr on generated libraries")
+    parser.add_argument("--sizes", nargs = "+", default = ["10k", "100k"], help = "library sizes, e.g. 10k 100k 1M (default 10k 100k)")
+    parser.add_argument("--repeat", type = int, default = 5, help = "times each operation is timed (default 5)")
+    parser.add_argument("--data", default = "benchmark_data", help = "folder for the generated libraries (default benchmark_data)")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--output", help = "results file (default benchmark_results/<commit>.json)")
+    parser.add_argument("--compare", help = "earlier results file to compare against")
+    parser.add_argument("--threshold", type = float, default = 0.1, help = "slowdown marked as a regression (default 0.1 = 10%%)")
+    parser.add_argument("--query-cache", type = float, metavar = "MB", help = "run with a query result cache of this size")
+    args = parser.parse_args()
+    data_directory = os.path.abspath(args.data)
+    output = os.path.abspath(args.output) if args.output else None
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__))) #the .ui files are loaded from the program folder
+    results = run_benchmarks([parse_count(size) for size in args.sizes], args.repeat, data_directory, args.seed, args.query_cache)
+
+    output = output or os.path.join("benchmark_results", results["commit"] + ".json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok = True)
+    with open(output, "w") as results_file:
+        json.dump(results, results_file, indent = 2)
+    print("Results written to " + output, file = sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as results_file:
+            print("\n".join(compare_results(json.load(results_file), results, args.threshold)))
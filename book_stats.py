@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+"""Summary counts of books by author, genre, series and rating, kept in the book_stats table.
+
+book_stats holds one row per (category, value) with the number of books and the sum of their ratings. The
+rows are kept current by triggers on books (see migrations.add_book_stats), so reading the statistics never
+scans books: the totals are the sum of the handful of rating rows, and the largest authors, genres or series
+are the first rows of the (category, books) index. The triggers run inside the same transaction as the write
+that fired them, so the summaries are never out of step with a committed change.
+
+rebuild() recomputes every row from books and check() compares the stored rows with a fresh count; both
+read the whole table, so they are maintenance commands rather than something the program runs on startup.
+
+FUNCTIONS:
+    rebuild(c)
+        Replaces the contents of book_stats with counts computed from books and returns the number of rows
+
+    check(c)
+        Returns a StatsMismatch for every (category, value) whose stored counts differ from books
+"""
+
+STATS_CATEGORIES = ("author", "genre", "series", "rating")
+
+StatsMismatch = namedtuple("StatsMismatch", ["category", "value", "expected", "found"])
+StatsMismatch.__doc__ = """A book_stats row that does not match the books table.
+
+    category (string) - one of STATS_CATEGORIES
+    value - the author, genre, series or rating
+    expected (tuple) - (books, rating total) counted from books; (0, 0) for a row that should not exist
+    found (tuple) - (books, rating total) stored in book_stats; (0, 0) for a missing row
+"""
+
+def counted_rows(c, category):
+    """Returns the cursor over (value, books, rating total) counted from books for one category"""
+
+    return c.execute("SELECT " + category + ", COUNT(*), SUM(rating) FROM books GROUP BY " + category)
+
+def rebuild(c):
+    """Replaces the contents of book_stats with counts computed from books and returns the number of rows.
+
+    Parameters:
+        c (sqlite3.Cursor) - cursor inside the caller's transaction
+    """
+
+    c.execute("DELETE FROM book_stats")
+    for category in STATS_CATEGORIES:
+        c.execute("INSERT INTO book_stats (category, value, books, rating_total) SELECT ?, " + category +
+            ", COUNT(*), SUM(rating) FROM books GROUP BY " + category, (category,))
+    return c.execute("SELECT COUNT(*) FROM book_stats").fetchone()[0]
+
+def check(c):
+    """Returns a StatsMismatch for every (category, value) whose stored counts differ from books.
+
+    An empty list means the summaries are consistent. Reads every book once per category.
+
+    Parameters:
+        c (sqlite3.Cursor) - cursor on the database to check
+    """
+
+    mismatches = []
+    for category in STATS_CATEGORIES:
+        stored = dict((value, (books, rating_total)) for value, books, rating_total in
+            c.execute("SELECT value, books, rating_total FROM book_stats WHERE category = ?", (category,)).fetchall())
+        for value, books, rating_total in counted_rows(c, category).fetchall():
+            expected = (books, rating_total)
+            found = stored.pop(value, (0, 0))
+            if found != expected:
+                mismatches.append(StatsMismatch(category, value, expected, found))
+        for value, found in stored.items():
+            mismatches.append(StatsMismatch(category, value, (0, 0), found))
+    return mismatches
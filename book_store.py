@@ -0,0 +1,448 @@
+import sys
+from array import array
+from itertools import accumulate
+
+"""Compact columnar storage for the rows a list view has loaded.
+
+A list of row tuples from fetchall() costs about 350 bytes a book: the tuple, and a separate str object for
+every author, genre and series even though a few values repeat across most of the library. BookStore keeps
+each column in an array instead. Whole-number columns (id, rating) are integer arrays; columns with few
+distinct values (author, genre, series, notes, date) are dictionary-encoded, an integer array of codes into
+one shared list of values; titles, which are mostly distinct, are UTF-8 in one bytearray with an array of
+offsets. Every integer array starts with the narrowest type code and is widened when a value does not fit,
+so ratings and genre codes take one byte a book and ids four. That is about 40 bytes a book plus the
+distinct values, and no per-row Python objects at all.
+
+Rows are rebuilt as tuples when they are read, so the store behaves like the list it replaces:
+
+    store = BookStore(("id", "title", "author", "rating", "genre", "series", "notes"))
+    store.extend(cursor.fetchmany(256))
+    store[0]             #(1, 'The Shining', 'Stephen King', 5, 'Horror', '', '')
+    store.value(0, 2)    #'Stephen King', without building the tuple
+    store.insert(0, record); store[5] = record; del store[3]
+
+    python book_store.py booklist.db      #memory used by the books as tuples and in a BookStore
+
+FUNCTIONS:
+    column_kind(column)
+        Returns how a column is stored: "int", "dictionary" or "text"
+
+    fitted(values, low, high)
+        Returns the integer array, widened to a larger type code if low or high does not fit in it
+
+    measure_memory(path, batch_size = 10000)
+        Loads every book of a database as tuples and into a BookStore and returns the bytes each used
+"""
+
+COLUMN_KINDS = {
+    "id": "int",
+    "rating": "int",
+    "archived": "int",
+    "title": "text",
+}
+
+INT_TYPECODES = ("b", "h", "i", "q") #signed, narrowest first
+OFFSET_TYPECODES = ("H", "I", "Q") #unsigned, for text offsets and lengths
+
+def column_kind(column):
+    """Returns how a column is stored: "int", "dictionary" (the default) or "text" (see COLUMN_KINDS)"""
+
+    return COLUMN_KINDS.get(column, "dictionary")
+
+def fitted(values, low, high):
+    """Returns the integer array, widened to a larger type code if low or high does not fit in it.
+
+    Parameters:
+        values (array) - a signed ("b", "h", "i", "q") or unsigned ("H", "I", "Q") integer array
+        low, high (int) - smallest and largest value about to be stored
+
+    Raises OverflowError if no type code is wide enough
+    """
+
+    codes = INT_TYPECODES if values.typecode in INT_TYPECODES else OFFSET_TYPECODES
+    for code in codes[codes.index(values.typecode):]:
+        bits = 8 * array(code).itemsize
+        minimum, maximum = (-(1 << (bits - 1)), (1 << (bits - 1)) - 1) if code in INT_TYPECODES else (0, (1 << bits) - 1)
+        if minimum <= low and high <= maximum:
+            return values if code == values.typecode else array(code, values)
+    raise OverflowError("Value does not fit in a 64-bit integer")
+
+
+class ValueTable:
+    """The distinct values of a dictionary-encoded column; each value is stored once and rows hold its code.
+
+    METHODS:
+        __init__(self)
+            Creates an empty table
+
+        code(self, value)
+            Returns the code of a value, adding the value the first time it is seen
+
+        encode(self, values)
+            Returns the codes of a list of values
+    """
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        """Creates an empty table"""
+
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        """Returns the code of a value, adding the value the first time it is seen"""
+
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values):
+        """Returns the codes of a list of values, with one dictionary lookup each when every value has been seen before"""
+
+        codes = list(map(self.codes.get, values))
+        if None in codes:
+            codes = [self.code(value) for value in values]
+        return codes
+
+
+class TextColumn:
+    """Mostly distinct strings, stored as UTF-8 in one bytearray with the start and length of each row's text.
+
+    Rows are inserted, replaced and deleted by editing the offset arrays only; new text is appended to the end
+    of the bytearray. The text left behind by replaced and deleted rows is reclaimed once it is more than half
+    of the bytearray.
+
+    METHODS:
+        __init__(self)
+            Creates an empty column
+
+        get(self, row)
+            Returns the text of a row
+
+        encode(self, value)
+            Appends a value's text to the bytearray and returns its (start, length)
+
+        set(self, row, value)
+            Replaces the text of a row
+
+        insert(self, row, values)
+            Inserts the texts of several rows before the row index
+
+        extend(self, values)
+            Adds the texts of rows after the last row
+
+        delete(self, row)
+            Removes a row's text
+
+        compact(self)
+            Rewrites the bytearray without the text of replaced and deleted rows once that is more than half of it
+    """
+
+    __slots__ = ("data", "starts", "lengths", "garbage")
+
+    def __init__(self):
+        """Creates an empty column"""
+
+        self.data = bytearray()
+        self.starts = array("I")
+        self.lengths = array("H")
+        self.garbage = 0
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self, row):
+        """Returns the text of a row"""
+
+        start = self.starts[row]
+        return self.data[start:start + self.lengths[row]].decode("utf-8", "surrogatepass")
+
+    def encode(self, value):
+        """Appends a value's text to the bytearray and returns its (start, length), widening the offset arrays if needed"""
+
+        text = str(value).encode("utf-8", "surrogatepass")
+        start = len(self.data)
+        self.data += text
+        self.starts = fitted(self.starts, 0, start)
+        self.lengths = fitted(self.lengths, 0, len(text))
+        return start, len(text)
+
+    def set(self, row, value):
+        """Replaces the text of a row"""
+
+        self.garbage += self.lengths[row]
+        self.starts[row], self.lengths[row] = self.encode(value)
+        self.compact()
+
+    def insert(self, row, values):
+        """Inserts the texts of several rows before the row index; the offsets are moved once for all of them"""
+
+        offsets = [self.encode(value) for value in values]
+        self.starts[row:row] = array(self.starts.typecode, [start for start, length in offsets])
+        self.lengths[row:row] = array(self.lengths.typecode, [length for start, length in offsets])
+
+    def extend(self, values):
+        """Adds the texts of rows after the last row"""
+
+        texts = [str(value).encode("utf-8", "surrogatepass") for value in values]
+        if len(texts) == 0:
+            return
+        lengths = [len(text) for text in texts]
+        starts = list(accumulate(lengths[:-1], initial = len(self.data)))
+        self.data += b"".join(texts)
+        self.starts = fitted(self.starts, 0, starts[-1])
+        self.lengths = fitted(self.lengths, 0, max(lengths))
+        self.starts.extend(starts)
+        self.lengths.extend(lengths)
+
+    def delete(self, row):
+        """Removes a row's text"""
+
+        self.garbage += self.lengths[row]
+        del self.starts[row]
+        del self.lengths[row]
+        self.compact()
+
+    def compact(self):
+        """Rewrites the bytearray without the text of replaced and deleted rows once that is more than half of it"""
+
+        if self.garbage < 65536 or self.garbage * 2 < len(self.data):
+            return
+        data = bytearray()
+        starts = array("I")
+        for start, length in zip(self.starts, self.lengths):
+            starts = fitted(starts, 0, len(data))
+            starts.append(len(data))
+            data += self.data[start:start + length]
+        self.data = data
+        self.starts = starts
+        self.garbage = 0
+
+
+class BookStore:
+    """Rows of a table held column by column; indexing returns the row as a tuple, like the list it replaces.
+
+    METHODS:
+        __init__(self, columns)
+            Creates an empty store with one column array per column name
+
+        index(self, row)
+            Returns a row index as a non-negative int, raising IndexError if it is out of range
+
+        value(self, row, column)
+            Returns one value of a row without building the row's tuple
+
+        cell(self, row, column)
+            Returns one value of a row whose index has already been checked
+
+        insert(self, row, record)
+            Inserts a record before the row index, like list.insert()
+
+        insert_records(self, row, records)
+            Inserts records before the row index with one move of each column's later rows
+
+        append(self, record)
+            Adds a record after the last row
+
+        extend(self, records)
+            Adds records after the last row, a column at a time
+
+        prepend(self, records)
+            Adds records before the first row, keeping their order
+
+        find(self, column, value)
+            Returns the first row whose value in an integer column equals value, or None
+
+        memory_usage(self)
+            Returns the approximate number of bytes used by the columns and the distinct values
+    """
+
+    def __init__(self, columns):
+        """Creates an empty store with one column array per column name.
+
+        Parameters:
+            columns (tuple) - column names, in the order of the records; each is stored as column_kind() says
+        """
+
+        self.columns = tuple(columns)
+        self.kinds = tuple(column_kind(column) for column in self.columns)
+        self.arrays = []
+        self.tables = []
+        for kind in self.kinds:
+            self.arrays.append(TextColumn() if kind == "text" else array("b"))
+            self.tables.append(ValueTable() if kind == "dictionary" else None)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def index(self, row):
+        """Returns a row index as a non-negative int, raising IndexError if it is out of range"""
+
+        if row < 0:
+            row += self.count
+        if row < 0 or row >= self.count:
+            raise IndexError("BookStore index out of range")
+        return row
+
+    def value(self, row, column):
+        """Returns one value of a row without building the row's tuple.
+
+        Parameters:
+            row (int) - row index
+            column (int) - column index
+        """
+
+        return self.cell(self.index(row), column)
+
+    def cell(self, row, column):
+        """Returns one value of a row whose index has already been checked"""
+
+        kind = self.kinds[column]
+        if kind == "int":
+            return self.arrays[column][row]
+        if kind == "text":
+            return self.arrays[column].get(row)
+        return self.tables[column].values[self.arrays[column][row]]
+
+    def __getitem__(self, row):
+        row = self.index(row)
+        return tuple(self.cell(row, column) for column in range(len(self.columns)))
+
+    def __setitem__(self, row, record):
+        row = self.index(row)
+        for column, kind in enumerate(self.kinds):
+            if kind == "text":
+                self.arrays[column].set(row, record[column])
+                continue
+            value = record[column] if kind == "int" else self.tables[column].code(record[column])
+            self.arrays[column] = fitted(self.arrays[column], value, value)
+            self.arrays[column][row] = value
+
+    def __delitem__(self, row):
+        row = self.index(row)
+        for column, kind in enumerate(self.kinds):
+            if kind == "text":
+                self.arrays[column].delete(row)
+            else:
+                del self.arrays[column][row]
+        self.count -= 1
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self[row]
+
+    def insert(self, row, record):
+        """Inserts a record before the row index, like list.insert()"""
+
+        self.insert_records(max(0, min(row + self.count if row < 0 else row, self.count)), (record,))
+
+    def insert_records(self, row, records):
+        """Inserts records before the row index with one move of each column's later rows"""
+
+        records = list(records)
+        for column, kind in enumerate(self.kinds):
+            values = [record[column] for record in records]
+            if kind == "text":
+                self.arrays[column].insert(row, values)
+                continue
+            if kind == "dictionary":
+                values = self.tables[column].encode(values)
+            if values:
+                self.arrays[column] = fitted(self.arrays[column], min(values), max(values))
+            self.arrays[column][row:row] = array(self.arrays[column].typecode, values)
+        self.count += len(records)
+
+    def append(self, record):
+        """Adds a record after the last row"""
+
+        self.extend((record,))
+
+    def extend(self, records):
+        """Adds records after the last row, a column at a time"""
+
+        records = list(records)
+        for column, (kind, values) in enumerate(zip(self.kinds, zip(*records))):
+            values = list(values)
+            if kind == "dictionary":
+                values = self.tables[column].encode(values)
+            if kind != "text":
+                self.arrays[column] = fitted(self.arrays[column], min(values), max(values))
+            self.arrays[column].extend(values)
+        self.count += len(records)
+
+    def prepend(self, records):
+        """Adds records before the first row, keeping their order"""
+
+        self.insert_records(0, records)
+
+    def find(self, column, value):
+        """Returns the first row whose value in an integer column (such as id) equals value, or None.
+
+        The array is searched in C, a few milliseconds for a million rows.
+        """
+
+        try:
+            return self.arrays[column].index(value)
+        except (ValueError, OverflowError, TypeError):
+            return None
+
+    def memory_usage(self):
+        """Returns the approximate number of bytes used by the columns and the distinct values"""
+
+        size = sys.getsizeof(self)
+        for column, kind in enumerate(self.kinds):
+            values = self.arrays[column]
+            if kind == "text":
+                size += sys.getsizeof(values.data) + sys.getsizeof(values.starts) + sys.getsizeof(values.lengths)
+            else:
+                size += sys.getsizeof(values)
+            table = self.tables[column]
+            if table is not None:
+                size += sys.getsizeof(table.values) + sys.getsizeof(table.codes) + sum(sys.getsizeof(value) for value in table.values)
+        return size
+
+
+def measure_memory(path, batch_size = 10000):
+    """Loads every book of a database as tuples and into a BookStore and returns the bytes each used.
+
+    Counted with tracemalloc, so the figures are the Python allocations themselves rather than the process size.
+
+    Returns tuple of (books, bytes as a list of tuples, bytes in a BookStore)
+    """
+
+    import sqlite3, tracemalloc
+    columns = ("id", "title", "author", "rating", "genre", "series", "notes")
+    query = "SELECT " + ", ".join(columns) + " FROM books ORDER BY id"
+    conn = sqlite3.connect(path)
+    try:
+        tracemalloc.start()
+        rows = conn.execute(query).fetchall()
+        tuple_bytes = tracemalloc.get_traced_memory()[0]
+        books = len(rows)
+        del rows
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        store = BookStore(columns)
+        c = conn.execute(query)
+        while True:
+            batch = c.fetchmany(batch_size)
+            if len(batch) == 0:
+                break
+            store.extend(batch)
+        del batch
+        store_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        conn.close()
+    return books, tuple_bytes, store_bytes
+
+
+if __name__ == "__main__":
+    books, tuple_bytes, store_bytes = measure_memory(sys.argv[1] if len(sys.argv) > 1 else "booklist.db")
+    print("{0} books: {1:.1f} MB as tuples, {2:.1f} MB in a BookStore ({3:.1f}x smaller)".format(
+        books, tuple_bytes / 1e6, store_bytes / 1e6, tuple_bytes / max(store_bytes, 1)))
@@ -0,0 +1,542 @@
+from bisect import bisect_left
+from PyQt5 import QtCore
+from SqliteHelper import SqliteHelper, BULK_CHUNK
+from book_store import BookStore
+
+BOOK_COLUMNS = ("id", "title", "author", "rating", "genre", "series", "notes")
+BOOK_HEADERS = ("Id", "Title", "Author", "Rating", "Genre", "Series", "Notes")
+BOOK_SORT_COLUMNS = ("id", "title", "author", "rating", "genre", "series") #columns with an index; notes would be sorted for every page
+
+BULK_CHANGES = 256 #a larger batch of changes (e.g. a bulk edit) is patched inside one model reset instead of row by row
+RELOAD_CHANGES = 20000 #a batch this large is not read back record by record; the model reloads instead
+
+CALENDAR_COLUMNS = ("id", "date", "title", "author")
+CALENDAR_HEADERS = ("Id", "Date", "Title", "Author")
+
+
+class Descending:
+    """Wraps a sort value so that it compares in reverse, keeping the keys of a descending list in ascending order for bisect"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class SortKeys:
+    """The (order, id) keys of a model's loaded rows as a read-only sequence for bisect; each key is built when it is read"""
+
+    __slots__ = ("model",)
+
+    def __init__(self, model):
+        self.model = model
+
+    def __len__(self):
+        return len(self.model.rows)
+
+    def __getitem__(self, row):
+        return self.model.sort_key_at(row)
+
+
+class BooklistModel(QtCore.QAbstractTableModel):
+    """Table model that reads rows from a SQLite table lazily, one window at a time.
+
+    Only the rows the view has asked for are held in memory, column by column in a BookStore, so a list scrolled
+    through a million books takes about a sixth of the memory of the row tuples. Each window is read with a keyset
+    query (SqliteHelper.keyset_page(): rows after the last (order, id) pair already loaded), so fetching the
+    next window costs the same no matter how far down the list the user has scrolled.
+
+    Clicking a column heading calls sort(), which reloads the model in the new order; the sorting is done by
+    SQLite on the column's index, never in the view. jump_to_end() reads the last window straight away, and
+    fetch_previous() then reads the windows before it as the user scrolls back up.
+
+    Rows are kept sorted by their (order, id) key so that apply_changes() can find the position of an inserted,
+    updated or deleted record with a binary search and patch just that row instead of reloading the model.
+    A batch of more than BULK_CHANGES changes is patched the same way but reported to the view as one reset.
+    The keys are not stored; SortKeys reads them from the store as the search needs them.
+
+    Every read goes through the DatabaseWorker, so the GUI thread never waits for SQLite: fetchMore() queues
+    the next window and the rows are appended when the result arrives. Reloading or changing the filter
+    supersedes a window that is still being read.
+
+    METHODS:
+        __init__(self, worker, table, columns, headers, order = "id", where = "", parameters = (), window_size = 256, sort_columns = ("id",))
+            Stores the query details for the table; no rows are read until the view asks for them
+
+        rowCount(self, parent)
+            Returns the number of rows loaded so far
+
+        columnCount(self, parent)
+            Returns the number of columns shown by the model
+
+        data(self, index, role)
+            Returns the text for the cell at the given index
+
+        headerData(self, section, orientation, role)
+            Returns the column headings passed in by the caller
+
+        canFetchMore(self, parent)
+            Returns True until the last window of the query has been read, unless a window is already being read
+
+        fetchMore(self, parent)
+            Queues a read of the next window of rows from the database
+
+        append_window(self, window)
+            Appends a window of rows read by the worker to the model
+
+        sort(self, column, order)
+            Reloads the model sorted by the column, if it is one of the sortable columns
+
+        jump_to_end(self)
+            Drops the loaded rows and reads the last window of the list
+
+        can_fetch_previous(self)
+            Returns True if rows before the first loaded row have not been read yet
+
+        fetch_previous(self)
+            Queues a read of the window before the first loaded row
+
+        prepend_window(self, window)
+            Inserts a window of rows read by the worker before the loaded rows
+
+        set_query(self, where = "", parameters = ())
+            Replaces the filter for the model and reloads it
+
+        reload(self)
+            Drops the loaded rows and reads the first window again
+
+        clear(self)
+            Drops the loaded rows without reading from the database
+
+        row_id(self, row)
+            Returns the id of the record shown in the given row
+
+        row_data(self, row)
+            Returns the full record shown in the given row
+
+        find_row(self, row_id, record = None)
+            Returns the row of the loaded record with the given id, or None if it is not loaded
+
+        sort_key_at(self, row)
+            Returns the sort key of a loaded row, read from the store
+
+        build_records_queries(self, row_ids)
+            Builds the queries that read the given records, BULK_CHUNK ids each
+
+        read_records(helper, queries)
+            Runs the queries from build_records_queries() on the worker and returns all their records
+
+        apply_changes(self, changes)
+            Queues a read of the records affected by a list of RowChange events from SqliteHelper
+
+        patch_records(self, changes, records)
+            Patches the rows affected by the changes once their records have been read
+
+        patch_changes(self, changes, records)
+            Applies the changes to the loaded rows for patch_records()
+    """
+
+    rows_prepended = QtCore.pyqtSignal(int) #number of rows inserted above the loaded rows, so the view can keep its place
+
+    def __init__(self, worker, table, columns, headers, order = "id", where = "", parameters = (), window_size = 256, sort_columns = ("id",)):
+        """Stores the query details for the table; no rows are read until the view asks for them.
+
+        Parameters:
+            worker: reference to the DatabaseWorker that owns the sqlite connection
+            table (string) - name of the table to read
+            columns (tuple) - column names to select; the first one must be the id column
+            headers (tuple) - column headings shown in the view
+            order (string) - column the rows are sorted by (ties are broken by id)
+            where (string) - optional sqlite condition with parameterized statements
+            parameters (tuple) - items to be inserted into the parameterized condition
+            window_size (int) - number of rows read per fetch
+            sort_columns (tuple) - columns the user may sort by; each needs an index so a window is a seek
+        """
+
+        super(BooklistModel, self).__init__()
+        self.worker = worker
+        self.table = table
+        self.columns = tuple(columns)
+        self.headers = tuple(headers)
+        self.order = order
+        self.where = where
+        self.parameters = tuple(parameters)
+        self.window_size = window_size
+        self.sort_columns = tuple(sort_columns)
+        self.descending = False
+
+        self.rows = BookStore(self.columns)
+        self.keys = SortKeys(self)
+        self.exhausted = True
+        self.at_start = True #False after jump_to_end() until the first row of the list has been read
+        self.request = None #id of the window read that is waiting for the worker
+        self.generation = 0 #bumped on every reload so results read for older rows are dropped
+        self.notify_rows = True #False while patch_records() applies a bulk batch inside a model reset
+        self.order_index = self.columns.index(order)
+
+    def rowCount(self, parent = QtCore.QModelIndex()):
+        """Returns the number of rows loaded so far"""
+
+        if parent.isValid():
+            return 0
+        return len(self.rows)
+
+    def columnCount(self, parent = QtCore.QModelIndex()):
+        """Returns the number of columns shown by the model"""
+
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def data(self, index, role = QtCore.Qt.DisplayRole):
+        """Returns the text for the cell at the given index"""
+
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+            return None
+        return str(self.rows.value(index.row(), index.column()))
+
+    def headerData(self, section, orientation, role = QtCore.Qt.DisplayRole):
+        """Returns the column headings passed in by the caller"""
+
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
+
+    def canFetchMore(self, parent = QtCore.QModelIndex()):
+        """Returns True until the last window of the query has been read, unless a window is already being read"""
+
+        return not parent.isValid() and not self.exhausted and self.request is None
+
+    def fetchMore(self, parent = QtCore.QModelIndex()):
+        """Queues a read of the next window of rows from the database; append_window() adds the rows when they arrive"""
+
+        if parent.isValid() or self.exhausted or self.request is not None:
+            return
+
+        key = self.record_key(self.rows[-1]) if self.rows else None
+        self.request = self.worker.submit(SqliteHelper.keyset_page, self.table, self.columns, self.order, key, True, self.window_size,
+            self.where, self.parameters, self.descending, callback = self.append_window, key = self)
+
+    def append_window(self, window):
+        """Appends a window of rows read by the worker to the model.
+
+        Parameters:
+            window (list of tuples) - rows that follow the last loaded row, in (order, id) order
+        """
+
+        self.request = None
+        if len(window) < self.window_size:
+            self.exhausted = True
+
+        if len(window) > 0:
+            first = len(self.rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(window) - 1)
+            self.rows.extend(window)
+            self.endInsertRows()
+
+    def sort(self, column, order = QtCore.Qt.AscendingOrder):
+        """Reloads the model sorted by the column, if it is one of the sortable columns.
+
+        Called by the view when the user clicks a column heading (with sorting enabled on the view).
+
+        Parameters:
+            column (int) - index of the column in the model
+            order (Qt.SortOrder) - Qt.AscendingOrder or Qt.DescendingOrder
+        """
+
+        name = self.columns[column]
+        descending = order == QtCore.Qt.DescendingOrder
+        if name not in self.sort_columns or (name == self.order and descending == self.descending):
+            return
+
+        self.order = name
+        self.order_index = column
+        self.descending = descending
+        self.reload()
+
+    def jump_to_end(self):
+        """Drops the loaded rows and reads the last window of the list, walking the sort index from its far end"""
+
+        self.cancel_request()
+        self.beginResetModel()
+        self.rows = BookStore(self.columns)
+        self.exhausted = True
+        self.at_start = False
+        self.endResetModel()
+        self.fetch_previous()
+
+    def can_fetch_previous(self):
+        """Returns True if rows before the first loaded row have not been read yet, unless a window is already being read"""
+
+        return not self.at_start and self.request is None
+
+    def fetch_previous(self):
+        """Queues a read of the window before the first loaded row; prepend_window() adds the rows when they arrive"""
+
+        if self.at_start or self.request is not None:
+            return
+
+        key = self.record_key(self.rows[0]) if self.rows else None
+        self.request = self.worker.submit(SqliteHelper.keyset_page, self.table, self.columns, self.order, key, False, self.window_size,
+            self.where, self.parameters, self.descending, callback = self.prepend_window, key = self)
+
+    def prepend_window(self, window):
+        """Inserts a window of rows read by the worker before the loaded rows and emits rows_prepended.
+
+        Parameters:
+            window (list of tuples) - rows that come before the first loaded row, in display order
+        """
+
+        self.request = None
+        if len(window) < self.window_size:
+            self.at_start = True
+
+        if len(window) > 0:
+            self.beginInsertRows(QtCore.QModelIndex(), 0, len(window) - 1)
+            self.rows.prepend(window)
+            self.endInsertRows()
+            self.rows_prepended.emit(len(window))
+
+    def set_query(self, where = "", parameters = ()):
+        """Replaces the filter for the model and reloads it.
+
+        Parameters:
+            where (string) - sqlite condition with parameterized statements
+            parameters (tuple) - items to be inserted into the parameterized condition
+        """
+
+        self.where = where
+        self.parameters = tuple(parameters)
+        self.reload()
+
+    def reload(self):
+        """Drops the loaded rows and reads the first window again"""
+
+        self.cancel_request()
+        self.beginResetModel()
+        self.rows = BookStore(self.columns)
+        self.exhausted = False
+        self.at_start = True
+        self.endResetModel()
+        self.fetchMore()
+
+    def clear(self):
+        """Drops the loaded rows without reading from the database"""
+
+        self.cancel_request()
+        self.beginResetModel()
+        self.rows = BookStore(self.columns)
+        self.exhausted = True
+        self.at_start = True
+        self.endResetModel()
+
+    def cancel_request(self):
+        """Cancels the window read that is waiting for the worker and drops patches read for the current rows"""
+
+        if self.request is not None:
+            self.worker.cancel(self.request)
+            self.request = None
+        self.generation += 1
+
+    def row_id(self, row):
+        """Returns the id of the record shown in the given row (None if the row does not exist)"""
+
+        if row < 0 or row >= len(self.rows):
+            return None
+        return self.rows.value(row, 0)
+
+    def row_data(self, row):
+        """Returns the full record shown in the given row (None if the row does not exist)"""
+
+        if row < 0 or row >= len(self.rows):
+            return None
+        return self.rows[row]
+
+    def find_row(self, row_id, record = None):
+        """Returns the row of the loaded record with the given id, or None if it is not loaded.
+
+        The row is found with a binary search when its sort key is known: always in id order, and from the record's
+        current values when an update did not change the sort column. Otherwise the id column is scanned, which
+        runs in C and takes a few milliseconds even with a million rows loaded.
+
+        Parameters:
+            row_id (int) - id of the record
+            record (tuple) - the record's current values, if its sort value is known not to have changed
+        """
+
+        if record is None and self.order_index != 0:
+            return self.rows.find(0, row_id)
+
+        row = bisect_left(self.keys, self.sort_key(record if record is not None else (row_id,)))
+        if row < len(self.rows) and self.rows.cell(row, 0) == row_id:
+            return row
+        return None
+
+    def sort_key_at(self, row):
+        """Returns the sort key of a loaded row, read from the store"""
+
+        if self.descending:
+            return (Descending(self.rows.cell(row, self.order_index)), Descending(self.rows.cell(row, 0)))
+        return (self.rows.cell(row, self.order_index), self.rows.cell(row, 0))
+
+    def record_key(self, record):
+        """Returns the (order, id) values of the record, as passed to SqliteHelper.keyset_page()"""
+
+        return (record[self.order_index], record[0])
+
+    def sort_key(self, record):
+        """Returns the key the record is kept in order by; wrapped in Descending when the list is sorted largest first"""
+
+        if self.descending:
+            return (Descending(record[self.order_index]), Descending(record[0]))
+        return (record[self.order_index], record[0])
+
+    def build_records_queries(self, row_ids):
+        """Builds the queries that read the given records, limited to the ones that match the model's filter.
+
+        Each query binds at most BULK_CHUNK ids, so a batch of up to RELOAD_CHANGES changes stays well under
+        SQLite's limit on bound parameters.
+
+        Returns
+            list of (query string, parameters tuple) tuples
+        """
+
+        queries = []
+        for first in range(0, len(row_ids), BULK_CHUNK):
+            chunk = tuple(row_ids[first:first + BULK_CHUNK])
+            query = "SELECT " + ", ".join(self.columns) + " FROM " + self.table + " WHERE id IN (" + ", ".join("?" * len(chunk)) + ")"
+            if self.where:
+                query += " AND (" + self.where + ")"
+            queries.append((query, chunk + self.parameters))
+        return queries
+
+    @staticmethod
+    def read_records(helper, queries):
+        """Runs the queries from build_records_queries() on the worker and returns all their records"""
+
+        records = []
+        for query, parameters in queries:
+            records.extend(helper.sort_items(query, parameters))
+        return records
+
+    def remove_record(self, row_id):
+        """Removes the loaded record with the given id from the model (does nothing if it is not loaded)"""
+
+        row = self.find_row(row_id)
+        if row is None:
+            return
+
+        if self.notify_rows:
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        del self.rows[row]
+        if self.notify_rows:
+            self.endRemoveRows()
+
+    def place_record(self, record):
+        """Inserts the record at its sorted position if that position is inside the loaded rows.
+
+        Records that sort after the last loaded row are skipped while more windows remain, because
+        fetchMore() will read them in order when the user scrolls that far; the same goes for records
+        before the first loaded row after jump_to_end().
+        """
+
+        key = self.sort_key(record)
+        row = bisect_left(self.keys, key)
+        if row == len(self.rows) and not self.exhausted:
+            return
+        if row == 0 and not self.at_start and len(self.rows) > 0:
+            return
+
+        if self.notify_rows:
+            self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.rows.insert(row, record)
+        if self.notify_rows:
+            self.endInsertRows()
+
+    def apply_changes(self, changes):
+        """Queues a read of the records affected by a list of RowChange events from SqliteHelper.
+
+        The inserted and updated records are read with primary-key queries in one worker request and patched in by patch_records().
+        The worker runs requests in order, so the records read reflect every write reported before them.
+
+        Parameters:
+            changes (list of RowChange) - changes reported by SqliteHelper after a commit
+        """
+
+        changes = [change for change in changes if change.table == self.table]
+        if len(changes) == 0:
+            return
+
+        if len(changes) > RELOAD_CHANGES or any(change.operation == "reload" for change in changes):
+            self.reload()
+            return
+
+        row_ids = sorted(set(change.row_id for change in changes if change.operation != "delete"))
+        if len(row_ids) == 0:
+            self.patch_records(changes, [])
+            return
+
+        generation = self.generation
+        def patch(records):
+            if generation == self.generation:
+                self.patch_records(changes, records)
+
+        self.worker.submit(BooklistModel.read_records, self.build_records_queries(row_ids), callback = patch)
+
+    def patch_records(self, changes, records):
+        """Patches the rows affected by the changes once their records have been read.
+
+        Each change costs a binary search over the loaded rows, so a single edit takes the same time
+        regardless of how many books are in the library. More than BULK_CHANGES changes are applied inside
+        one beginResetModel()/endResetModel() pair, so the view is updated once instead of once per row. Only an update that moves a record (one that
+        changed the sort column) or a delete in a list not sorted by id also scans the id column.
+
+        Parameters:
+            changes (list of RowChange) - changes for this model's table
+            records (list of tuples) - current records for the inserted and updated ids that match the filter
+        """
+
+        bulk = len(changes) > BULK_CHANGES
+        if bulk:
+            self.beginResetModel()
+            self.notify_rows = False
+        try:
+            self.patch_changes(changes, records)
+        finally:
+            if bulk:
+                self.notify_rows = True
+                self.endResetModel()
+
+    def patch_changes(self, changes, records):
+        """Applies the changes to the loaded rows for patch_records(); see there for the parameters"""
+
+        records = dict((record[0], record) for record in records)
+        order = self.columns[self.order_index]
+        for change in changes:
+            if change.operation == "delete":
+                self.remove_record(change.row_id)
+                continue
+
+            record = records.get(change.row_id)
+            if record is not None and change.operation == "update" and order not in change.columns:
+                row = self.find_row(change.row_id, record)
+                if row is not None:
+                    self.rows[row] = record
+                    if self.notify_rows:
+                        self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+                else:
+                    self.place_record(record) #it did not match the filter before this update
+                continue
+
+            if change.operation != "insert":
+                self.remove_record(change.row_id)
+            if record is not None:
+                self.place_record(record)
@@ -0,0 +1,86 @@
+from PyQt5 import QtWidgets
+from PyQt5.QtCore import Qt
+from SqliteHelper import SqliteHelper
+from ui_cache import load_ui
+from shared import *
+
+class BulkEditBooks(QtWidgets.QDialog):
+    """Sets the rating, genre, series or notes of every selected book at once.
+
+    Only the details whose check box is ticked are changed; typing in a field ticks its box. All the books are
+    written with one parameterized executemany in a single transaction (SqliteHelper.update_books()), so the
+    main window is patched once and one Undo puts every book back.
+
+    METHODS:
+        __init__(self, window, worker)
+            Loads the bulk_edit form: a check box and an input for each detail that can be set on several books
+
+        edit_books(self, book_ids)
+            Opens the form for the selected books and queues one update for all of them when the user clicks OK
+
+        values(self)
+            Returns the cleaned details whose check box is ticked, as a {column: value} dictionary
+    """
+
+    def __init__(self, window, worker):
+        """Loads the bulk_edit form: a check box and an input for each detail that can be set on several books
+
+        Parameters:
+            window: reference to the main screen created by MainWindow class
+            worker: reference to the DatabaseWorker that owns the sqlite connection
+        """
+
+        super(BulkEditBooks, self).__init__(window)
+        self.window = window
+        self.worker = worker
+        load_ui("bulk_edit.ui", self)
+        self.setWindowFlags(self.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+
+        self.checks = {"rating": self.check_rating, "genre": self.check_genre, "series": self.check_series, "notes": self.check_notes}
+        self.rating.valueChanged.connect(lambda value: self.check_rating.setChecked(True))
+        for column in ("genre", "series", "notes"):
+            getattr(self, column).textEdited.connect(lambda text, check = self.checks[column]: check.setChecked(True))
+
+        self.buttonBox.accepted.connect(self.accept)
+        self.buttonBox.rejected.connect(self.reject)
+
+    def edit_books(self, book_ids):
+        """Opens the form for the selected books and queues one update for all of them when the user clicks OK.
+
+        The window's add_undo() receives the BookSnapshot of the books as they were.
+
+        Parameters:
+            book_ids (list of ints) - ids of the selected books
+        """
+
+        self.heading.setText("Set these details on the %d selected books:" % len(book_ids))
+        for check in self.checks.values():
+            check.setChecked(False)
+        self.rating.blockSignals(True) #resetting the fields must not tick their boxes
+        self.rating.setValue(0)
+        self.rating.blockSignals(False)
+        for field in (self.genre, self.series, self.notes):
+            field.setText("")
+
+        if self.exec_() != QtWidgets.QDialog.Accepted:
+            return
+
+        values = self.values()
+        if len(values) == 0:
+            show_message("Error", "Tick at least one detail to change")
+            return
+        self.worker.submit(SqliteHelper.update_books, book_ids, values, callback = self.window.add_undo) #main window is patched by the change listener
+
+    def values(self):
+        """Returns the cleaned details whose check box is ticked, as a {column: value} dictionary.
+
+        Genre and series get the same clean-up as in the Update Book form.
+        """
+
+        values = {
+            "rating": self.rating.value(),
+            "genre": remove_punctuation(self.genre.text().title()),
+            "series": remove_punctuation(self.series.text().title()),
+            "notes": self.notes.text(),
+        }
+        return dict((column, value) for column, value in values.items() if self.checks[column].isChecked())
@@ -0,0 +1,206 @@
+import queue, threading
+from PyQt5 import QtCore
+from SqliteHelper import SqliteHelper
+
+
+class DatabaseWorker(QtCore.QThread):
+    """Background thread that owns the SQLite connection and runs queued database requests one at a time.
+
+    The GUI thread never touches the connection. It submits a function with submit(); the function is called
+    on the worker thread as function(helper, *args) and its result is handed to the callback on the GUI thread
+    through a queued signal. Any SqliteHelper method can be submitted directly, e.g.
+    worker.submit(SqliteHelper.update, query, values).
+
+    Requests run in the order they were submitted, so a read submitted after a write always sees it.
+    A request submitted with a key supersedes the earlier request with the same key: if the earlier one is
+    still queued it is skipped, and if it is already running its statement is interrupted. Only reads
+    should be given a key, since an interrupted write is rolled back.
+
+    Change events from SqliteHelper are re-emitted on the GUI thread through the changes_ready signal.
+
+    SIGNALS:
+        changes_ready(list of RowChange)
+            Emitted after every committed write, delivered on the GUI thread
+
+    METHODS:
+        __init__(self, name)
+            Stores the database name; the connection is opened by the worker thread once start() is called
+
+        start(self)
+            Starts the worker thread and waits until its connection is open
+
+        run(self)
+            Opens the connection and runs queued requests until stop() is called
+
+        submit(self, function, *args, callback = None, error = None, key = None)
+            Queues a request and returns its id
+
+        cancel(self, request_id)
+            Drops a queued request, or interrupts it if it is running; its callback is never called
+
+        finish(self, request_id)
+            Removes a request that has run and returns its callbacks, or None if it was cancelled
+
+        deliver(self, request_id, result)
+            Hands a finished request's result to its callback on the GUI thread
+
+        report_failure(self, request_id, exception)
+            Hands a failed request's exception to its error callback on the GUI thread
+
+        stop(self)
+            Lets the queued requests finish, closes the connection and ends the thread
+    """
+
+    changes_ready = QtCore.pyqtSignal(object)
+    request_finished = QtCore.pyqtSignal(int, object)
+    request_failed = QtCore.pyqtSignal(int, object)
+
+    def __init__(self, name):
+        """Stores the database name; the connection is opened by the worker thread once start() is called.
+
+        Parameters:
+            name (string) - database file name passed to SqliteHelper
+        """
+
+        super(DatabaseWorker, self).__init__()
+        self.name = name
+        self.helper = None
+        self.connection = None #the worker thread's connection, kept so other threads can interrupt it
+        self.requests = queue.Queue()
+        self.lock = threading.RLock()
+        self.opened = threading.Event()
+        self.last_id = 0
+        self.running = None
+        self.callbacks = {} #request id: (callback, error, key) for every request that has not been delivered or cancelled
+        self.latest = {} #key: id of the newest request submitted with that key
+
+        self.request_finished.connect(self.deliver)
+        self.request_failed.connect(self.report_failure)
+
+    def start(self):
+        """Starts the worker thread and waits until its connection is open"""
+
+        super(DatabaseWorker, self).start()
+        self.opened.wait()
+
+    def run(self):
+        """Opens the connection and runs queued requests until stop() is called.
+
+        sqlite3 connections may only be used by the thread that opened them, so the helper is created here.
+        """
+
+        self.helper = SqliteHelper(self.name)
+        self.connection = self.helper.conn
+        self.helper.add_listener(self.changes_ready.emit)
+        self.opened.set()
+
+        while True:
+            request_id, function, args = self.requests.get()
+            if request_id is None:
+                break
+
+            with self.lock:
+                if request_id not in self.callbacks:
+                    continue #cancelled or superseded while queued
+                self.running = request_id
+
+            try:
+                result = function(self.helper, *args)
+                failure = None
+            except Exception as e:
+                failure = e
+                if self.helper.conn.in_transaction:
+                    self.helper.conn.rollback()
+
+            with self.lock:
+                self.running = None
+
+            if failure is None:
+                self.request_finished.emit(request_id, result)
+            else:
+                self.request_failed.emit(request_id, failure)
+
+        self.helper.close()
+
+    def submit(self, function, *args, callback = None, error = None, key = None):
+        """Queues a request and returns its id.
+
+        Parameters:
+            function (callable) - called on the worker thread as function(helper, *args)
+            args - extra arguments passed to the function
+            callback (callable) - called on the GUI thread with the function's result
+            error (callable) - called on the GUI thread with the exception if the function raises;
+                               by default the error is printed
+            key (hashable) - requests with the same key supersede each other (reads only)
+
+        Returns int id that can be passed to cancel()
+        """
+
+        with self.lock:
+            self.last_id += 1
+            request_id = self.last_id
+
+            if key is not None:
+                previous = self.latest.get(key)
+                if previous is not None:
+                    self.cancel(previous)
+                self.latest[key] = request_id
+
+            self.callbacks[request_id] = (callback, error, key)
+
+        self.requests.put((request_id, function, args))
+        return request_id
+
+    def cancel(self, request_id):
+        """Drops a queued request, or interrupts it if it is running; its callback is never called.
+
+        Parameters:
+            request_id (int) - id returned by submit(); ids that already finished are ignored
+        """
+
+        with self.lock:
+            entry = self.callbacks.pop(request_id, None)
+            if entry is None:
+                return
+
+            key = entry[2]
+            if key is not None and self.latest.get(key) == request_id:
+                del self.latest[key]
+
+            if key is not None and self.running == request_id:
+                self.connection.interrupt()
+
+    def finish(self, request_id):
+        """Removes a request that has run and returns its (callback, error, key) entry, or None if it was cancelled"""
+
+        with self.lock:
+            entry = self.callbacks.pop(request_id, None)
+            if entry is not None and entry[2] is not None and self.latest.get(entry[2]) == request_id:
+                del self.latest[entry[2]]
+            return entry
+
+    def deliver(self, request_id, result):
+        """Hands a finished request's result to its callback on the GUI thread"""
+
+        entry = self.finish(request_id)
+        if entry is not None and entry[0] is not None:
+            entry[0](result)
+
+    def report_failure(self, request_id, exception):
+        """Hands a failed request's exception to its error callback on the GUI thread"""
+
+        entry = self.finish(request_id)
+        if entry is None:
+            return #a superseded read that was interrupted
+
+        if entry[1] is not None:
+            entry[1](exception)
+        else:
+            print("Database request failed: " + str(exception))
+
+    def stop(self):
+        """Lets the queued requests finish, closes the connection and ends the thread"""
+
+        if self.isRunning():
+            self.requests.put((None, None, None))
+            self.wait()
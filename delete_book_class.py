@@ -1,55 +1,63 @@
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtWidgets import *
+from SqliteHelper import SqliteHelper
+from ui_cache import load_ui
 from shared import *
 
 class DeleteBook(QtWidgets.QDialog):
-    """Deletes the selected book in the booklist table.
+    """Deletes the selected books in the booklist table.
+
+    Any number of books can be selected; they are deleted with one parameterized executemany in a single
+    transaction (SqliteHelper.delete_books()), and the snapshot it returns lets the main window undo the delete.
     
     METHODS: 
-        __init__(self, window, helper)
-            Loads the dialog window to confirm user's request to delete the selected book
+        __init__(self, window, worker)
+            Loads the dialog window to confirm user's request to delete the selected books
         
         confirm_ok(self)
-            Attempts to get the selected book id and opens dialog winodw for user to confirm deletion
+            Attempts to get the selected book ids and opens dialog winodw for user to confirm deletion
         
         delete_book(self)
-            Called by confirm_ok() when user clicks the OK button, this method sends a SQLite query to delete the book from the database
+            Called by confirm_ok() when user clicks the OK button, this method queues one SQLite request to delete the books from the database
     """
 
-    def __init__(self, window, helper):
-        """Loads the dialog window to confirm user's request to delete the selected book
+    def __init__(self, window, worker):
+        """Loads the dialog window to confirm user's request to delete the selected books
         
         Parameters: 
             window: reference to the main screen created by MainWindow class
-            helper: reference to the sqlite object created by SqliteHelper class
+            worker: reference to the DatabaseWorker that owns the sqlite connection
         """
         super(DeleteBook, self).__init__()
-        uic.loadUi("dialog_confirm.ui", self)
+        load_ui("dialog_confirm.ui", self)
         self.window = window
-        self.helper = helper
-        self.confirm = uic.loadUi("dialog_confirm.ui")
+        self.worker = worker
+        self.confirm = self #the form is loaded once, onto this dialog
+        self.confirm.OK_button.clicked.connect(self.delete_book)
+        self.confirm.Cancel_button.clicked.connect(self.confirm.close)
+        self.booksToDelete = []
     
     def delete_book(self):
-        """Sends a SQLite query to delete the book from the database.
-        Called by confirm_ok() when user clicks the OK button
+        """Queues one SQLite request to delete the books from the database.
+        Called by confirm_ok() when user clicks the OK button; the window's add_undo() receives the deleted books
         """
         
-        self.bookToDelete = self.window.getBookId()
-        self.helper.delete("DELETE FROM books WHERE id=" + self.bookToDelete)
+        self.worker.submit(SqliteHelper.delete_books, self.booksToDelete, callback = self.window.add_undo)
 
     def confirm_ok(self):  
-        """Attempts to get the selected book id and opens dialog winodw for user to confirm deletion
+        """Attempts to get the selected book ids and opens dialog winodw for user to confirm deletion
 
             Raises AttributeError if no book is selected
                 Please select a book
         """
 
         try:
-            self.confirm.OK_button.clicked.connect(self.delete_book)
-            self.confirm.Cancel_button.clicked.connect(self.confirm.close)
-            self.bookToDelete = self.window.getBookId()       
-            self.confirm.exec_()
-            self.window.refresh_data()
+            self.booksToDelete = self.window.getBookIds()
+            if len(self.booksToDelete) == 1:
+                self.confirm.label.setText("Are you sure?")
+            else:
+                self.confirm.label.setText("Delete %d books - are you sure?" % len(self.booksToDelete))
+            self.confirm.exec_() #main window is patched by the change listener
         except AttributeError:
             show_message("Error", "Please select a book")
             self.window.refresh_data()
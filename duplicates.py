@@ -0,0 +1,450 @@
+import random, zlib
+from normalize import normalize_key
+
+"""Near-duplicate detection for books (typos, subtitles, "Stephen King" vs "King, Stephen").
+
+Every book gets a few locality-sensitive hash buckets, stored in the book_signatures table:
+    bands 0-3 - MinHash of the character trigrams of the title, two hash values per band, together with the
+                (sorted) author, so books by the same author whose titles share most of their trigrams land
+                in the same bucket in at least one band
+    band 4    - first title word plus the author, and band 5 - last title word plus the author, which catch
+                typos in short titles where one changed letter is a large part of the trigrams
+    band 6    - main title (without its subtitle) plus the author, which catches "It" vs "It: A Novel"
+    band 7    - the whole title with the alphabetically first word of the author, and band 8 - with the last word,
+                so the same book entered as "Steven King" or "Stephen E King" shares a bucket as long as one
+                word of the name is unchanged
+    band 9    - for a one-word title only: the title and every copy of it with one letter left out, each with the
+                author. A title one typing mistake away shares one of these ("shining" and "shinning" both give
+                "shinin"); the bands above cannot be relied on there, since a word band holds the whole title and
+                one changed letter alters a large part of the few trigrams of a short word
+
+The main title is taken from the title as it was typed, because the forms and the importer remove the
+":", "(" and " - " that mark a subtitle before the book is saved. Books indexed from the saved title
+(rebuild(), the upgrade and Undo) only have the whole title as their main title.
+
+Looking up a book reads at most MAX_BUCKET_SIZE rows from each of its buckets through the (band, bucket)
+index, so the cost does not grow with the size of the library. Candidates from the buckets are then checked
+by score(): the authors must be the same apart from a typo or a missing middle name, and the titles must
+be the same apart from a typo or have the same main title.
+
+FUNCTIONS:
+    title_key(title)
+        Returns the normalized title with a leading article removed
+
+    author_key(author)
+        Returns the normalized author with the name words sorted, so word order does not matter
+
+    main_title(title)
+        Returns the title key without its subtitle
+
+    within_edits(a, b, limit)
+        Returns True if one string can be turned into the other with at most limit typing mistakes
+
+    same_author(a, b)
+        Returns True if two author keys are the same person
+
+    deletion_rows(book_id, title, author)
+        Returns the DELETION_BAND rows for a book whose title key is a single word; [] for a longer title
+
+    signature_rows(book_id, title, author)
+        Returns the (book_id, band, bucket) rows stored for a book
+
+    book_features(title, author)
+        Returns the precomputed comparison data for a book, used by score()
+
+    saved_features(title_norm, author_norm)
+        Returns book_features() for a saved book from its stored keys
+
+    score(features_a, features_b, same_main_title = False)
+        Returns a score between 0 and 1, or 0 if the two books should not be treated as duplicates
+
+    similarity(title_a, author_a, title_b, author_b)
+        Returns score() for two books given as text
+"""
+
+BANDS = 4
+ROWS_PER_BAND = 2
+FIRST_WORD_BAND = BANDS
+LAST_WORD_BAND = BANDS + 1
+MAIN_TITLE_BAND = BANDS + 2
+TITLE_BAND = BANDS + 3 #and TITLE_BAND + 1
+DELETION_BAND = BANDS + 5
+ARTICLES = ("the ", "a ", "an ")
+SUBTITLE_SEPARATORS = (":", "(", " - ", ";")
+MASK = (1 << 63) - 1
+SEEDS = random.Random(20231).sample(range(1, 1 << 32), BANDS * ROWS_PER_BAND)
+
+TITLE_FLOOR = 0.6 #title part of the score for titles that only match through a typo or a subtitle
+TYPO_LENGTH = 30 #titles may differ by one typing mistake, plus one more for every TYPO_LENGTH characters
+MAX_BUCKET_SIZE = 100 #larger buckets hold common words, not duplicates; lookups read at most this many rows per bucket
+CLUSTER_BUCKET_SIZE = 20 #the cluster report compares the books in a bucket with each other, so it skips buckets above this size
+
+SIGNATURE_INSERT = "INSERT INTO book_signatures (book_id, band, bucket) VALUES (?, ?, ?)"
+
+def without_article(key):
+    """Returns a normalized title with a leading article removed"""
+
+    for article in ARTICLES:
+        if key.startswith(article) and len(key) > len(article):
+            return key[len(article):]
+    return key
+
+def title_key(title):
+    """Returns the normalized title with a leading article removed"""
+
+    return without_article(normalize_key(title))
+
+def author_key(author):
+    """Returns the normalized author with the name words sorted, so word order does not matter"""
+
+    return " ".join(sorted(normalize_key(author).split()))
+
+def trigrams(key):
+    """Returns the set of character trigrams in a key, padded with spaces so short words still have some"""
+
+    padded = " " + key + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bucket_hash(text):
+    """Returns a stable 63-bit bucket number for a string"""
+
+    data = text.encode("utf-8")
+    return ((zlib.crc32(data) << 31) ^ zlib.adler32(data)) & MASK
+
+def main_title(title):
+    """Returns the title key without its subtitle ("It: A Novel" gives "it")"""
+
+    title = str(title)
+    for separator in SUBTITLE_SEPARATORS:
+        position = title.find(separator)
+        if position > 0:
+            title = title[:position]
+    return title_key(title)
+
+def deletion_rows(book_id, title, author):
+    """Returns the DELETION_BAND rows for a book whose title key is a single word; [] for a longer title.
+
+    Two words one typing mistake apart always share a key from {word} plus the word with each letter left
+    out in turn: a changed letter or two swapped neighbours disappear when that position is left out of both,
+    and an added letter when it is left out of the longer word. score() then checks the candidates.
+
+    Parameters:
+        book_id (int) - id of the book (None for a lookup)
+        title (string) - title as typed or as saved
+        author (string) - author of the book
+    """
+
+    title = title_key(title)
+    if len(title.split()) != 1:
+        return []
+    author = author_key(author)
+    variants = set([title] + [title[:i] + title[i + 1:] for i in range(len(title))])
+    return [(book_id, DELETION_BAND, bucket_hash(variant + "|" + author)) for variant in sorted(variants)]
+
+def signature_rows(book_id, title, author):
+    """Returns the (book_id, band, bucket) rows stored for a book.
+
+    Parameters:
+        book_id (int) - id of the book (None for a lookup)
+        title (string) - title as typed, so the subtitle can be found; a saved title works too, with the whole title as its main title
+        author (string) - author of the book
+    """
+
+    rows = deletion_rows(book_id, title, author)
+    main = main_title(title)
+    title = title_key(title)
+    author = author_key(author)
+
+    hashes = [zlib.crc32(gram.encode("utf-8")) for gram in trigrams(title)]
+    minimums = [min(value ^ seed for value in hashes) for seed in SEEDS]
+
+    for band in range(BANDS):
+        values = minimums[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        rows.append((book_id, band, bucket_hash(" ".join(str(value) for value in values) + "|" + author)))
+
+    words = title.split() or [""]
+    rows.append((book_id, FIRST_WORD_BAND, bucket_hash(words[0] + "|" + author)))
+    rows.append((book_id, LAST_WORD_BAND, bucket_hash(words[-1] + "|" + author)))
+    rows.append((book_id, MAIN_TITLE_BAND, bucket_hash(main + "|" + author)))
+    names = author.split() or [""]
+    rows.append((book_id, TITLE_BAND, bucket_hash(title + "|" + names[0])))
+    rows.append((book_id, TITLE_BAND + 1, bucket_hash(title + "|" + names[-1])))
+    return rows
+
+def jaccard(a, b):
+    """Returns the Jaccard similarity of two sets"""
+
+    if not a or not b:
+        return 0.0
+    common = len(a & b)
+    return common / (len(a) + len(b) - common)
+
+def within_edits(a, b, limit):
+    """Returns True if one string can be turned into the other with at most limit typing mistakes.
+
+    A mistake is one character added, left out or changed, or two neighbouring characters swapped
+    ("Misery" vs "Misrey"). The common start and end are skipped, so only the part that differs is compared.
+    """
+
+    if abs(len(a) - len(b)) > limit:
+        return False
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a = a[start:len(a) - end]
+    b = b[start:len(b) - end]
+    if len(a) == 0 or len(b) == 0:
+        return max(len(a), len(b)) <= limit
+    if limit == 1 and max(len(a), len(b)) > 2: #one mistake changes at most two neighbouring characters
+        return False
+
+    row = list(range(len(b) + 1))
+    before = row #the row two above, for a swap of neighbouring characters; only read from the third row on
+    for i in range(1, len(a) + 1):
+        previous, row = row, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            row[j] = min(previous[j] + 1, row[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                row[j] = min(row[j], before[j - 2] + 1)
+        if min(row) > limit:
+            return False
+        before = previous
+    return row[-1] <= limit
+
+def same_author(a, b):
+    """Returns True if two author keys are the same person: equal apart from typing mistakes, or one name is the
+    other with a middle name or initial left out ("Stephen King" vs "Stephen E King"). Two different initials
+    are two different people ("Sarah A Sanderson" vs "Sarah G Sanderson"), not a typing mistake.
+    """
+
+    if a == b:
+        return True
+    words_a, words_b = set(a.split()), set(b.split())
+    initials_a = set(word for word in words_a if len(word) == 1)
+    initials_b = set(word for word in words_b if len(word) == 1)
+    if initials_a and initials_b and initials_a != initials_b:
+        return False
+    if within_edits(a, b, 1 + max(len(a), len(b)) // TYPO_LENGTH):
+        return True
+    return min(len(words_a), len(words_b)) >= 2 and (words_a <= words_b or words_b <= words_a)
+
+def book_features(title, author):
+    """Returns the precomputed comparison data for a book, used by score().
+
+    Returns tuple of (title key, main title key, author key)
+    """
+
+    return (title_key(title), main_title(title), author_key(author))
+
+def saved_features(title_norm, author_norm):
+    """Returns book_features() for a saved book from its stored title_norm and author_norm keys, without normalizing
+    the text again (a saved title has no subtitle punctuation, so its main title is the whole title)
+    """
+
+    title = without_article(title_norm)
+    return (title, title, " ".join(sorted(author_norm.split())))
+
+def score(features_a, features_b, same_main_title = False):
+    """Returns a score between 0 and 1, or 0 if the two books should not be treated as duplicates.
+
+    Authors must be the same apart from typing mistakes or a missing middle name, once the name words are
+    sorted (see same_author()). Titles must be the same apart from typing mistakes (see within_edits()), or
+    have the same main title once a subtitle after ":", "(", " - " or ";" is removed. Sharing most of their
+    trigrams is not enough: "Children of the Moon" and "Children of the Thorn" are different books, and so are
+    "James C Jones" and "James C Johnson". The score itself is the trigram similarity of the two.
+
+    Parameters:
+        features_a, features_b (tuple) - values returned by book_features()
+        same_main_title (bool) - True if the books are known to share a main title, because they are in the
+                                 same MAIN_TITLE_BAND bucket (a saved title has lost its subtitle punctuation)
+    """
+
+    title_a, main_a, author_a = features_a
+    title_b, main_b, author_b = features_b
+
+    if author_a != author_b and not same_author(author_a, author_b):
+        return 0.0
+
+    if not (same_main_title or (main_a != "" and main_a == main_b)
+            or within_edits(title_a, title_b, 1 + max(len(title_a), len(title_b)) // TYPO_LENGTH)):
+        return 0.0
+
+    title_score = max(jaccard(trigrams(title_a), trigrams(title_b)), TITLE_FLOOR)
+    return round((title_score + jaccard(trigrams(author_a), trigrams(author_b))) / 2, 3)
+
+def similarity(title_a, author_a, title_b, author_b):
+    """Returns score() for two books given as text"""
+
+    return score(book_features(title_a, author_a), book_features(title_b, author_b))
+
+def index_books(c, books):
+    """Stores the signature rows for (id, title, author) rows using the given cursor (part of the caller's transaction)."""
+
+    c.executemany(SIGNATURE_INSERT, (row for book in books for row in signature_rows(*book)))
+
+
+class DuplicateIndex:
+    """Finds books that are probably the same as a new entry, and groups the whole library into duplicate clusters.
+
+    METHODS:
+        __init__(self, helper)
+            Registers the index as a change listener so edited titles and authors are re-indexed
+
+        find_similar(self, title, author, limit = 5)
+            Returns likely duplicates of a book, best match first
+
+        clusters(self)
+            Returns every group of books that look like the same title, for the duplicate report
+
+        rebuild(self)
+            Recomputes the signatures of every book
+
+        apply_changes(self, changes)
+            Re-indexes books whose title or author was changed by an update
+    """
+
+    def __init__(self, helper):
+        """Registers the index as a change listener so edited titles and authors are re-indexed.
+
+        Parameters:
+            helper: reference to the sqlite object created by SqliteHelper class
+        """
+
+        self.helper = helper
+        self.helper.add_listener(self.apply_changes)
+
+    def find_similar(self, title, author, limit = 5):
+        """Returns likely duplicates of a book, best match first.
+
+        Parameters:
+            title (string) - title of the book being added
+            author (string) - author of the book being added
+            limit (int) - maximum number of matches returned
+
+        Returns list of (score, id, title, author) tuples ([] if nothing similar is found)
+        """
+
+        buckets = signature_rows(None, title, author)
+        lookups = " UNION ".join("SELECT * FROM (SELECT book_id FROM book_signatures WHERE band = ? AND bucket = ? LIMIT ?)" for _ in buckets)
+        parameters = tuple(value for _, band, bucket in buckets for value in (band, bucket, MAX_BUCKET_SIZE))
+        main_bucket = [bucket for _, band, bucket in buckets if band == MAIN_TITLE_BAND][0]
+        candidates = self.helper.sort_items("""SELECT b.id, b.title, b.author,
+            EXISTS (SELECT 1 FROM book_signatures s WHERE s.book_id = b.id AND s.band = ? AND s.bucket = ?)
+            FROM books b WHERE b.id IN (""" + lookups + ")", (MAIN_TITLE_BAND, main_bucket) + parameters)
+
+        features = book_features(title, author)
+        matches = []
+        for book_id, other_title, other_author, same_main_title in candidates:
+            match_score = score(features, book_features(other_title, other_author), bool(same_main_title))
+            if match_score > 0:
+                matches.append((match_score, book_id, other_title, other_author))
+
+        matches.sort(key = lambda match: (-match[0], match[1]))
+        return matches[:limit]
+
+    def clusters(self):
+        """Returns every group of books that look like the same title, for the duplicate report.
+
+        Candidate pairs come only from books that share a bucket, so the work grows with the number of
+        near-duplicates rather than with the square of the library size. Buckets larger than CLUSTER_BUCKET_SIZE
+        are left out by the query, before any book in them is read or scored. Inside a bucket the books are
+        sorted by title length, and only titles close enough in length to be a typing mistake apart are scored.
+
+        Books are then taken in id order; the first book not yet in a cluster becomes the representative of a new
+        one, and a book joins only if it matched the representative itself. Matches are not followed from one book
+        to the next, so a chain of near misses ("Matthew I Hoover", "Michael I Hoover", "Michael H Hoover")
+        cannot merge books that are not duplicates of each other.
+
+        Returns list of clusters, largest first; each cluster is a list of (id, title, author) tuples sorted by id
+        """
+
+        c = self.helper.conn.cursor()
+        c.execute("""SELECT band, group_concat(book_id) FROM book_signatures
+            GROUP BY band, bucket HAVING COUNT(*) > 1 AND COUNT(*) <= ?""", (CLUSTER_BUCKET_SIZE,))
+        buckets = [(band, [int(book_id) for book_id in members.split(",")]) for band, members in c.fetchall()]
+
+        features = {}
+        needed = sorted(set(book_id for band, members in buckets for book_id in members))
+        for start in range(0, len(needed), 500):
+            chunk = needed[start:start + 500]
+            c.execute("SELECT id, title_norm, author_norm FROM books WHERE id IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+            for book_id, title_norm, author_norm in c:
+                features[book_id] = saved_features(title_norm, author_norm)
+
+        matches = {} #book id: ids of the books with a higher id that it matched
+        for band, members in buckets:
+            members = sorted((len(features[book_id][0]), book_id) for book_id in members if book_id in features)
+            for i, (length, first) in enumerate(members):
+                for other_length, second in members[i + 1:]:
+                    #books in a MAIN_TITLE_BAND bucket share a main title whatever the length of their saved titles
+                    if band != MAIN_TITLE_BAND and other_length - length > 1 + other_length // TYPO_LENGTH:
+                        break
+                    low, high = min(first, second), max(first, second)
+                    if high not in matches.get(low, ()) and score(features[low], features[high], band == MAIN_TITLE_BAND) > 0:
+                        matches.setdefault(low, set()).add(high)
+
+        clustered = set()
+        groups = []
+        for first in sorted(matches):
+            if first in clustered:
+                continue
+            group = [first] + sorted(second for second in matches[first] if second not in clustered)
+            if len(group) > 1:
+                clustered.update(group)
+                groups.append(group)
+
+        books = {}
+        ids = sorted(clustered)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            c.execute("SELECT id, title, author FROM books WHERE id IN (" + ",".join("?" * len(chunk)) + ")", chunk)
+            for book in c:
+                books[book[0]] = book
+
+        groups = [[books[book_id] for book_id in group] for group in groups]
+        return sorted(groups, key = lambda group: (-len(group), group[0][0]))
+
+    def rebuild(self):
+        """Recomputes the signatures of every book (used after restoring an old backup or changing the hashing)."""
+
+        c = self.helper.conn.cursor()
+        with self.helper.transaction():
+            c.execute("DELETE FROM book_signatures")
+            reader = self.helper.conn.cursor()
+            reader.execute("SELECT id, title, author FROM books")
+            while True:
+                books = reader.fetchmany(5000)
+                if len(books) == 0:
+                    break
+                index_books(c, books)
+
+    def apply_changes(self, changes):
+        """Re-indexes books whose title or author was changed by an update.
+
+        New books are indexed by SqliteHelper.insert_book() and the importer, and deleted books' rows are
+        removed by a trigger, so only updates need handling here.
+        """
+
+        books = []
+        for change in changes:
+            if change.table == "books" and change.operation == "update" and ("title" in change.columns or "author" in change.columns):
+                books.extend(self.helper.sort_items("SELECT id, title, author FROM books WHERE id = ?", (change.row_id,)))
+
+        if len(books) > 0:
+            c = self.helper.conn.cursor()
+            with self.helper.transaction():
+                c.executemany("DELETE FROM book_signatures WHERE book_id = ?", ((book[0],) for book in books))
+                index_books(c, books)
+
+
+if __name__ == "__main__":
+    import sys
+    from SqliteHelper import SqliteHelper
+
+    helper = SqliteHelper(sys.argv[1] if len(sys.argv) > 1 else "booklist.db")
+    helper.migrate()
+    for group in DuplicateIndex(helper).clusters():
+        print("; ".join("%d: %s by %s" % book for book in group))
@@ -0,0 +1,318 @@
+import csv, gzip, json, os, shutil, sqlite3, sys, time
+from collections import namedtuple
+from contextlib import contextmanager
+
+"""Streams the books and calendar tables out to CSV, JSON Lines or a copy of the database file.
+
+Rows are read with fetchmany a batch at a time and written straight to the output, optionally through gzip,
+so memory use stays the same for a thousand books or ten million. Files are written under a temporary name
+and renamed when complete, so an interrupted export never leaves a half-written file behind.
+
+By default the tables are read from a snapshot: a second, read-only connection holds one read transaction
+for the whole export. With the database in WAL mode, edits committed while a long export runs neither wait
+for it nor appear half way through it, and the books and calendar files describe the same moment.
+
+    python export_books.py library.csv.gz --tables books calendar
+    python export_books.py backup.db
+
+FUNCTIONS:
+    detect_format(path)
+        Works out the export format from the file extension
+
+    table_path(path, table, tables)
+        Returns the file a table is written to when several tables are exported to one path
+
+    open_output(path, compress = False)
+        Opens a text file for writing, through gzip when compress is True
+"""
+
+EXPORT_TABLES = {
+    "books": ("id", "title", "author", "rating", "genre", "series", "notes"),
+    "calendar": ("id", "date", "title", "author", "archived"),
+}
+EXPORT_COLUMNS = EXPORT_TABLES["books"]
+EXPORT_FORMATS = ("csv", "jsonl", "sqlite")
+FORMAT_EXTENSIONS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".db": "sqlite", ".sqlite": "sqlite", ".sqlite3": "sqlite"}
+
+class ExportReport(namedtuple("ExportReport", ["rows", "files", "seconds"])):
+    """Progress of an export.
+
+    rows (dictionary) - {table: rows written so far}
+    files (list) - files completed so far
+    seconds (float) - time since the export started
+    """
+
+    @property
+    def rate(self):
+        """Returns the number of rows written per second"""
+
+        if self.seconds <= 0:
+            return 0.0
+        return sum(self.rows.values()) / self.seconds
+
+def detect_format(path):
+    """Works out the export format from the file extension (a trailing .gz is ignored).
+
+    Raises ValueError if the extension is not one of FORMAT_EXTENSIONS
+    """
+
+    name = path[:-3] if path.lower().endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lower()
+    if extension not in FORMAT_EXTENSIONS:
+        raise ValueError("Cannot tell the export format of " + repr(path) + "; use a .csv, .jsonl or .db file name")
+    return FORMAT_EXTENSIONS[extension]
+
+def table_path(path, table, tables):
+    """Returns the file a table is written to: the path itself for one table, otherwise the path with the table name
+    before the extension (library.csv.gz becomes library.books.csv.gz and library.calendar.csv.gz)
+    """
+
+    if len(tables) == 1:
+        return path
+    name, compressed = (path[:-3], path[-3:]) if path.lower().endswith(".gz") else (path, "")
+    base, extension = os.path.splitext(name)
+    return base + "." + table + extension + compressed
+
+def open_output(path, compress = False):
+    """Opens a text file for writing as UTF-8, through gzip when compress is True"""
+
+    if compress:
+        return gzip.open(path, "wt", encoding = "utf-8", newline = "", compresslevel = 6)
+    return open(path, "w", encoding = "utf-8", newline = "")
+
+
+class BookExporter:
+    """Writes tables out a batch of rows at a time, from a consistent snapshot of the database.
+
+    METHODS:
+        __init__(self, helper, batch_size = 1000, snapshot = True, progress = None)
+            Stores the database helper, batch size, snapshot setting and optional progress callback
+
+        reading(self)
+            Context manager that yields the connection the tables are read from
+
+        export_stream(self, out, file_format = "csv", table = "books")
+            Writes one table to an open text file and returns the number of rows written
+
+        export_file(self, path, file_format = None, tables = ("books",), compress = None)
+            Writes the tables to files and returns an ExportReport
+
+        export_database(self, path, compress = False)
+            Writes a compacted copy of the whole database file and returns an ExportReport
+
+        write_table(self, conn, out, table, file_format)
+            Streams one table from a connection to an open text file and returns the number of rows written
+    """
+
+    def __init__(self, helper, batch_size = 1000, snapshot = True, progress = None):
+        """Stores the database helper, batch size, snapshot setting and optional progress callback.
+
+        Parameters:
+            helper: reference to the sqlite object created by SqliteHelper class
+            batch_size (int) - rows fetched from SQLite at a time
+            snapshot (bool) - read from a separate read-only connection in one transaction; False to read on the
+                helper's own connection, which sees the caller's uncommitted writes
+            progress (callable) - called with an ExportReport every 100 batches and after every file
+        """
+
+        self.helper = helper
+        self.batch_size = batch_size
+        self.snapshot = snapshot
+        self.progress = progress
+        self.rows = {}
+        self.files = []
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def reading(self):
+        """Context manager that yields the connection the tables are read from.
+
+        With snapshot on, this is a new query_only connection whose read transaction starts with the first
+        SELECT and ends when the block exits, so every table read inside the block sees the same data.
+        An in-memory database has no file to open a second connection on, so it is read on the helper's connection.
+        """
+
+        if not self.snapshot or self.helper.name in (None, "", ":memory:"):
+            yield self.helper.conn
+            return
+
+        conn = sqlite3.connect(self.helper.name)
+        try:
+            conn.execute("PRAGMA query_only = 1")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            conn.close() #ends the read transaction
+
+    def export_stream(self, out, file_format = "csv", table = "books"):
+        """Writes one table to an open text file and returns the number of rows written.
+
+        Parameters:
+            out - text file object opened for writing (newline = "" for CSV)
+            file_format (string) - "csv" (with a header row) or "jsonl" (one JSON object per line)
+            table (string) - "books" or "calendar"
+
+        Raises ValueError if the format or table cannot be exported to a stream
+        """
+
+        if file_format not in ("csv", "jsonl"):
+            raise ValueError("Cannot export as " + repr(file_format) + " to a stream")
+        if table not in EXPORT_TABLES:
+            raise ValueError("Cannot export table " + repr(table))
+
+        with self.reading() as conn:
+            return self.write_table(conn, out, table, file_format)
+
+    def export_file(self, path, file_format = None, tables = ("books",), compress = None):
+        """Writes the tables to files and returns an ExportReport.
+
+        Parameters:
+            path (string) - output file; with more than one table, each gets its own file (see table_path())
+            file_format (string) - "csv", "jsonl" or "sqlite"; detected from the path when None
+            tables (tuple) - tables written, from EXPORT_TABLES ("sqlite" always copies the whole database)
+            compress (bool) - write through gzip; True when the path ends in .gz if None
+
+        Raises ValueError if the format or a table cannot be exported, OSError if a file cannot be written
+        """
+
+        if file_format is None:
+            file_format = detect_format(path)
+        if file_format not in EXPORT_FORMATS:
+            raise ValueError("Cannot export as " + repr(file_format))
+        if compress is None:
+            compress = path.lower().endswith(".gz")
+        if file_format == "sqlite":
+            return self.export_database(path, compress)
+
+        tables = tuple(tables)
+        for table in tables:
+            if table not in EXPORT_TABLES:
+                raise ValueError("Cannot export table " + repr(table))
+
+        self.started = time.perf_counter()
+        self.rows, self.files = {}, []
+        with self.reading() as conn:
+            for table in tables:
+                target = table_path(path, table, tables)
+                temporary = target + ".tmp"
+                try:
+                    with open_output(temporary, compress) as out:
+                        self.write_table(conn, out, table, file_format)
+                    os.replace(temporary, target)
+                except BaseException:
+                    if os.path.exists(temporary):
+                        os.remove(temporary)
+                    raise
+                self.files.append(target)
+                if self.progress:
+                    self.progress(self.report())
+        return self.report()
+
+    def export_database(self, path, compress = False):
+        """Writes a compacted copy of the whole database file and returns an ExportReport.
+
+        VACUUM INTO reads the database in a single transaction, so the copy is consistent and the program can
+        keep writing while it is made. With compress, the copy is then streamed through gzip.
+
+        Parameters:
+            path (string) - file to create; replaced if it exists
+            compress (bool) - gzip the copy
+        """
+
+        self.started = time.perf_counter()
+        self.rows, self.files = {}, []
+        copy = path + ".tmp"
+        if os.path.exists(copy):
+            os.remove(copy)
+
+        try:
+            conn = sqlite3.connect(self.helper.name)
+            try:
+                conn.execute("VACUUM INTO ?", (copy,))
+            finally:
+                conn.close()
+            conn = sqlite3.connect(copy) #counted in the copy, which no later write can change
+            try:
+                for table in EXPORT_TABLES:
+                    self.rows[table] = conn.execute("SELECT COUNT(*) FROM " + table).fetchone()[0]
+            finally:
+                conn.close()
+
+            if compress:
+                with open(copy, "rb") as source, gzip.open(copy + ".gz", "wb", compresslevel = 6) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                os.remove(copy)
+                copy += ".gz"
+            os.replace(copy, path)
+        except BaseException:
+            for leftover in (path + ".tmp", path + ".tmp.gz"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+        self.files.append(path)
+        if self.progress:
+            self.progress(self.report())
+        return self.report()
+
+    def write_table(self, conn, out, table, file_format):
+        """Streams one table from a connection to an open text file and returns the number of rows written.
+
+        Rows are read in id order, batch_size at a time, through a cursor of their own.
+        """
+
+        columns = EXPORT_TABLES[table]
+        if file_format == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            write_rows = writer.writerows
+        else:
+            def write_rows(rows):
+                out.write("".join(json.dumps(dict(zip(columns, row)), ensure_ascii = False) + "\n" for row in rows))
+
+        count = 0
+        batches = 0
+        c = conn.cursor()
+        c.execute("SELECT " + ", ".join(columns) + " FROM " + table + " ORDER BY id")
+        while True:
+            rows = c.fetchmany(self.batch_size)
+            if len(rows) == 0:
+                break
+            write_rows(rows)
+            count += len(rows)
+            self.rows[table] = count
+            batches += 1
+            if self.progress and batches % 100 == 0:
+                self.progress(self.report())
+        c.close()
+        self.rows[table] = count
+        return count
+
+    def report(self):
+        """Returns an ExportReport for the export so far"""
+
+        return ExportReport(dict(self.rows), list(self.files), time.perf_counter() - self.started)
+
+
+if __name__ == "__main__":
+    import argparse
+    from SqliteHelper import SqliteHelper
+
+    parser = argparse.ArgumentParser(description = "Export a MyBookMgr database")
+    parser.add_argument("path", help = "output file: .csv, .jsonl or .db, optionally followed by .gz")
+    parser.add_argument("--format", choices = EXPORT_FORMATS, help = "output format (detected from the file name when omitted)")
+    parser.add_argument("--tables", nargs = "+", choices = sorted(EXPORT_TABLES), default = ["books"])
+    parser.add_argument("--db", default = "booklist.db", help = "database file (default booklist.db)")
+    parser.add_argument("--gzip", action = "store_true", help = "compress the output (implied by a .gz file name)")
+    parser.add_argument("--no-snapshot", action = "store_true", help = "read on the program's connection instead of a snapshot")
+    args = parser.parse_args()
+
+    def print_progress(report):
+        print("{0} rows ({1:.0f} rows/s)".format(sum(report.rows.values()), report.rate), file = sys.stderr)
+
+    helper = SqliteHelper(args.db)
+    helper.migrate() #an older booklist.db has no archived column for the calendar export
+    exporter = BookExporter(helper, snapshot = not args.no_snapshot, progress = print_progress)
+    report = exporter.export_file(args.path, args.format, args.tables, True if args.gzip else None)
+    print("{0} written in {1:.1f}s".format(", ".join(report.files), report.seconds), file = sys.stderr)
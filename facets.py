@@ -0,0 +1,90 @@
+from SqliteHelper import SqliteHelper, FILTER_CATEGORIES
+
+class FacetCache:
+    """Distinct values and book counts for each filter category, read from the book_stats summary and cached until a write touches that column.
+
+    The counts are kept by triggers (see book_stats.py), so reading a facet costs one row per distinct value
+    however many books there are. Results stay cached until SqliteHelper reports a change to the column:
+    editing a book's genre only invalidates the genre facet, and adding or deleting a book invalidates all of them.
+
+    Facets that are not cached are read by the DatabaseWorker. Asking for another category before the
+    read finishes supersedes it, so only the last category chosen reaches the callback.
+
+    METHODS:
+        __init__(self, worker)
+            Registers the cache as a listener for the worker's change events
+
+        values(self, category, callback)
+            Passes a list of (value, count) tuples for the category, sorted by value, to the callback
+
+        label(value, count)
+            Returns the text shown in a drop-down for a facet value, e.g. "Horror (412)"
+
+        invalidate(self, changes)
+            Forgets the cached facets for every column touched by the changes
+    """
+
+    def __init__(self, worker):
+        """Registers the cache as a listener for the worker's change events.
+
+        Parameters:
+            worker: reference to the DatabaseWorker that owns the sqlite connection
+        """
+
+        self.worker = worker
+        self.cache = {}
+        self.request = None
+        self.worker.changes_ready.connect(self.invalidate)
+
+    def values(self, category, callback):
+        """Passes a list of (value, count) tuples for the category, sorted by value, to the callback.
+
+        Cached facets are passed straight away; others are passed once the worker has read them.
+
+        Parameters:
+            category (string) - one of FILTER_CATEGORIES (author, rating, genre, or series)
+            callback (callable) - called on the GUI thread with the list
+
+        Raises ValueError if the category is not one of FILTER_CATEGORIES
+        """
+
+        if category not in FILTER_CATEGORIES:
+            raise ValueError("No facet for " + repr(category))
+
+        if self.request is not None:
+            self.worker.cancel(self.request)
+            self.request = None
+
+        if category in self.cache:
+            callback(self.cache[category])
+            return
+
+        def store(values):
+            self.request = None
+            self.cache[category] = values
+            callback(values)
+
+        self.request = self.worker.submit(SqliteHelper.sort_items,
+            "SELECT value, books FROM book_stats WHERE category = ? ORDER BY value", (category,),
+            callback = store, key = self)
+
+    @staticmethod
+    def label(value, count):
+        """Returns the text shown in a drop-down for a facet value, e.g. "Horror (412)"."""
+
+        if str(value) == "":
+            value = "(none)"
+        return "%s (%d)" % (value, count)
+
+    def invalidate(self, changes):
+        """Forgets the cached facets for every column touched by the changes.
+
+        Parameters:
+            changes (list of RowChange) - changes reported by SqliteHelper after a commit
+        """
+
+        for change in changes:
+            if change.table != "books":
+                continue
+            for column in change.columns:
+                self.cache.pop(column, None)
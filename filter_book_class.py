@@ -3,61 +3,78 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
 
 from SqliteHelper import *
+from booklist_model import *
+from facets import FacetCache
+from filter_query import compile_filter, filter_expression
+from ui_cache import load_ui
 from shared import *
 
 
 class FilterBook:
     """Filters the booklist data based on user's selection in filter wizard.
+
+    The wizard's choice becomes a filter query (e.g. author:"Stephen King") shown above the results, where it can
+    be edited to narrow or widen the results, e.g. to author:"Stephen King" rating>=4 (see filter_query.py).
     
     METHODS: 
-        __init__(self, helper)
+        __init__(self, worker)
             Loads and opens the filter wizard, and loads the filter_results window
 
         filter_book_by_category(self)
             Opens filter wizard and connects to respective import method based on user's chosen filter category
 
         import_rating(self) 
-            Runs a sqlite query to select all values for rating from the books database
+            Reads the distinct values for rating and their book counts from the facet cache
         
         import_author(self) 
-            Runs a sqlite query to select all values for author from the books database
+            Reads the distinct values for author and their book counts from the facet cache
         
         import_genre(self)
-            Runs a sqlite query to select all values for genre from the books database
+            Reads the distinct values for genre and their book counts from the facet cache
         
         import_series(self)
-            Runs a sqlite query to select all values for series from the books database
-        
-        get_options(self, category)
-            Creates a new set with the unique values from the database for the user's chosen filter category
+            Reads the distinct values for series and their book counts from the facet cache
         
-        get_combobox_values(self, new_set)
-            Fills the filter wizard's drop-down menu with the unique values for the user's chosen filter category
+        get_combobox_values(self, facet_values)
+            Fills the filter wizard's drop-down menu with the unique values and book counts for the user's chosen filter category
 
         build_table(self)
-            Builds a new filter table based on the user's chosen category and value in the filter wizard
+            Reads the user's chosen category and value in the filter wizard and shows the matching books
+
+        apply_query(self)
+            Shows the books that match the query typed above the results
         
         load_filter_data(self)
-            Loads the results table from the database into the the filter table that is shown in a new window
+            Compiles the filter query and points the results model at it so the filter table shown in a new window reads it lazily
 
         clear_filter_data(self)
-            Systematically removes existing data from the filter results table by iterating through each row and clearing its data
+            Drops the rows held by the filter results model
         
         filter_refresh(self)
             Clears the filter data and then loads the data again so any modifications will be shown
     """
 
-    def __init__(self, helper):
+    def __init__(self, worker):
         """Loads and opens the filter wizard, and loads the filter_results window. 
 
         Parameters: 
-            helper: reference to the sqlite object created by SqliteHelper class
+            worker: reference to the DatabaseWorker that owns the sqlite connection
         """
 
         super(FilterBook, self).__init__()
-        self.filter_wizard = uic.loadUi("filter_wizard.ui") 
-        self.helper = helper
-        self.filter_results = uic.loadUi("filter_results.ui")
+        self.filter_wizard = load_ui("filter_wizard.ui") 
+        self.worker = worker
+        self.facets = FacetCache(worker)
+        self.filter_results = load_ui("filter_results.ui")
+        self.results_model = BooklistModel(worker, "books", BOOK_COLUMNS, BOOK_HEADERS)
+        self.filter_results.filter_results_table.setModel(self.results_model)
+        self.worker.changes_ready.connect(self.results_model.apply_changes)
+        self.category = None
+        self.query = ""
+        self.query_box = QtWidgets.QLineEdit(self.filter_results)
+        self.query_box.setToolTip('Filter query, e.g. author:"Stephen King" rating>=4 genre:(Horror|Thriller) -series:""')
+        self.query_box.returnPressed.connect(self.apply_query)
+        self.filter_results.gridLayout.addWidget(self.query_box, 0, 1)
         self.filter_results.filter_results_table.hideColumn(0)
         self.filter_wizard.setWindowFlags(self.filter_wizard.windowFlags() & ~Qt.WindowContextHelpButtonHint)
     
@@ -75,122 +92,109 @@ class FilterBook:
         self.filter_wizard.exec_()
         
     def import_rating(self): 
-        """Runs a sqlite query to select all values for rating from the books database.
-        Calls get_options() method to remove duplicate values
-        Calls get_combobox_values() method to fill drop-down menu with unique values for user to select
+        """Reads the distinct values for rating and their book counts from the facet cache.
+        Calls get_combobox_values() method to fill drop-down menu with the values for user to select
         """
 
-        self.category = self.helper.select("SELECT rating FROM books") 
-        self.category_set = self.get_options(self.category)
-        self.get_combobox_values(self.category_set)
+        self.facets.values("rating", self.get_combobox_values)
 
     def import_author(self): 
-        """Runs a sqlite query to select all values for author from the books database.
-        Calls get_options() method to remove duplicate values
-        Calls get_combobox_values() method to fill drop-down menu with unique values for user to select
+        """Reads the distinct values for author and their book counts from the facet cache.
+        Calls get_combobox_values() method to fill drop-down menu with the values for user to select
         """
 
-        self.category = self.helper.select("SELECT author FROM books") 
-        self.category_set = self.get_options(self.category)
-        self.get_combobox_values(self.category_set)
+        self.facets.values("author", self.get_combobox_values)
 
     def import_genre(self): 
-        """Runs a sqlite query to select all values for genre from the books database.
-        Calls get_options() method to remove duplicate values
-        Calls get_combobox_values() method to fill drop-down menu with unique values for user to select
+        """Reads the distinct values for genre and their book counts from the facet cache.
+        Calls get_combobox_values() method to fill drop-down menu with the values for user to select
         """
 
-        self.category = self.helper.select("SELECT genre FROM books") 
-        self.category_set = self.get_options(self.category)
-        self.get_combobox_values(self.category_set)
+        self.facets.values("genre", self.get_combobox_values)
 
     def import_series(self): 
-        """Runs a sqlite query to select all values for series from the books database.
-        Calls get_options() method to remove duplicate values
-        Calls get_combobox_values() method to fill drop-down menu with unique values for user to select
+        """Reads the distinct values for series and their book counts from the facet cache.
+        Calls get_combobox_values() method to fill drop-down menu with the values for user to select
         """
 
-        self.category = self.helper.select("SELECT series FROM books") 
-        self.category_set = self.get_options(self.category)
-        self.get_combobox_values(self.category_set)
+        self.facets.values("series", self.get_combobox_values)
         
-    def get_options(self, category):
-        """Called by the import methods to create a new set with the unique values from the database for the user's chosen filter category.
-        Punctuation is removed before the value is added to the set.
+    def get_combobox_values(self, facet_values):
+        """Called by the import methods to fill the filter wizard's drop-down menu with the unique values for the user's chosen filter category.
+        Each entry shows the value with its book count; the value itself is stored as the item's data for build_table().
 
-        Returns
-            set of unique values for user's chosen category
-        """
-
-        self.options = set() 
-        
-        for item in category:
-            item = str(remove_punctuation(item)) 
-            self.options.add(item)
-
-        return self.options
-
-    def get_combobox_values(self, new_set):
-        """Called by the import methods to fill the filter wizard's drop-down menu with the unique values for the user's chosen filter category 
+        Parameters:
+            facet_values (list of tuples) - (value, count) pairs from the facet cache
         """
         self.filter_wizard.comboBox.clear()
     
-        for name in new_set:
-            self.filter_wizard.comboBox.addItem(name)
+        for value, count in facet_values:
+            self.filter_wizard.comboBox.addItem(self.facets.label(value, count), value)
             
     def build_table(self):
-        """Builds a new filter table based on the user's chosen category and value in the filter wizard.
+        """Reads the user's chosen category and value in the filter wizard and shows the matching books.
+        Nothing is written to the database; the results window reads the matching rows straight from the books table.
         """
 
         self.filter_results.close_Button.clicked.connect(self.filter_results.close)
-        
-        self.helper.create_filter_table()
 
-        self.data = self.filter_wizard.comboBox.currentText()
+        self.data = self.filter_wizard.comboBox.currentData()
+        if self.data is None:
+            self.data = self.filter_wizard.comboBox.currentText()
+        self.category = None
 
         if self.filter_wizard.RadioBtn_author.isChecked():
-            self.helper.filter_items("author", self.data) 
+            self.category = "author"
             self.filter_wizard.RadioBtn_author.setChecked(False)
 
         elif self.filter_wizard.RadioBtn_rating.isChecked():
-            self.helper.filter_items("rating", self.data) 
+            self.category = "rating"
             self.filter_wizard.RadioBtn_rating.setChecked(False)
 
         elif self.filter_wizard.RadioBtn_genre.isChecked():
-            self.helper.filter_items("genre", self.data) 
+            self.category = "genre"
             self.filter_wizard.RadioBtn_genre.setChecked(False)
 
         elif self.filter_wizard.RadioBtn_series.isChecked():
-            self.helper.filter_items("series", self.data) 
+            self.category = "series"
             self.filter_wizard.RadioBtn_series.setChecked(False)
 
+        if self.category is not None:
+            self.query = filter_expression(self.category, self.data)
         self.filter_refresh()
         self.filter_results.show()
 
+    def apply_query(self):
+        """Shows the books that match the query typed above the results; called when the user presses Enter in it"""
+
+        self.query = self.query_box.text()
+        self.filter_refresh()
+
     def load_filter_data(self):   
-        """Loads the results table from the database into the the filter table that is shown in a new window.
+        """Compiles the filter query and points the results model at it so the filter table shown in a new window reads it lazily.
+        The query box shows the query in its normalized form.
+
+        Raises ValueError if the query cannot be parsed
+            The message says what is wrong and where
         """
-        self.helper.create_filter_table() 
 
-        filtered_table = self.helper.select("SELECT * FROM results ORDER BY id")    
-        
-        for row_num, book in enumerate(filtered_table):
-            self.filter_results.filter_results_table.insertRow(row_num)
-            for col_num, data in enumerate(book):
-                cell = QtWidgets.QTableWidgetItem(str(data))
-                self.filter_results.filter_results_table.setItem(row_num, col_num, cell)
-        
-        self.helper.delete("DROP TABLE results") #TESTED WITH DB BROWSER (SQLITE) PROGRAM
+        if self.query == "":
+            return
+
+        try:
+            compiled = compile_filter(self.query)
+        except ValueError as e:
+            show_message("Error", str(e))
+            return
+        self.query_box.setText(compiled.expression)
+        self.results_model.set_query(compiled.condition, compiled.parameters)
 
     def clear_filter_data(self):
-        """Systematically removes existing data from the filter results table by iterating through each row and clearing its data.
+        """Drops the rows held by the filter results model.
         """
 
         self.filter_results.filter_results_table.clearSelection()
-        
-        while (self.filter_results.filter_results_table.rowCount() > 0):
-            self.filter_results.filter_results_table.removeRow(0)
-            self.filter_results.filter_results_table.clearSelection()
+        self.results_model.clear()
         
     def filter_refresh(self):
         """Clears the filter data and then loads the data again so any modifications will be shown"""
@@ -0,0 +1,536 @@
+import re, sys
+from collections import namedtuple
+from functools import lru_cache
+from normalize import remove_punctuation
+from SqliteHelper import SqliteHelper
+
+"""Filter query language for books, compiled to parameterized SQLite conditions.
+
+A query is a list of terms; terms next to each other must all match, OR between them lets either match and
+NOT (or a leading -) excludes the books a term matches. Parentheses group terms.
+
+    author:"Stephen King"          equal (values are cleaned like the Add Book form: "stephen king" works too)
+    author:steph*                  prefix: every author that starts with Steph
+    genre:(Horror|Thriller)        any of several values
+    rating>=4   rating!=0          comparisons: = != < <= > >=
+    rating:3..5   title:A..M       inclusive ranges; either end may be left out (rating:4..)
+    -series:""                     NOT: books in a series
+    king shining                   words without a field search the full-text index, as the search box does
+    author:king* (rating:5 OR genre:Horror) NOT notes:""
+
+The fields are id, title, author, rating, genre, series and notes. Every value is bound as a parameter, and
+the conditions are the forms SQLite can answer from an index: = and IN are index seeks, ranges and
+prefixes are index range scans (a prefix never becomes LIKE, which cannot use the index), and a NOT is written
+as the ranges outside what it excludes (-genre:Horror is genre < ? OR genre > ?). check_plan() asks EXPLAIN
+QUERY PLAN whether the list query for a filter still reads the whole table; the search box shows it when it does.
+
+Parsing produces a tree of tuples with the values already cleaned, nested ANDs and ORs flattened and IN
+lists sorted, so "rating >= 4  genre:horror" and "rating>=4 genre:Horror" have the same tree. The compiled
+condition is cached by that tree.
+
+    compiled = compile_filter('author:"King" rating>=4')
+    model.set_query(compiled.condition, compiled.parameters)
+
+    python filter_query.py booklist.db 'genre:(Horror|Thriller) rating>=4'
+
+FUNCTIONS:
+    parse_filter(text)
+        Returns the normalized tree for a filter query, or None if the query is empty
+
+    format_filter(tree)
+        Returns the query text for a tree, in the normalized form
+
+    complement(tree)
+        Returns a tree for NOT tree written without NOT, or None for a full-text term
+
+    without_not(tree)
+        Returns the tree with a NOT or != at its top written as ranges, or the tree itself
+
+    compile_tree(tree)
+        Returns the (condition, parameters) for a tree; cached
+
+    compile_filter(text)
+        Returns a CompiledFilter with the normalized query, the sqlite condition and its parameters
+
+    filter_expression(category, value)
+        Returns the query text that matches one value of a category, as chosen in the filter wizard
+
+    check_plan(helper, condition, parameters, order = "id")
+        Returns a FilterPlan with the EXPLAIN QUERY PLAN steps of the list query for a condition
+"""
+
+FILTER_FIELDS = {
+    "id": "int",
+    "title": "text",
+    "author": "text",
+    "rating": "int",
+    "genre": "text",
+    "series": "text",
+    "notes": "text",
+}
+KEYWORDS = ("AND", "OR", "NOT")
+FTS_CONDITION = "id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)" #same as SqliteHelper.search_condition()
+
+TOKEN = re.compile(r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*")(?P<string_star>\*)?
+    |(?P<op>>=|<=|!=|[:<>=])
+    |(?P<range>\.\.)
+    |(?P<punct>[()|])
+    |(?P<word>(?:[^\s()|"<>=!:.*]|\.(?!\.)|!(?!=))+)(?P<word_star>\*)?
+    |(?P<star>\*)
+    )""", re.VERBOSE)
+
+CompiledFilter = namedtuple("CompiledFilter", ["expression", "condition", "parameters"])
+CompiledFilter.__doc__ = """A filter query compiled by compile_filter().
+
+    expression (string) - the query in its normalized form (see format_filter())
+    condition (string) - parameterized sqlite condition on the books table; "" for an empty query
+    parameters (tuple) - values for the condition's placeholders
+"""
+
+FilterPlan = namedtuple("FilterPlan", ["steps", "full_scan"])
+FilterPlan.__doc__ = """EXPLAIN QUERY PLAN result for a filter, from check_plan().
+
+    steps (list of strings) - plan steps, indented by depth
+    full_scan (bool) - True if a step walks the books in list order testing each one, instead of seeking an index for the filter
+"""
+
+
+class FilterSyntaxError(ValueError):
+    """A filter query that cannot be parsed; position is the offset in the text where the problem was found"""
+
+    def __init__(self, message, position):
+        super(FilterSyntaxError, self).__init__("%s (at character %d)" % (message, position + 1))
+        self.position = position
+
+
+def tokenize(text):
+    """Returns the (kind, value, position) tokens of a filter query.
+
+    kind is "string" or "word" (value is (text, True if a * follows it)), "op", "range" or one of "()|".
+
+    Raises FilterSyntaxError for an unterminated quote or a character that cannot start a token
+    """
+
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None or match.end() == position:
+            start = len(text) - len(text[position:].lstrip())
+            if text[start] == '"':
+                raise FilterSyntaxError("Unterminated quote", start)
+            raise FilterSyntaxError("Unexpected " + repr(text[start]), start)
+
+        start = match.end() - len(match.group(0).lstrip())
+        if match.group("string") is not None:
+            value = re.sub(r"\\(.)", r"\1", match.group("string")[1:-1])
+            tokens.append(("string", (value, match.group("string_star") is not None), start))
+        elif match.group("word") is not None:
+            tokens.append(("word", (match.group("word"), match.group("word_star") is not None), start))
+        elif match.group("star") is not None:
+            tokens.append(("word", ("", True), start))
+        elif match.group("op") is not None:
+            tokens.append(("op", match.group("op"), start))
+        elif match.group("range") is not None:
+            tokens.append(("range", "..", start))
+        else:
+            tokens.append((match.group("punct"), match.group("punct"), start))
+        position = match.end()
+    return tokens
+
+
+def clean_value(field, value, position):
+    """Returns a value as it is stored in the field: an int for id and rating, cleaned text for the others.
+
+    Title and author are cleaned like clean_book_details() does, so a query matches what the forms saved.
+
+    Raises FilterSyntaxError if a number field is given something that is not a whole number
+    """
+
+    if FILTER_FIELDS[field] == "int":
+        try:
+            return int(value)
+        except ValueError:
+            raise FilterSyntaxError(field + " needs a whole number, not " + repr(value), position)
+    if field in ("title", "author"):
+        return remove_punctuation(value).title()
+    if field in ("genre", "series"):
+        return remove_punctuation(value.title())
+    return value
+
+
+class Parser:
+    """Recursive-descent parser from tokens to the normalized tree.
+
+    METHODS:
+        __init__(self, text)
+            Splits the text into tokens
+
+        parse(self)
+            Returns the tree for the whole query, or None if it is empty
+    """
+
+    def __init__(self, text):
+        """Splits the text into tokens"""
+
+        self.text = text
+        self.tokens = tokenize(text)
+        self.index = 0
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None, len(self.text))
+
+    def take(self):
+        token = self.peek()
+        self.index += 1
+        return token
+
+    def is_keyword(self, token, keyword):
+        return token[0] == "word" and token[1] == (keyword, False)
+
+    def parse(self):
+        """Returns the tree for the whole query, or None if it is empty"""
+
+        if len(self.tokens) == 0:
+            return None
+        tree = self.parse_or()
+        kind, value, position = self.peek()
+        if kind is not None:
+            raise FilterSyntaxError("Unexpected " + repr(self.text[position:position + 10]), position)
+        return tree
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.is_keyword(self.peek(), "OR"):
+            self.take()
+            children.append(self.parse_and())
+        return combine("or", children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while True:
+            token = self.peek()
+            if token[0] in (None, ")", "|") or self.is_keyword(token, "OR"):
+                break
+            if self.is_keyword(token, "AND"):
+                self.take()
+            children.append(self.parse_not())
+        return combine("and", children)
+
+    def parse_not(self):
+        token = self.peek()
+        if self.is_keyword(token, "NOT") or (token[0] == "word" and token[1] == ("-", False)):
+            self.take()
+            return negate(self.parse_not())
+        if token[0] == "word" and token[1][0].startswith("-"):
+            word, star = token[1]
+            self.tokens[self.index] = ("word", (word[1:], star), token[2] + 1) #"-genre:x" is NOT genre:x
+            return negate(self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value, position = self.take()
+        if kind == "(":
+            tree = self.parse_or()
+            if self.take()[0] != ")":
+                raise FilterSyntaxError("Missing )", position)
+            return tree
+        if kind == "string":
+            return self.text_term(value, position)
+        if kind == "word":
+            if value[0] in KEYWORDS:
+                raise FilterSyntaxError(value[0] + " needs a term after it", position)
+            if self.peek()[0] == "op" and not value[1]:
+                return self.field_term(value[0], position)
+            return self.text_term(value, position)
+        if kind is None:
+            raise FilterSyntaxError("The query ends too soon", position)
+        raise FilterSyntaxError("Unexpected " + repr(value), position)
+
+    def text_term(self, value, position):
+        """A word (or quoted words) without a field, matched against the full-text index"""
+
+        words, star = value
+        if SqliteHelper.match_expression(words) is None:
+            raise FilterSyntaxError("Nothing to search for in " + repr(words), position)
+        return ("text", words)
+
+    def field_term(self, field, position):
+        """A field followed by an operator and a value, a range or a list of values"""
+
+        name = field.lower()
+        if name not in FILTER_FIELDS:
+            raise FilterSyntaxError("Unknown field " + repr(field) + "; use one of " + ", ".join(FILTER_FIELDS), position)
+        op, op_position = self.take()[1:]
+
+        if op == ":" and self.peek()[0] == "(":
+            self.take()
+            values = [self.value(name)]
+            while self.peek()[0] == "|":
+                self.take()
+                values.append(self.value(name))
+            if self.take()[0] != ")":
+                raise FilterSyntaxError("Missing ) after the values of " + name, op_position)
+            prefixes = [value for value in values if value[0] == "prefix"]
+            if prefixes:
+                return combine("or", [("prefix", name, value[1]) if value[0] == "prefix" else ("cmp", name, "=", value[1]) for value in values])
+            values = tuple(sorted(set(value[1] for value in values)))
+            return ("cmp", name, "=", values[0]) if len(values) == 1 else ("in", name, values)
+
+        low = None if (op == ":" and self.peek()[0] == "range") else self.value(name)
+        if op == ":" and self.peek()[0] == "range":
+            range_end = self.take()[2] + 2
+            following = self.peek()
+            high = self.value(name) if following[0] in ("word", "string") and following[2] == range_end else None #"rating:4.. genre:x" is open-ended
+            if (low is not None and low[0] == "prefix") or (high is not None and high[0] == "prefix"):
+                raise FilterSyntaxError("A range cannot end with *", op_position)
+            if low is None and high is None:
+                raise FilterSyntaxError("A range needs at least one end", op_position)
+            return ("range", name, low[1] if low else None, high[1] if high else None)
+
+        if low[0] == "prefix":
+            if op != ":":
+                raise FilterSyntaxError("* only works with :", op_position)
+            if FILTER_FIELDS[name] == "int":
+                raise FilterSyntaxError(name + " cannot be matched by prefix", op_position)
+            return ("prefix", name, low[1])
+        return ("cmp", name, "=" if op == ":" else op, low[1])
+
+    def value(self, field):
+        """Reads one value; returns ("value", cleaned value) or ("prefix", cleaned text) for a value ending in *"""
+
+        kind, value, position = self.take()
+        if kind not in ("word", "string"):
+            raise FilterSyntaxError(field + " needs a value", position)
+        text, star = value
+        if star:
+            return ("prefix", clean_value(field, text, position) if FILTER_FIELDS[field] == "text" else text)
+        return ("value", clean_value(field, text, position))
+
+
+def combine(operation, children):
+    """Returns an AND or OR of the children with nested groups of the same kind flattened"""
+
+    flat = []
+    for child in children:
+        if child[0] == operation:
+            flat.extend(child[1])
+        elif child not in flat:
+            flat.append(child)
+    return flat[0] if len(flat) == 1 else (operation, tuple(flat))
+
+def negate(tree):
+    """Returns NOT tree, removing a double negation"""
+
+    return tree[1] if tree[0] == "not" else ("not", tree)
+
+def parse_filter(text):
+    """Returns the normalized tree for a filter query, or None if the query is empty.
+
+    Raises FilterSyntaxError (a ValueError) if the query cannot be parsed
+    """
+
+    return Parser(text).parse()
+
+
+def quote(value):
+    """Returns a value as it is written in a query: numbers and plain words as they are, anything else in quotes"""
+
+    if isinstance(value, int):
+        return str(value)
+    if re.fullmatch(r"[^\s()|\"<>=!:.*-][^\s()|\"<>=!:.*]*", value) and value not in KEYWORDS:
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+def format_filter(tree):
+    """Returns the query text for a tree, in the normalized form (e.g. 'author:"Stephen King" rating>=4')"""
+
+    if tree is None:
+        return ""
+    kind = tree[0]
+    if kind == "and":
+        return " ".join("(" + format_filter(child) + ")" if child[0] == "or" else format_filter(child) for child in tree[1])
+    if kind == "or":
+        return " OR ".join("(" + format_filter(child) + ")" if child[0] == "and" else format_filter(child) for child in tree[1])
+    if kind == "not":
+        child = format_filter(tree[1])
+        return "-(" + child + ")" if tree[1][0] in ("and", "or") else "-" + child
+    if kind == "text":
+        return quote(tree[1])
+    if kind == "prefix":
+        return tree[1] + ":" + quote(tree[2]) + "*" if tree[2] else tree[1] + ":*"
+    if kind == "in":
+        return tree[1] + ":(" + "|".join(quote(value) for value in tree[2]) + ")"
+    if kind == "range":
+        return tree[1] + ":" + ("" if tree[2] is None else quote(tree[2])) + ".." + ("" if tree[3] is None else quote(tree[3]))
+    field, op, value = tree[1:]
+    return field + (":" if op == "=" else op) + quote(value)
+
+
+def prefix_end(prefix):
+    """Returns the smallest string above every string that starts with prefix, or None if there is none"""
+
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            following = last + 1 if not 0xD800 <= last + 1 <= 0xDFFF else 0xE000 #skip the surrogates, which cannot be stored
+            return prefix[:-1] + chr(following)
+        prefix = prefix[:-1]
+    return None
+
+def complement(tree):
+    """Returns a tree for NOT tree written without NOT, or None for a full-text term (which stays NOT (...)).
+
+    SQLite cannot seek an index for NOT (genre = ?), so a negated comparison becomes the ranges on either side
+    of its values: -genre:Horror is genre < "Horror" OR genre > "Horror", and -series:"" is series > "" (no text
+    sorts below ""). A negated AND or OR is turned inside out (De Morgan), which keeps the NULL results the same.
+    """
+
+    kind = tree[0]
+    if kind == "and" or kind == "or":
+        return combine("or" if kind == "and" else "and", [negate(child) for child in tree[1]])
+    if kind == "text":
+        return None
+
+    field = tree[1]
+    def below(value):
+        return None if value == "" and FILTER_FIELDS[field] == "text" else ("cmp", field, "<", value)
+
+    if kind == "cmp":
+        op, value = tree[2], tree[3]
+        if op != "=":
+            return ("cmp", field, {"!=": "=", "<": ">=", "<=": ">", ">": "<=", ">=": "<"}[op], value)
+        ranges = [below(value), ("cmp", field, ">", value)]
+    elif kind == "in":
+        values = tree[2]
+        ranges = [below(values[0])]
+        ranges += [("and", (("cmp", field, ">", low), ("cmp", field, "<", high))) for low, high in zip(values, values[1:])
+            if FILTER_FIELDS[field] == "text" or high - low > 1] #no whole number between 4 and 5
+        ranges.append(("cmp", field, ">", values[-1]))
+    elif kind == "range":
+        ranges = [None if tree[2] is None else below(tree[2]), None if tree[3] is None else ("cmp", field, ">", tree[3])]
+    else:
+        end = prefix_end(tree[2])
+        ranges = [("cmp", field, "<", tree[2]), None if end is None else ("cmp", field, ">=", end)]
+
+    ranges = [part for part in ranges if part is not None]
+    return combine("or", ranges) if ranges else ("cmp", field, "<", "")
+
+def without_not(tree):
+    """Returns the tree with a NOT or != at its top written as ranges (see complement()), or the tree itself"""
+
+    if tree[0] == "not":
+        outside = complement(tree[1])
+    elif tree[0] == "cmp" and tree[2] == "!=":
+        outside = complement(("cmp", tree[1], "=", tree[3]))
+    else:
+        return tree
+    return tree if outside is None else outside
+
+@lru_cache(maxsize = 256)
+def compile_tree(tree):
+    """Returns the (condition, parameters) for a tree; cached, so a repeated query is only compiled once.
+
+    The words without a field in one AND group become a single full-text MATCH, as in the search box.
+    """
+
+    tree = without_not(tree)
+    kind = tree[0]
+    if kind in ("and", "or"):
+        children = [without_not(child) for child in tree[1]]
+        parts = []
+        parameters = ()
+        if kind == "and":
+            words = [child[1] for child in children if child[0] == "text"]
+            if len(words) > 1:
+                children = [child for child in children if child[0] != "text"]
+                parts.append(FTS_CONDITION)
+                parameters += (SqliteHelper.match_expression(" ".join(words)),)
+        for child in children:
+            condition, child_parameters = compile_tree(child)
+            parts.append("(" + condition + ")" if child[0] in ("and", "or") else condition)
+            parameters += child_parameters
+        return (" AND " if kind == "and" else " OR ").join(parts), parameters
+
+    if kind == "not":
+        condition, parameters = compile_tree(tree[1])
+        return "NOT (" + condition + ")", parameters
+    if kind == "text":
+        return FTS_CONDITION, (SqliteHelper.match_expression(tree[1]),)
+
+    field = tree[1]
+    if kind == "cmp":
+        return field + " " + tree[2] + " ?", (tree[3],)
+    if kind == "in":
+        return field + " IN (" + ", ".join("?" * len(tree[2])) + ")", tree[2]
+    if kind == "range":
+        low, high = tree[2], tree[3]
+        if low is not None and high is not None:
+            return field + " BETWEEN ? AND ?", (low, high)
+        return (field + " >= ?", (low,)) if low is not None else (field + " <= ?", (high,))
+
+    end = prefix_end(tree[2]) #prefix: a range on the index rather than LIKE
+    if end is None:
+        return field + " >= ?", (tree[2],)
+    return field + " >= ? AND " + field + " < ?", (tree[2], end)
+
+def compile_filter(text):
+    """Returns a CompiledFilter with the normalized query, the sqlite condition and its parameters.
+
+    An empty query compiles to the condition "", which BooklistModel.set_query() reads as every book.
+
+    Raises FilterSyntaxError (a ValueError) if the query cannot be parsed
+    """
+
+    tree = parse_filter(text)
+    if tree is None:
+        return CompiledFilter("", "", ())
+    condition, parameters = compile_tree(tree)
+    return CompiledFilter(format_filter(tree), condition, parameters)
+
+def filter_expression(category, value):
+    """Returns the query text that matches one value of a category, as chosen in the filter wizard"""
+
+    return category + ":" + quote(value)
+
+
+def check_plan(helper, condition, parameters, order = "id"):
+    """Returns a FilterPlan with the EXPLAIN QUERY PLAN steps of the list query for a condition.
+
+    The query planned is the first page the booklist reads (SqliteHelper.keyset_query()), so the plan shows
+    whether SQLite seeks an index for the filter or reads every book. A filter on notes, which has no index,
+    or one that is all NOT terms, is expected to scan.
+
+    Parameters:
+        helper (SqliteHelper) - connection to plan the query on
+        condition, parameters - from compile_filter()
+        order (string) - column the list is sorted by
+    """
+
+    query, query_parameters = SqliteHelper.keyset_query("books", tuple(FILTER_FIELDS), order, None, True, 256, condition, parameters)
+    steps = helper.explain(query, query_parameters)
+    full_scan = any(re.match(r"\s*SCAN (?:TABLE )?books\b", step) is not None for step in steps)
+    return FilterPlan(steps, full_scan)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python filter_query.py DATABASE QUERY", file = sys.stderr)
+        sys.exit(2)
+    helper = SqliteHelper(sys.argv[1])
+    helper.migrate()
+    try:
+        compiled = compile_filter(sys.argv[2])
+    except FilterSyntaxError as e:
+        print(e, file = sys.stderr)
+        sys.exit(2)
+    print("query:      " + compiled.expression)
+    print("condition:  " + compiled.condition)
+    print("parameters: " + repr(compiled.parameters))
+    plan = check_plan(helper, compiled.condition, compiled.parameters)
+    print("plan:" + (" (reads every book)" if plan.full_scan else ""))
+    for step in plan.steps:
+        print("    " + step)
+    helper.close()
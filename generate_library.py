@@ -0,0 +1,211 @@
+import argparse, datetime, itertools, os, random, sys
+from SqliteHelper import SqliteHelper
+from import_books import BookImporter
+from migrations import ANALYZE_TABLES
+
+"""Generates synthetic booklist.db files for benchmarks.
+
+Authors, genres and series follow a Zipf-like skew, as in a real library: a few prolific authors and popular
+genres account for many of the books, with a long tail of authors who have one or two. About a third of the
+books belong to a series and a few have notes. Reminders are spread from a year ago to two years ahead, so
+there are past, upcoming and far-off release dates.
+
+Books go through BookImporter, so the file has the same schema, normalized keys, full-text index and
+near-duplicate signatures as a library built by the program. The same seed always produces the same library.
+
+    python generate_library.py bench_100k.db --books 100k
+    python generate_library.py bench_1m.db --books 1M --reminders 5000 --seed 7
+
+FUNCTIONS:
+    generate_library(path, books, reminders = None, seed = 1, progress = None)
+        Creates a new database file with the given number of books and reminders and returns the ImportReport
+
+    book_records(count, seed = 1)
+        Yields count book dictionaries with unique titles per author
+
+    parse_count(text)
+        Turns "10k", "100k" or "1M" into a whole number
+"""
+
+FIRST_NAMES = ("James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen", "Stephen",
+    "Nancy", "Daniel", "Lisa", "Matthew", "Margaret", "Anthony", "Sandra", "Mark", "Ashley", "Donald", "Emily",
+    "Paul", "Donna", "Andrew", "Michelle", "Joshua", "Carol", "Kenneth", "Amanda", "Kevin", "Melissa", "Brian",
+    "Deborah", "George", "Rebecca", "Neil", "Laura", "Terry", "Ursula", "Agatha", "Colleen", "Haruki", "Isabel",
+    "Chimamanda", "Kazuo", "Octavia", "Toni", "Gabriel", "Leigh")
+
+LAST_NAMES = ("Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin", "Lee",
+    "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson", "Walker", "Young",
+    "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores", "Green", "Adams", "Nelson", "Baker",
+    "Hall", "Rivera", "Campbell", "Mitchell", "Carter", "Roberts", "Gaiman", "Pratchett", "Le Guin", "Christie",
+    "Hoover", "Murakami", "Allende", "Adichie", "Ishiguro", "Butler", "Morrison", "Marquez", "Bardugo", "Okafor",
+    "Jemisin", "Tolkien", "Austen", "Bronte", "Dickens", "Atwood", "Rowling", "Sanderson", "Hobb", "Jordan",
+    "Abercrombie", "Lawrence", "Kowal", "Leckie", "Wells", "Chambers")
+
+GENRES = ("Fiction", "Fantasy", "Mystery", "Romance", "Thriller", "Science Fiction", "Horror", "Historical Fiction",
+    "Young Adult", "Nonfiction", "Biography", "Literary Fiction", "Crime", "Memoir", "Self Help", "History",
+    "Poetry", "Graphic Novel", "Humor", "Travel", "Classics", "Short Stories", "Science", "Philosophy", "Cooking")
+
+TITLE_WORDS = ("Shadow", "River", "Night", "Fire", "Stone", "House", "Garden", "Winter", "Summer", "Crown", "Blood",
+    "Star", "Sea", "Storm", "Silence", "Memory", "Glass", "Iron", "Ghost", "Light", "Road", "Island", "City",
+    "Forest", "Mountain", "Queen", "King", "Daughter", "Son", "Wolf", "Raven", "Dragon", "Secret", "Promise",
+    "Letter", "Library", "Mirror", "Clock", "Bridge", "Door", "Key", "Song", "Dream", "Lie", "Truth", "Heart",
+    "Bone", "Ash", "Salt", "Thorn", "Moon", "Sun", "Tide", "Harbor", "Empire", "Witch", "Thief", "Sword", "Map",
+    "Orchard", "Lantern", "Tower", "Hollow", "Ember", "Frost", "Echo", "Veil", "Wings", "Ruin", "Kingdom")
+
+TITLE_ADJECTIVES = ("Silent", "Last", "Broken", "Hidden", "Lost", "Burning", "Golden", "Dark", "Quiet", "Wild",
+    "Forgotten", "Midnight", "Little", "Long", "Bright", "Cold", "Crimson", "Secret", "Distant", "Final", "Empty",
+    "Endless", "Fallen", "Invisible", "Scarlet", "Sleeping", "Wicked", "Silver", "Stolen", "Strange")
+
+TITLE_PATTERNS = ("The {adjective} {noun}", "{noun} of {noun2}", "The {noun} and the {noun2}", "A {adjective} {noun}",
+    "{adjective} {noun}", "The {noun}'s {noun2}", "{noun} and {noun2}", "Before the {noun}", "The {noun} Keeper",
+    "Children of the {noun}", "{adjective} {noun}: A Novel", "The {adjective} {noun} of {noun2}")
+
+SERIES_SUFFIXES = ("Chronicles", "Saga", "Cycle", "Trilogy", "Mysteries", "Quartet", "Sequence", "Files")
+
+NOTE_TEXTS = ("Signed copy", "Borrowed from the library", "Lent to a friend", "Reread every winter", "Book club pick",
+    "Gift", "Audiobook", "Did not finish", "Favourite", "Ebook only")
+
+RATING_WEIGHTS = (8, 3, 6, 20, 35, 28) #ratings 0-5; unrated and low ratings are rarer than 3-5
+
+def parse_count(text):
+    """Turns "10k", "100k" or "1M" (or a plain number) into a whole number"""
+
+    text = str(text).strip().lower()
+    for suffix, factor in (("k", 1000), ("m", 1000000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+def zipf_weights(count, exponent = 1.1):
+    """Returns cumulative weights for picking one of count items with a Zipf-like skew (item 0 the most common)"""
+
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+def make_authors(rng, count):
+    """Returns count distinct author names (up to about 380,000)"""
+
+    names = set()
+    while len(names) < count:
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        if len(names) < len(FIRST_NAMES) * len(LAST_NAMES) // 2:
+            names.add(first + " " + last)
+        else:
+            middle = rng.choice(FIRST_NAMES) if rng.random() < 0.5 else rng.choice("ABCDEFGHIJKLMNOPRSTW") + "."
+            names.add(first + " " + middle + " " + last)
+    names = sorted(names)
+    rng.shuffle(names)
+    return names
+
+def make_title(rng):
+    """Returns a title built from one of the title patterns"""
+
+    return rng.choice(TITLE_PATTERNS).format(adjective = rng.choice(TITLE_ADJECTIVES), noun = rng.choice(TITLE_WORDS),
+        noun2 = rng.choice(TITLE_WORDS))
+
+def book_records(count, seed = 1):
+    """Yields count book dictionaries (title, author, rating, genre, series, notes) with unique titles per author.
+
+    Parameters:
+        count (int) - number of books
+        seed (int) - random seed; the same seed always yields the same books
+    """
+
+    rng = random.Random(seed)
+    authors = make_authors(rng, max(20, count // 8))
+    author_weights = zipf_weights(len(authors), 0.75)
+    genre_weights = zipf_weights(len(GENRES), 0.9)
+
+    series_names = set()
+    while len(series_names) < max(10, count // 40):
+        kind = rng.random()
+        if kind < 0.5:
+            series_names.add("The " + rng.choice(TITLE_WORDS) + " " + rng.choice(SERIES_SUFFIXES))
+        elif kind < 0.8:
+            series_names.add(rng.choice(TITLE_ADJECTIVES) + " " + rng.choice(TITLE_WORDS))
+        else: #the two short patterns only give a few thousand names; large libraries need more series than that
+            series_names.add(make_title(rng) + " " + rng.choice(SERIES_SUFFIXES))
+    series_names = sorted(series_names)
+    series_weights = zipf_weights(len(series_names))
+
+    used = set() #(title, author) pairs already yielded
+    author_series = {} #author: the series their series books belong to
+    for book_number in range(count):
+        author = rng.choices(authors, cum_weights = author_weights)[0]
+        title = make_title(rng)
+        while (title.lower(), author) in used:
+            title = make_title(rng) if rng.random() < 0.8 else title + " " + rng.choice(("II", "III", "IV", "Returns", "Reborn"))
+        used.add((title.lower(), author))
+
+        series = ""
+        if rng.random() < 0.35:
+            series = author_series.get(author)
+            if series is None:
+                series = author_series[author] = rng.choices(series_names, cum_weights = series_weights)[0]
+
+        yield {
+            "title": title,
+            "author": author,
+            "rating": rng.choices(range(6), RATING_WEIGHTS)[0],
+            "genre": rng.choices(GENRES, cum_weights = genre_weights)[0] if rng.random() < 0.9 else "",
+            "series": series,
+            "notes": rng.choice(NOTE_TEXTS) if rng.random() < 0.1 else "",
+        }
+
+def reminder_rows(count, seed = 1):
+    """Yields count (title, author, date) reminders dated from a year ago to two years ahead"""
+
+    rng = random.Random(seed + 1)
+    today = datetime.date.today()
+    authors = make_authors(rng, max(10, count // 4))
+    for reminder_number in range(count):
+        date = today + datetime.timedelta(days = rng.randint(-365, 730))
+        yield make_title(rng), rng.choice(authors), date.isoformat()
+
+def generate_library(path, books, reminders = None, seed = 1, progress = None):
+    """Creates a new database file with the given number of books and reminders and returns the ImportReport.
+
+    Parameters:
+        path (string) - database file to create; an existing file is replaced
+        books (int) - number of books
+        reminders (int) - number of reminders; one per hundred books (at least 20) when None
+        seed (int) - random seed
+        progress (callable) - called with an ImportReport after every batch of books
+    """
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    if reminders is None:
+        reminders = max(20, books // 100)
+
+    helper = SqliteHelper(path, "bulk-load")
+    try:
+        report = BookImporter(helper, 10000, progress).import_records(book_records(books, seed))
+        with helper.transaction():
+            helper.cursor.executemany("INSERT INTO calendar (title, author, date) VALUES (?, ?, ?)", reminder_rows(reminders, seed))
+        with helper.transaction():
+            for table in ANALYZE_TABLES: #the tables migrate() analyzes; never the FTS5 shadow tables
+                helper.cursor.execute("ANALYZE " + table)
+        helper.cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        helper.close()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate a synthetic MyBookMgr database for benchmarks")
+    parser.add_argument("path", help = "database file to create (replaced if it exists)")
+    parser.add_argument("--books", default = "10k", help = "number of books, e.g. 10k, 100k or 1M (default 10k)")
+    parser.add_argument("--reminders", type = int, help = "number of reminders (default one per hundred books)")
+    parser.add_argument("--seed", type = int, default = 1)
+    args = parser.parse_args()
+
+    def print_progress(report):
+        print("{0.inserted} books ({1:.0f} records/s)".format(report, report.rate), file = sys.stderr)
+
+    report = generate_library(args.path, parse_count(args.books), args.reminders, args.seed, print_progress)
+    print("{0.inserted} books written to {1} in {0.seconds:.1f}s".format(report, args.path), file = sys.stderr)
@@ -0,0 +1,314 @@
+import csv, json, os, re, sys, time
+from collections import namedtuple
+from shared import clean_book_details
+from normalize import normalize_many
+import duplicates
+from SqliteHelper import BOOK_INSERT
+
+"""Streams book records from CSV, JSON or Goodreads export files into the books table.
+
+Records are read one at a time, cleaned with the same rules as the Add Book form, checked for duplicates
+a whole batch at a time and inserted with executemany. The import runs in a single transaction, so the
+database is synced once at the end instead of once per book. Only one batch is held in memory, so memory
+use does not grow with the size of the input file.
+
+FUNCTIONS:
+    read_csv(path)
+        Yields one dictionary per row of a CSV file with title, author, rating, genre, series and notes columns
+
+    read_goodreads(path)
+        Yields one dictionary per row of a Goodreads library export
+
+    read_json(path)
+        Yields one dictionary per object in a JSON Lines file or a JSON array
+
+    detect_format(path)
+        Works out which reader to use from the file extension and CSV header
+"""
+
+class ImportReport(namedtuple("ImportReport", ["read", "inserted", "duplicates", "skipped", "seconds"])):
+    """Progress of an import.
+
+    read (int) - records read from the input
+    inserted (int) - books added to the database
+    duplicates (int) - records skipped because the book (normalized title and author) is already in the database or earlier in the file
+    skipped (int) - records skipped because the title or author is blank or the rating is not a number
+    seconds (float) - time since the import started
+    """
+
+    @property
+    def rate(self):
+        """Returns the number of records read per second"""
+
+        if self.seconds <= 0:
+            return 0.0
+        return self.read / self.seconds
+
+GOODREADS_SERIES = re.compile(r"^(?P<title>.*?)\s*\((?P<series>[^()]*?),?\s*#[\d.\-]+\)\s*$")
+GOODREADS_STATUS_SHELVES = {"read", "to-read", "currently-reading"}
+
+def lower_keys(row):
+    """Returns a copy of the dictionary with lower-case, stripped keys"""
+
+    return {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+def read_csv(path):
+    """Yields one dictionary per row of a CSV file with title, author, rating, genre, series and notes columns.
+    Column names are not case sensitive and missing columns are treated as blank.
+    """
+
+    with open(path, newline = "", encoding = "utf-8-sig") as csv_file:
+        for row in csv.DictReader(csv_file):
+            yield lower_keys(row)
+
+def read_goodreads(path):
+    """Yields one dictionary per row of a Goodreads library export.
+
+    The series is taken from the "(Series Name, #2)" suffix Goodreads adds to titles, the genre from the
+    first shelf that is not a reading-status shelf, and the notes from Private Notes (or My Review).
+    """
+
+    with open(path, newline = "", encoding = "utf-8-sig") as csv_file:
+        for row in csv.DictReader(csv_file):
+            row = lower_keys(row)
+            title = row.get("title", "")
+            series = ""
+
+            match = GOODREADS_SERIES.match(title)
+            if match:
+                title = match.group("title")
+                series = match.group("series")
+
+            shelves = [shelf.strip() for shelf in row.get("bookshelves", "").split(",")]
+            genres = [shelf for shelf in shelves if shelf and shelf not in GOODREADS_STATUS_SHELVES]
+
+            yield {
+                "title": title,
+                "author": row.get("author", ""),
+                "rating": row.get("my rating", ""),
+                "genre": genres[0].replace("-", " ") if genres else "",
+                "series": series,
+                "notes": row.get("private notes") or row.get("my review") or "",
+            }
+
+def read_json(path, chunk_size = 65536):
+    """Yields one dictionary per object in a JSON Lines file or a JSON array.
+
+    A top-level array is decoded one element at a time from fixed-size chunks of the file,
+    so the whole document is never held in memory.
+    """
+
+    decoder = json.JSONDecoder()
+
+    with open(path, encoding = "utf-8-sig") as json_file:
+        buffer = json_file.read(chunk_size).lstrip()
+        in_array = buffer.startswith("[")
+        if in_array:
+            buffer = buffer[1:]
+
+        while True:
+            buffer = buffer.lstrip().lstrip(",").lstrip()
+
+            if in_array and buffer.startswith("]"):
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer)
+            except ValueError:
+                more = json_file.read(chunk_size)
+                if more == "":
+                    if buffer.strip() != "":
+                        raise ValueError("Unexpected end of JSON input in " + path)
+                    return
+                buffer += more
+                continue
+
+            if isinstance(record, dict):
+                yield lower_keys(record)
+            buffer = buffer[end:]
+
+def detect_format(path):
+    """Works out which reader to use from the file extension and CSV header.
+
+    Returns one of "csv", "goodreads" or "json"
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".json", ".jsonl", ".ndjson"):
+        return "json"
+
+    with open(path, newline = "", encoding = "utf-8-sig") as csv_file:
+        header = [column.strip().lower() for column in next(csv.reader(csv_file), [])]
+
+    if "book id" in header and "my rating" in header:
+        return "goodreads"
+    return "csv"
+
+READERS = {"csv": read_csv, "goodreads": read_goodreads, "json": read_json}
+
+
+class BookImporter:
+    """Imports books in large batches inside a single transaction.
+
+    METHODS:
+        __init__(self, helper, batch_size = 5000, progress = None)
+            Stores the database helper, batch size and optional progress callback
+
+        import_file(self, path, file_format = None)
+            Imports every record in the file and returns an ImportReport
+
+        import_records(self, records)
+            Imports books from any iterable of dictionaries and returns an ImportReport
+
+        insert_batch(self, batch)
+            Drops books that already exist and inserts the rest of the batch with executemany
+    """
+
+    def __init__(self, helper, batch_size = 5000, progress = None):
+        """Stores the database helper, batch size and optional progress callback.
+
+        Parameters:
+            helper: reference to the sqlite object created by SqliteHelper class
+            batch_size (int) - number of records checked and inserted together
+            progress (callable) - called with an ImportReport after every batch
+        """
+
+        self.helper = helper
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def import_file(self, path, file_format = None):
+        """Imports every record in the file and returns an ImportReport.
+
+        Parameters:
+            path (string) - file to import
+            file_format (string) - "csv", "goodreads" or "json"; detected from the file when None
+        """
+
+        if file_format is None:
+            file_format = detect_format(path)
+        return self.import_records(READERS[file_format](path))
+
+    def import_records(self, records):
+        """Imports books from any iterable of dictionaries and returns an ImportReport.
+        The connection is switched to the "bulk-load" profile for the import and back afterwards.
+
+        Raises sqlite3.Error if the database write fails; nothing from the import is kept in that case.
+        """
+
+        self.started = time.perf_counter()
+        self.read = self.inserted = self.duplicates = self.skipped = 0
+
+        self.helper.migrate() #brings a new or old database up to the current schema
+        previous_profile = self.helper.apply_profile("bulk-load")
+        c = self.helper.conn.cursor()
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS import_keys (title_norm TEXT NOT NULL, author_norm TEXT NOT NULL)")
+
+        self.helper.track_changes = False
+        try:
+            with self.helper.transaction():
+                batch = []
+                for record in records:
+                    self.read += 1
+
+                    try:
+                        book = clean_book_details(record.get("title", ""), record.get("author", ""), record.get("rating", ""),
+                            record.get("genre", ""), record.get("series", ""), record.get("notes", ""))
+                    except ValueError:
+                        self.skipped += 1
+                        continue
+
+                    if book[0].strip(" ") == "" or book[1].strip(" ") == "":
+                        self.skipped += 1
+                        continue
+
+                    batch.append((book, str(record.get("title", "")))) #the title as read still shows where a subtitle starts
+                    if len(batch) >= self.batch_size:
+                        self.insert_batch(batch)
+                        batch = []
+
+                if len(batch) > 0:
+                    self.insert_batch(batch)
+
+                c.execute("DROP TABLE IF EXISTS temp.import_keys")
+        finally:
+            self.helper.track_changes = True
+            self.helper.apply_profile(previous_profile)
+
+        if self.inserted > 0:
+            self.helper.notify_reload("books")
+        return self.report()
+
+    def insert_batch(self, batch):
+        """Drops books that already exist and inserts the rest of the batch with executemany.
+
+        Titles and authors are normalized for the whole batch at once. The keys are loaded into a temporary
+        table and joined against the (title_norm, author_norm) index, so the duplicate check is one query
+        per batch instead of one query per book.
+
+        The near-duplicate signatures are computed from the titles as they were read, so a subtitle after ":"
+        or "(" (common in Goodreads exports) is recognised even though the saved title has lost that punctuation.
+
+        Parameters:
+            batch (list) - (cleaned book tuple, title as read) pairs
+        """
+
+        keys = zip(normalize_many(book[0] for book, title in batch), normalize_many(book[1] for book, title in batch))
+        rows = {}
+        typed_titles = {}
+        for (book, title), key in zip(batch, keys):
+            if key in rows:
+                self.duplicates += 1
+            else:
+                rows[key] = book + key
+                typed_titles[key] = title
+
+        c = self.helper.conn.cursor()
+        c.execute("DELETE FROM temp.import_keys")
+        c.executemany("INSERT INTO temp.import_keys (title_norm, author_norm) VALUES (?, ?)", rows.keys())
+        #CROSS JOIN keeps the batch as the outer loop, so each key is one probe of the books index even when
+        #the planner's statistics were gathered while the library was still small
+        c.execute("""SELECT DISTINCT k.title_norm, k.author_norm FROM temp.import_keys k
+            CROSS JOIN books b ON b.title_norm = k.title_norm AND b.author_norm = k.author_norm""")
+
+        for key in c.fetchall():
+            del rows[key]
+            self.duplicates += 1
+
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM books")
+        last_id = c.fetchone()[0]
+        c.executemany(BOOK_INSERT, rows.values())
+        self.inserted += len(rows)
+
+        #the new ids follow last_id in the order the rows were inserted
+        c.execute("SELECT id FROM books WHERE id > ? ORDER BY id", (last_id,))
+        duplicates.index_books(self.helper.conn.cursor(),
+            [(book_id, typed_titles[key], row[1]) for (book_id,), (key, row) in zip(c.fetchall(), rows.items())])
+
+        if self.progress:
+            self.progress(self.report())
+
+    def report(self):
+        """Returns an ImportReport for the import so far"""
+
+        return ImportReport(self.read, self.inserted, self.duplicates, self.skipped, time.perf_counter() - self.started)
+
+
+if __name__ == "__main__":
+    import argparse
+    from SqliteHelper import SqliteHelper
+
+    parser = argparse.ArgumentParser(description = "Import books into a MyBookMgr database")
+    parser.add_argument("path", help = "CSV, JSON/JSON Lines or Goodreads export file")
+    parser.add_argument("--format", choices = sorted(READERS), help = "input format (detected when omitted)")
+    parser.add_argument("--db", default = "booklist.db", help = "database file (default booklist.db)")
+    parser.add_argument("--batch-size", type = int, default = 5000)
+    args = parser.parse_args()
+
+    def print_progress(report):
+        print("{0.read} read, {0.inserted} added, {0.duplicates} duplicates, {0.skipped} skipped ({1:.0f} records/s)".format(report, report.rate), file = sys.stderr)
+
+    helper = SqliteHelper(args.db)
+    importer = BookImporter(helper, args.batch_size, print_progress)
+    print_progress(importer.import_file(args.path, args.format))
+    print("{0.commits} commits, {0.seconds:.3f}s spent committing".format(helper.commit_stats()), file = sys.stderr)
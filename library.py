@@ -0,0 +1,413 @@
+import datetime
+from collections import namedtuple
+from SqliteHelper import SqliteHelper
+from duplicates import DuplicateIndex
+from filter_query import compile_filter, check_plan
+from export_books import BookExporter, EXPORT_COLUMNS
+from shared import clean_book_details, clean_reminder_details
+
+"""Qt-free book library operations, shared by the command-line tool and the GUI's database requests.
+
+Nothing in this module imports PyQt5, so scripts and cron jobs can use it without a display.
+
+FUNCTIONS:
+    open_library(name = "booklist.db", profile = "desktop")
+        Opens the database, brings its schema up to date and returns a Library
+"""
+
+
+AddResult = namedtuple("AddResult", ["book_id", "duplicates", "similar"])
+AddResult.__doc__ = """Outcome of Library.add_book().
+
+    book_id (int) - id of the new book, or None if it was not added
+    duplicates (list) - ids of books with the same normalized title and author
+    similar (list) - (score, id, title, author) tuples from DuplicateIndex.find_similar()
+"""
+
+def open_library(name = "booklist.db", profile = "desktop"):
+    """Opens the database, brings its schema up to date and returns a Library.
+
+    Parameters:
+        name (string) - database file name
+        profile (string) - connection profile from SqliteHelper.PROFILES
+    """
+
+    helper = SqliteHelper(name, profile)
+    helper.migrate()
+    return Library(helper)
+
+
+class Library:
+    """Book and reminder operations on one database, without any user interface.
+
+    METHODS:
+        __init__(self, helper)
+            Stores the database helper and creates the near-duplicate index
+
+        check_book(self, title, author)
+            Returns the exact duplicates and the similar books for a book that is about to be added
+
+        add_book(self, title, author, rating = 0, genre = "", series = "", notes = "", allow_similar = False)
+            Cleans the details and adds the book unless it is already in the library
+
+        book(self, book_id)
+            Returns one book, or None if there is no book with that id
+
+        books(self, after = 0, limit = 100)
+            Returns a page of books in id order, starting after the given id
+
+        update_book(self, book_id, rating = None, genre = None, series = None, notes = None)
+            Cleans and saves the details that can be edited after a book is added, and returns True if the book exists
+
+        delete_book(self, book_id)
+            Deletes a book and returns True if it existed
+
+        import_file(self, path, file_format = None, batch_size = 5000, progress = None)
+            Imports a CSV, JSON or Goodreads file and returns an ImportReport
+
+        export(self, out, file_format = "csv", table = "books", snapshot = True)
+            Writes every row of a table to an open text file and returns the number written
+
+        export_file(self, path, file_format = None, tables = ("books",), compress = None, snapshot = True, progress = None)
+            Writes the tables to CSV or JSON Lines files, or copies the whole database, and returns an ExportReport
+
+        search(self, text, limit = 50)
+            Returns the books that best match the search text
+
+        filter(self, category, value)
+            Yields the books whose category (author, rating, genre or series) equals the value
+
+        query(self, expression, after = 0, limit = 100)
+            Returns the normalized query and a page of the books that match a filter query, in id order
+
+        explain_query(self, expression)
+            Returns the FilterPlan of a filter query, to check that it is answered from an index
+
+        stats(self, limit = 10)
+            Returns a dictionary of totals for the library, read from the book_stats summary
+
+        category_stats(self, category, limit = None, by_count = True)
+            Returns the (value, books, average rating) rows for author, genre, series or rating
+
+        check_stats(self)
+            Returns the summary rows that do not match the books table
+
+        rebuild_stats(self)
+            Recomputes the summary from the books table and returns the number of rows
+
+        duplicate_keys(self)
+            Returns the books left sharing a title and author by an upgrade, while the duplicate check index is not UNIQUE
+
+        restore_unique_keys(self)
+            Makes the duplicate check index UNIQUE again once no books share a title and author
+
+        reminders(self)
+            Returns every reminder, earliest date first
+
+        upcoming_reminders(self, days = 30, today = None)
+            Returns the active reminders due from today to the given number of days ahead
+
+        overdue_reminders(self, today = None)
+            Returns the active reminders whose release date has passed
+
+        archived_reminders(self, limit = None)
+            Returns the archived reminders, most recent release first
+
+        archive_reminder(self, reminder_id, archived = True)
+            Archives a reminder (or makes it active again) and returns True if it exists
+
+        add_reminder(self, title, author, date)
+            Cleans the details, adds a reminder and returns its id
+
+        delete_reminder(self, reminder_id)
+            Deletes a reminder and returns True if it existed
+    """
+
+    def __init__(self, helper):
+        """Stores the database helper and creates the near-duplicate index.
+
+        Parameters:
+            helper: reference to the sqlite object created by SqliteHelper class (already migrated)
+        """
+
+        self.helper = helper
+        self.duplicate_index = DuplicateIndex(helper)
+
+    def check_book(self, title, author):
+        """Returns the exact duplicates and the similar books for a book that is about to be added.
+
+        The similar books are only looked up when there is no exact duplicate. Pass the title as typed, before
+        its punctuation is removed, so a subtitle after ":" or "(" is recognised ("The Shining: A Novel").
+
+        Returns tuple of (list of (id,) tuples, list of (score, id, title, author) tuples)
+        """
+
+        dupe_id = self.helper.find_duplicates(title, author)
+        if len(dupe_id) > 0:
+            return dupe_id, []
+        return dupe_id, self.duplicate_index.find_similar(title, author)
+
+    def add_book(self, title, author, rating = 0, genre = "", series = "", notes = "", allow_similar = False):
+        """Cleans the details and adds the book unless it is already in the library.
+
+        Parameters:
+            title, author, rating, genre, series, notes - book details as typed by the user
+            allow_similar (bool) - add the book even if it looks like one already in the library
+
+        Returns AddResult (book_id is None if the book was not added)
+
+        Raises ValueError if the title or author is blank or the rating is not a whole number
+        """
+
+        book = clean_book_details(title, author, rating, genre, series, notes)
+        if book[0].strip(" ") == "" or book[1].strip(" ") == "":
+            raise ValueError("A book needs a title and an author")
+
+        dupe_id, similar = self.check_book(str(title), book[1]) #the typed title still shows where a subtitle starts
+        if len(dupe_id) > 0 or (len(similar) > 0 and not allow_similar):
+            return AddResult(None, [row[0] for row in dupe_id], similar)
+        return AddResult(self.helper.insert_book(book, str(title)), [], similar)
+
+    def book(self, book_id):
+        """Returns the (id, title, author, rating, genre, series, notes) tuple for a book, or None if there is no book with that id"""
+
+        books = self.helper.sort_items("SELECT " + ", ".join(EXPORT_COLUMNS) + " FROM books WHERE id = ?", (int(book_id),))
+        return books[0] if books else None
+
+    def books(self, after = 0, limit = 100):
+        """Returns up to limit (id, title, author, rating, genre, series, notes) tuples with ids above after, in id order.
+
+        Pass the last id of one page as after to read the next; each page is a seek on the primary key.
+        """
+
+        return self.helper.sort_items("SELECT " + ", ".join(EXPORT_COLUMNS) + " FROM books WHERE id > ? ORDER BY id LIMIT ?",
+            (int(after), int(limit)))
+
+    def update_book(self, book_id, rating = None, genre = None, series = None, notes = None):
+        """Cleans and saves the details that can be edited after a book is added, and returns True if the book exists.
+
+        As in the Update Book form, the title and author cannot be changed. Details passed as None keep their value.
+
+        Raises ValueError if the rating is not a whole number
+        """
+
+        with self.helper.transaction():
+            book = self.book(book_id)
+            if book is None:
+                return False
+            details = [current if new is None else new for current, new in zip(book[3:], (rating, genre, series, notes))]
+            details = clean_book_details(book[1], book[2], *details)[2:]
+            self.helper.update("UPDATE books SET rating = ?, genre = ?, series = ?, notes = ? WHERE id = ?", details + (book[0],))
+        return True
+
+    def delete_book(self, book_id):
+        """Deletes a book and returns True if it existed"""
+
+        c = self.helper.cursor
+        with self.helper.transaction():
+            c.execute("DELETE FROM books WHERE id = ?", (int(book_id),))
+            return c.rowcount > 0
+
+    def import_file(self, path, file_format = None, batch_size = 5000, progress = None):
+        """Imports a CSV, JSON or Goodreads file and returns an ImportReport.
+
+        Parameters:
+            path (string) - file to import
+            file_format (string) - "csv", "goodreads" or "json"; detected from the file when None
+            batch_size (int) - number of records checked and inserted together
+            progress (callable) - called with an ImportReport after every batch
+        """
+
+        from import_books import BookImporter #csv/json readers are only loaded when importing
+        return BookImporter(self.helper, batch_size, progress).import_file(path, file_format)
+
+    def export(self, out, file_format = "csv", table = "books", snapshot = True):
+        """Writes every row of a table to an open text file and returns the number written.
+
+        Rows are read in id order with fetchmany, so the whole library is never held in memory (see export_books.py).
+
+        Parameters:
+            out - text file object opened for writing (newline = "" for CSV)
+            file_format (string) - "csv" (with a header row) or "jsonl" (one JSON object per line)
+            table (string) - "books" or "calendar"
+            snapshot (bool) - read from a snapshot that edits made during the export do not change
+
+        Raises ValueError if the format or table cannot be exported to a stream
+        """
+
+        return BookExporter(self.helper, snapshot = snapshot).export_stream(out, file_format, table)
+
+    def export_file(self, path, file_format = None, tables = ("books",), compress = None, snapshot = True, progress = None):
+        """Writes the tables to CSV or JSON Lines files, or copies the whole database, and returns an ExportReport.
+
+        Parameters:
+            path (string) - output file; with more than one table the table name is added before the extension
+            file_format (string) - "csv", "jsonl" or "sqlite"; detected from the path when None
+            tables (tuple) - tables from EXPORT_TABLES
+            compress (bool) - write through gzip; True when the path ends in .gz if None
+            snapshot (bool) - read every table from one snapshot, so the files agree with each other
+            progress (callable) - called with an ExportReport as the export runs
+
+        Raises ValueError if the format or a table cannot be exported
+        """
+
+        return BookExporter(self.helper, snapshot = snapshot, progress = progress).export_file(path, file_format, tables, compress)
+
+    def search(self, text, limit = 50):
+        """Returns the books that best match the search text (see SqliteHelper.search())"""
+
+        return self.helper.search(text, limit)
+
+    def filter(self, category, value):
+        """Yields the books whose category (author, rating, genre or series) equals the value.
+
+        Raises ValueError if the category is not one of FILTER_CATEGORIES
+        """
+
+        if category == "rating":
+            value = int(value)
+        return self.helper.filter_items(category, value)
+
+    def query(self, expression, after = 0, limit = 100):
+        """Returns the normalized query and a page of the books that match a filter query, in id order.
+
+        The query language is described in filter_query.py, e.g. 'author:"Stephen King" rating>=4 -series:""'.
+        Pass the last id of one page as after to read the next.
+
+        Returns tuple of (normalized query string, list of book tuples)
+
+        Raises ValueError (FilterSyntaxError) if the query cannot be parsed
+        """
+
+        compiled = compile_filter(expression)
+        where = "(" + compiled.condition + ") AND " if compiled.condition else ""
+        books = self.helper.sort_items("SELECT " + ", ".join(EXPORT_COLUMNS) + " FROM books WHERE " + where + "id > ? ORDER BY id LIMIT ?",
+            compiled.parameters + (int(after), int(limit)))
+        return compiled.expression, books
+
+    def explain_query(self, expression):
+        """Returns the FilterPlan (EXPLAIN QUERY PLAN steps, and whether every book is read) of a filter query.
+
+        Raises ValueError (FilterSyntaxError) if the query cannot be parsed
+        """
+
+        compiled = compile_filter(expression)
+        return check_plan(self.helper, compiled.condition, compiled.parameters)
+
+    def stats(self, limit = 10):
+        """Returns a dictionary of totals for the library, read from the book_stats summary.
+
+        Keys: books, reminders, average_rating, ratings ({rating: count}), and authors, genres and series (the
+        largest, as lists of [value, count, average rating]; books without a genre or series are not listed).
+        Only summary rows are read, so the time taken does not grow with the library.
+
+        Parameters:
+            limit (int) - number of authors, genres and series listed
+        """
+
+        books, average = self.helper.book_totals()
+        stats = {
+            "books": books,
+            "reminders": self.helper.select("SELECT COUNT(*) FROM calendar WHERE archived = 0")[0][0],
+            "average_rating": average,
+            "ratings": dict((rating, count) for rating, count, rating_average in self.helper.category_stats("rating", by_count = False)),
+        }
+        for category, key in (("author", "authors"), ("genre", "genres"), ("series", "series")):
+            rows = self.helper.category_stats(category, limit + 1) #one extra in case the blank value is among them
+            stats[key] = [list(row) for row in rows if row[0] != ""][:limit]
+        return stats
+
+    def category_stats(self, category, limit = None, by_count = True):
+        """Returns the (value, books, average rating) rows for author, genre, series or rating (see SqliteHelper.category_stats())
+
+        Raises ValueError if the category is not one of STATS_CATEGORIES
+        """
+
+        return self.helper.category_stats(category, limit, by_count)
+
+    def check_stats(self):
+        """Returns a StatsMismatch for every summary row that does not match the books table; empty when they agree"""
+
+        return self.helper.check_stats()
+
+    def rebuild_stats(self):
+        """Recomputes the summary from the books table and returns the number of rows"""
+
+        return self.helper.rebuild_stats()
+
+    def duplicate_keys(self):
+        """Returns the books left sharing a title and author by an upgrade, while the duplicate check index is not UNIQUE.
+
+        Returns list of (title_norm, author_norm, list of ids) tuples; empty when the index is UNIQUE
+        """
+
+        return self.helper.duplicate_keys()
+
+    def restore_unique_keys(self):
+        """Makes the duplicate check index UNIQUE again once no books share a title and author; returns True if it was rebuilt"""
+
+        return self.helper.restore_unique_keys()
+
+    def reminders(self):
+        """Returns every reminder as (id, date, title, author) tuples, earliest date first"""
+
+        return self.helper.select("SELECT id, date, title, author FROM calendar ORDER BY date, id")
+
+    def upcoming_reminders(self, days = 30, today = None):
+        """Returns the active reminders due from today to the given number of days ahead, earliest first.
+
+        Parameters:
+            days (int) - size of the window
+            today (datetime.date) - start of the window; the current date when None
+        """
+
+        today = today or datetime.date.today()
+        return self.helper.reminders_between(today.isoformat(), (today + datetime.timedelta(days = days)).isoformat())
+
+    def overdue_reminders(self, today = None):
+        """Returns the active reminders whose release date is before today, earliest first"""
+
+        today = today or datetime.date.today()
+        return self.helper.reminders_between("", (today - datetime.timedelta(days = 1)).isoformat())
+
+    def archived_reminders(self, limit = None):
+        """Returns the archived reminders, most recent release first; limit is applied in SQLite, so only that many are read"""
+
+        return self.helper.reminders_between("", "9999-12-31", archived = True, limit = limit, descending = True)
+
+    def archive_reminder(self, reminder_id, archived = True):
+        """Archives a reminder (or makes it active again) and returns True if it exists"""
+
+        reminder_id = int(reminder_id)
+        if len(self.helper.sort_items("SELECT id FROM calendar WHERE id = ?", (reminder_id,))) == 0:
+            return False
+        self.helper.archive_reminders([reminder_id], archived)
+        return True
+
+    def add_reminder(self, title, author, date):
+        """Cleans the details, adds a reminder and returns its id.
+
+        Parameters:
+            title (string) - title of the upcoming book
+            author (string) - author of the upcoming book
+            date (string) - release date as yyyy-MM-dd
+
+        Raises ValueError if the title or author is blank
+        """
+
+        title, author = clean_reminder_details(title, author)
+        if title.strip(" ") == "" or author.strip(" ") == "":
+            raise ValueError("A reminder needs a title and an author")
+
+        c = self.helper.cursor
+        with self.helper.transaction():
+            c.execute("INSERT INTO calendar (title, author, date) VALUES (?, ?, ?)", (title, author, date))
+            return c.lastrowid
+
+    def delete_reminder(self, reminder_id):
+        """Deletes a reminder and returns True if it existed"""
+
+        c = self.helper.cursor
+        with self.helper.transaction():
+            c.execute("DELETE FROM calendar WHERE id = ?", (int(reminder_id),))
+            return c.rowcount > 0
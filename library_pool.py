@@ -0,0 +1,255 @@
+import asyncio, os, re, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from library import open_library
+
+"""Keeps the most recently used libraries open for an asyncio server that serves many booklist databases.
+
+Each library is one SQLite file in the pool's directory, named after the library ("alice" is alice.db). Up to
+capacity libraries stay open, least recently used first out; libraries nobody has used for idle_seconds are
+closed by a background task, so a server with thousands of users only holds the files of the active ones.
+
+SQLite calls block, so they run on a bounded thread pool and never on the event loop. Reads of one library may
+run on several threads at once (each thread has its own connection, and WAL lets them read while another writes).
+Writes to one library are queued on an asyncio lock and run one at a time, so they never wait on SQLite's file
+lock or fail with "database is locked"; writes to different libraries still run in parallel.
+
+    pool = LibraryPool("libraries", capacity = 64, idle_seconds = 300, threads = 8)
+    pool.start()
+    books = await pool.run("alice", Library.search, "king")
+    result = await pool.run("alice", Library.add_book, "It", "Stephen King", write = True)
+    await pool.close()
+"""
+
+LIBRARY_NAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+
+class PooledLibrary:
+    """One open library in a LibraryPool, with its write lock and usage counts.
+
+    METHODS:
+        __init__(self, name)
+            Creates the entry; library is set once the file has been opened on the thread pool
+    """
+
+    def __init__(self, name):
+        """Creates the entry; library is set once the file has been opened on the thread pool.
+
+        Parameters:
+            name (string) - library name
+        """
+
+        self.name = name
+        self.library = None
+        self.opening = None #future for the open, awaited by every request that arrives before it finishes
+        self.write_lock = asyncio.Lock()
+        self.users = 0 #requests running or queued on this library; it is only closed when this is 0
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+
+class LibraryPool:
+    """LRU pool of open libraries with idle eviction, a bounded thread pool and per-library write serialization.
+
+    The methods are called on the event loop's thread; only the SQLite work runs on the thread pool.
+
+    METHODS:
+        __init__(self, directory, capacity = 64, idle_seconds = 300, threads = 8, create = False)
+            Sets the folder, pool size, idle timeout and number of threads, and creates the thread pool
+
+        start(self)
+            Starts the background task that closes idle libraries
+
+        library_path(self, name)
+            Returns the database file for a library name
+
+        run(self, name, function, *args, write = False)
+            Runs function(library, *args) on the thread pool and returns its result
+
+        evict_idle(self)
+            Closes the libraries that have not been used for idle_seconds and returns how many were closed
+
+        stats(self)
+            Returns the pool's size, limits and counters as a dictionary
+
+        close(self)
+            Stops the eviction task, closes every library and shuts the thread pool down
+    """
+
+    def __init__(self, directory, capacity = 64, idle_seconds = 300, threads = 8, create = False):
+        """Sets the folder, pool size, idle timeout and number of threads, and creates the thread pool.
+
+        Parameters:
+            directory (string) - folder that holds one .db file per library
+            capacity (int) - most libraries kept open; more may be open for a moment while all of them are busy
+            idle_seconds (float) - libraries unused for this long are closed
+            threads (int) - threads that run SQLite work, shared by every library
+            create (bool) - create the database file for a library that does not exist yet
+        """
+
+        self.directory = directory
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.threads = threads
+        self.create = create
+        self.executor = ThreadPoolExecutor(max_workers = threads, thread_name_prefix = "library")
+        self.entries = OrderedDict() #name: PooledLibrary, least recently used first
+        self.eviction_task = None
+        self.opened = self.evicted = self.hits = 0
+
+    def start(self):
+        """Starts the background task that closes idle libraries"""
+
+        if self.eviction_task is None:
+            self.eviction_task = asyncio.ensure_future(self.evict_loop())
+
+    def library_path(self, name):
+        """Returns the database file for a library name.
+
+        Raises ValueError if the name could reach outside the pool's folder, LookupError if the library does not
+        exist and the pool does not create libraries
+        """
+
+        if not LIBRARY_NAME.match(name) or ".." in name:
+            raise ValueError("Invalid library name " + repr(name))
+        path = os.path.join(self.directory, name + ".db")
+        if not self.create and not os.path.exists(path):
+            raise LookupError("No library named " + repr(name))
+        return path
+
+    async def acquire(self, name):
+        """Returns the open PooledLibrary for a name, opening it on the thread pool first if it is not in the pool.
+
+        The caller must pass the entry to release() when it is done with it.
+        """
+
+        entry = self.entries.get(name)
+        if entry is None:
+            path = self.library_path(name)
+            entry = self.entries[name] = PooledLibrary(name)
+            entry.opening = asyncio.get_event_loop().run_in_executor(self.executor, open_library, path)
+            entry.opening.add_done_callback(partial(self.library_opened, entry))
+            self.opened += 1
+        else:
+            self.entries.move_to_end(name)
+            self.hits += 1
+
+        entry.users += 1
+        try:
+            if entry.library is None:
+                entry.library = await asyncio.shield(entry.opening) #a cancelled request leaves the open running for the others
+        except BaseException:
+            entry.users -= 1
+            raise
+
+        self.shrink()
+        return entry
+
+    def library_opened(self, entry, opening):
+        """Stores the Library once its file is open, or drops the entry if it could not be opened so the next request tries again"""
+
+        if not opening.cancelled() and opening.exception() is None:
+            entry.library = opening.result()
+        elif self.entries.get(entry.name) is entry:
+            del self.entries[entry.name]
+
+    def release(self, entry, locked = False, work = None):
+        """Marks a request on the entry as finished, releasing the write lock if the request held it"""
+
+        if work is not None and not work.cancelled():
+            work.exception() #retrieved, so a failure after the request was cancelled is not reported as never retrieved
+        if locked:
+            entry.write_lock.release()
+        entry.users -= 1
+        entry.requests += 1
+        entry.last_used = time.monotonic()
+
+    async def run(self, name, function, *args, write = False):
+        """Runs function(library, *args) on the thread pool and returns its result.
+
+        Parameters:
+            name (string) - library name
+            function (callable) - called with the library's Library and args, e.g. Library.search
+            args - further arguments for the function
+            write (bool) - the function writes; it waits for the library's earlier writes to finish first
+
+        Raises ValueError or LookupError from library_path(), or whatever the function raised
+        """
+
+        entry = await self.acquire(name)
+        locked = False
+        work = None
+        try:
+            if write:
+                await entry.write_lock.acquire()
+                locked = True
+            work = asyncio.get_event_loop().run_in_executor(self.executor, partial(function, entry.library, *args))
+            return await asyncio.shield(work)
+        finally:
+            if work is None or work.done():
+                self.release(entry, locked)
+            else: #the request was cancelled while its thread still runs: keep the library and lock until it ends
+                work.add_done_callback(lambda work: self.release(entry, locked, work))
+
+    def shrink(self):
+        """Closes the least recently used idle libraries until the pool is back at capacity"""
+
+        for name in list(self.entries):
+            if len(self.entries) <= self.capacity:
+                break
+            entry = self.entries[name]
+            if entry.users == 0 and entry.library is not None:
+                self.discard(entry)
+
+    def discard(self, entry):
+        """Removes an idle entry from the pool and closes its connections on the thread pool"""
+
+        del self.entries[entry.name]
+        self.evicted += 1
+        self.executor.submit(entry.library.helper.close_all)
+
+    def evict_idle(self):
+        """Closes the libraries that have not been used for idle_seconds and returns how many were closed"""
+
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [entry for entry in self.entries.values() if entry.users == 0 and entry.library is not None and entry.last_used < cutoff]
+        for entry in idle:
+            self.discard(entry)
+        return len(idle)
+
+    async def evict_loop(self):
+        """Calls evict_idle() every few seconds until the pool is closed"""
+
+        while True:
+            await asyncio.sleep(max(1.0, min(self.idle_seconds / 4, 30.0)))
+            self.evict_idle()
+
+    def stats(self):
+        """Returns the pool's size, limits and counters as a dictionary"""
+
+        return {
+            "open": len(self.entries),
+            "busy": sum(1 for entry in self.entries.values() if entry.users > 0),
+            "capacity": self.capacity,
+            "idle_seconds": self.idle_seconds,
+            "threads": self.threads,
+            "opened": self.opened,
+            "evicted": self.evicted,
+            "hits": self.hits,
+        }
+
+    async def close(self):
+        """Stops the eviction task, closes every library and shuts the thread pool down"""
+
+        if self.eviction_task is not None:
+            self.eviction_task.cancel()
+            self.eviction_task = None
+        for entry in list(self.entries.values()):
+            if entry.library is None:
+                try:
+                    entry.library = await entry.opening
+                except Exception:
+                    continue #library_opened() has dropped it
+            self.discard(entry)
+        await asyncio.get_event_loop().run_in_executor(None, self.executor.shutdown)
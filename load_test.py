@@ -0,0 +1,273 @@
+import argparse, asyncio, json, os, random, shutil, socket, subprocess, sys, tempfile, time
+from urllib.parse import quote
+from generate_library import generate_library, parse_count, zipf_weights, GENRES, TITLE_WORDS
+
+"""Load test for server.py: many keep-alive clients sending a mix of reads and writes to many libraries.
+
+Without --url it generates the libraries into a temporary folder (one library generated and copied, so the
+setup takes seconds), starts server.py on a free port and stops it at the end. Libraries are picked with a
+Zipf-like skew, so a few are hot and the rest are opened and evicted as the pool fills, like a real set of users.
+
+    python load_test.py --libraries 200 --capacity 32 --concurrency 64 --duration 20
+    python load_test.py --url http://127.0.0.1:8765 --libraries 50 --books 100k
+
+The report lists the p50 and p99 latency of every operation in milliseconds, the requests per second over the
+whole run and the number of errors (status 500 or a dropped connection); --output also saves it as JSON.
+
+FUNCTIONS:
+    percentile(ordered, fraction)
+        Returns the value at a fraction of a sorted list (nearest rank)
+
+    prepare_libraries(directory, count, books, seed = 1)
+        Generates one library and copies it to count library files in a folder
+
+    start_server(directory, capacity, idle_seconds, threads)
+        Starts server.py on a free port and returns (process, base url) once it answers
+
+    run_load(host, port, libraries, books, concurrency, duration, write_fraction = 0.1, seed = 1)
+        Runs the clients for duration seconds and returns the results dictionary
+"""
+
+READ_OPERATIONS = (("search", 30), ("get_book", 25), ("list_books", 20), ("filter", 10), ("stats", 10), ("reminders", 5))
+WRITE_OPERATIONS = (("add_book", 40), ("update_book", 40), ("delete_book", 20))
+
+def percentile(ordered, fraction):
+    """Returns the value at a fraction (0 to 1) of a sorted list, by nearest rank"""
+
+    if len(ordered) == 0:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+def prepare_libraries(directory, count, books, seed = 1):
+    """Generates one library and copies it to count library files (library0.db, library1.db, ...) in a folder"""
+
+    os.makedirs(directory, exist_ok = True)
+    template = os.path.join(directory, "template.db.tmp")
+    generate_library(template, books, seed = seed)
+    for number in range(count):
+        shutil.copyfile(template, os.path.join(directory, "library%d.db" % number))
+    os.remove(template)
+
+def free_port():
+    """Returns a TCP port nothing is listening on"""
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(directory, capacity, idle_seconds, threads):
+    """Starts server.py on a free port and returns (process, base url) once it answers.
+
+    Raises RuntimeError if the server exits or does not answer within 30 seconds
+    """
+
+    port = free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"), "--root", directory,
+        "--port", str(port), "--capacity", str(capacity), "--idle", str(idle_seconds), "--threads", str(threads)]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server.py exited with status %d" % process.returncode)
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.2).close()
+            return process, "http://127.0.0.1:%d" % port
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("server.py did not start")
+
+
+class LoadClient:
+    """One keep-alive connection that sends random requests until the deadline.
+
+    METHODS:
+        __init__(self, host, port, libraries, books, write_fraction, rng, results)
+            Stores the server address, the library choice weights and the shared results
+
+        request(self, method, path, body = None)
+            Sends one request and returns (status, decoded JSON or None)
+
+        operation(self, library)
+            Picks an operation and returns (name, method, path, body)
+
+        run(self, deadline)
+            Sends requests until the deadline, recording the latency of each under its operation name
+    """
+
+    def __init__(self, host, port, libraries, books, write_fraction, rng, results):
+        """Stores the server address, the library choice weights and the shared results.
+
+        Parameters:
+            host (string), port (int) - server address
+            libraries (int) - number of libraries (library0 to library{libraries - 1})
+            books (int) - books each library started with; ids are picked from 1 to books
+            write_fraction (float) - share of requests that write
+            rng (random.Random) - this client's random numbers
+            results (dictionary) - {operation: [latency in seconds, ...]}, plus "errors"
+        """
+
+        self.host, self.port = host, port
+        self.libraries = libraries
+        self.library_weights = zipf_weights(libraries, 0.8)
+        self.books = books
+        self.write_fraction = write_fraction
+        self.rng = rng
+        self.results = results
+        self.reader = self.writer = None
+        self.added = [] #(library, id) of books this client added, deleted again by delete_book
+
+    async def request(self, method, path, body = None):
+        """Sends one request and returns (status, decoded JSON or None), reconnecting if the server closed the connection"""
+
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.writer.write(("%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % (
+            method, path, self.host, len(data))).encode("latin-1") + data)
+        await self.writer.drain()
+
+        head = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        status = int(head[0].split(" ")[1])
+        headers = dict((name.strip().lower(), value.strip()) for name, value in (line.split(":", 1) for line in head[1:] if ":" in line))
+        payload = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            self.writer.close()
+            self.writer = None
+        return status, json.loads(payload) if payload else None
+
+    def operation(self, library):
+        """Picks an operation and returns (name, method, path, body)"""
+
+        base = "/libraries/" + quote(library)
+        rng = self.rng
+        if rng.random() < self.write_fraction:
+            name = rng.choices([op for op, weight in WRITE_OPERATIONS], [weight for op, weight in WRITE_OPERATIONS])[0]
+            if name == "add_book":
+                return name, "POST", base + "/books", {"title": "Load Test %d" % rng.getrandbits(48), "author": "Load Tester",
+                    "rating": rng.randint(0, 5), "genre": rng.choice(GENRES)}
+            if name == "update_book":
+                return name, "PATCH", base + "/books/%d" % rng.randint(1, self.books), {"rating": rng.randint(0, 5)}
+            mine = [book for book in self.added if book[0] == library]
+            book_id = mine[0][1] if mine else rng.randint(1, self.books)
+            if mine:
+                self.added.remove(mine[0])
+            return name, "DELETE", base + "/books/%d" % book_id, None
+
+        name = rng.choices([op for op, weight in READ_OPERATIONS], [weight for op, weight in READ_OPERATIONS])[0]
+        if name == "search":
+            return name, "GET", base + "/search?q=" + quote(" ".join(rng.sample(TITLE_WORDS, 2))) + "&limit=20", None
+        if name == "get_book":
+            return name, "GET", base + "/books/%d" % rng.randint(1, self.books), None
+        if name == "list_books":
+            return name, "GET", base + "/books?after=%d&limit=50" % rng.randint(0, self.books), None
+        if name == "filter":
+            return name, "GET", base + "/filter?category=genre&value=" + quote(rng.choice(GENRES)) + "&limit=50", None
+        if name == "stats":
+            return name, "GET", base + "/stats", None
+        return name, "GET", base + "/reminders?view=upcoming&days=30", None
+
+    async def run(self, deadline):
+        """Sends requests until the deadline, recording the latency of each under its operation name"""
+
+        try:
+            while time.monotonic() < deadline:
+                library = "library%d" % self.rng.choices(range(self.libraries), cum_weights = self.library_weights)[0]
+                name, method, path, body = self.operation(library)
+                started = time.perf_counter()
+                try:
+                    status, payload = await self.request(method, path, body)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    self.results["errors"] += 1
+                    self.writer = None
+                    continue
+                self.results.setdefault(name, []).append(time.perf_counter() - started)
+                if status >= 500:
+                    self.results["errors"] += 1
+                elif name == "add_book" and status == 201:
+                    self.added.append((library, payload["id"]))
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+
+async def run_load(host, port, libraries, books, concurrency, duration, write_fraction = 0.1, seed = 1):
+    """Runs the clients for duration seconds and returns the results dictionary.
+
+    Parameters:
+        host (string), port (int) - server address
+        libraries (int) - number of libraries the requests are spread over
+        books (int) - books in each library
+        concurrency (int) - clients sending requests at the same time, each on its own connection
+        duration (float) - seconds to run for
+        write_fraction (float) - share of requests that add, update or delete a book
+        seed (int) - random seed for the clients
+
+    Returns dictionary with requests, seconds, rps, errors, operations ({name: {count, p50_ms, p99_ms}}) and the
+    server's /status after the run
+    """
+
+    results = {"errors": 0}
+    clients = [LoadClient(host, port, libraries, books, write_fraction, random.Random(seed * 1000 + number), results)
+        for number in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(time.monotonic() + duration) for client in clients))
+    seconds = time.perf_counter() - started
+
+    status_client = LoadClient(host, port, libraries, books, 0, random.Random(seed), {"errors": 0})
+    server_status = (await status_client.request("GET", "/status"))[1]
+    status_client.writer.close()
+
+    errors = results.pop("errors")
+    everything = sorted(latency for latencies in results.values() for latency in latencies)
+    operations = {}
+    for name, latencies in sorted(results.items()) + [("all", everything)]:
+        latencies = sorted(latencies)
+        operations[name] = {"count": len(latencies), "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)}
+    return {"requests": len(everything), "seconds": round(seconds, 2), "rps": round(len(everything) / seconds, 1),
+        "errors": errors, "operations": operations, "server": server_status}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Load test the MyBookMgr HTTP server")
+    parser.add_argument("--url", help = "server to test, e.g. http://127.0.0.1:8765 (default: start one on generated libraries)")
+    parser.add_argument("--libraries", type = int, default = 100, help = "number of libraries (default 100)")
+    parser.add_argument("--books", default = "2k", help = "books in each generated library (default 2k)")
+    parser.add_argument("--concurrency", type = int, default = 32, help = "clients at once (default 32)")
+    parser.add_argument("--duration", type = float, default = 10, help = "seconds to run for (default 10)")
+    parser.add_argument("--writes", type = float, default = 0.1, help = "share of requests that write (default 0.1)")
+    parser.add_argument("--capacity", type = int, default = 32, help = "pool size of the started server (default 32)")
+    parser.add_argument("--idle", type = float, default = 60, help = "idle timeout of the started server (default 60)")
+    parser.add_argument("--threads", type = int, default = 8, help = "threads of the started server (default 8)")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--output", help = "also save the results as JSON")
+    args = parser.parse_args()
+
+    books = parse_count(args.books)
+    directory = process = None
+    try:
+        if args.url is None:
+            directory = tempfile.mkdtemp(prefix = "mybookmgr-load-")
+            print("Generating %d libraries of %d books..." % (args.libraries, books), file = sys.stderr)
+            prepare_libraries(directory, args.libraries, books, args.seed)
+            process, url = start_server(directory, args.capacity, args.idle, args.threads)
+        else:
+            url = args.url
+        host, port = url.split("://", 1)[-1].rstrip("/").split(":")
+
+        results = asyncio.run(run_load(host, int(port), args.libraries, books, args.concurrency, args.duration, args.writes, args.seed))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors = True)
+
+    print("{0} requests in {1}s: {2} requests/s, {3} errors".format(results["requests"], results["seconds"], results["rps"], results["errors"]))
+    print("{0:<12} {1:>8} {2:>10} {3:>10}".format("operation", "count", "p50 ms", "p99 ms"))
+    for name, row in results["operations"].items():
+        print("{0:<12} {1:>8} {2:>10} {3:>10}".format(name, row["count"], row["p50_ms"], row["p99_ms"]))
+    print("pool: {open} open, {opened} opened, {evicted} evicted, {hits} hits".format(**results["server"]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -1,6 +1,11 @@
+import os, sys
+from startup_timer import StartupTimer
+startup = StartupTimer(verbose = "--startup-report" in sys.argv) #started before PyQt5 is imported so the imports are timed
 from PyQt5 import QtCore, QtGui, QtWidgets, uic
 from PyQt5.QtWidgets import *
 from mainwindow_class import MainWindow
+from query_stats import QueryStats
+from query_cache import QueryCache
 
 '''Reference Credits.
 (1) Žiga Benko's Youtube series Python UI application with Qt designer (Videos 7-10) - https://www.youtube.com/watch?v=mBvpoNLb654&list=PLuTktZ8WcEGTdId-Kjbj6gsZTk65yudJh
@@ -11,7 +16,25 @@ from mainwindow_class import MainWindow
 '''
 
 if __name__ == "__main__":
-    import sys
     app = QtWidgets.QApplication(sys.argv)
-    mainscreen = MainWindow()
-    sys.exit(app.exec_())
+    startup.mark("imports")
+
+    #--query-stats=FILE times every query (.prom for the Prometheus textfile collector, JSON otherwise)
+    #and appends the slow ones to slow_queries.jsonl next to it
+    stats_file = next((argument.split("=", 1)[1] for argument in sys.argv if argument.startswith("--query-stats=")), None)
+    query_stats = None
+    if stats_file:
+        query_stats = QueryStats(100, os.path.join(os.path.dirname(os.path.abspath(stats_file)), "slow_queries.jsonl"), capture_plans = True)
+
+    #--query-cache=MB keeps the results of repeated reads in memory until a write changes their tables
+    cache_size = next((argument.split("=", 1)[1] for argument in sys.argv if argument.startswith("--query-cache=")), None)
+    query_cache = QueryCache(int(float(cache_size) * 1024 * 1024)) if cache_size else None
+
+    mainscreen = MainWindow(startup, query_stats = query_stats, query_cache = query_cache)
+    status = app.exec_()
+    if query_stats is not None:
+        query_stats.write(stats_file)
+    if query_cache is not None:
+        print("Query cache: {0.hits} hits, {0.misses} misses, {0.entries} results in {0.bytes} bytes, "
+            "{0.evictions} evicted, {0.invalidations} invalidated".format(query_cache.stats()), file = sys.stderr)
+    sys.exit(status)
@@ -1,4 +1,4 @@
-from PyQt5 import QtCore, QtGui, QtWidgets, uic
+from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
 from SqliteHelper import *
@@ -7,10 +7,21 @@ from datetime import datetime
 from add_book_class import AddBook
 from delete_book_class import DeleteBook
 from update_book_class import UpdateBook
+from bulk_edit_class import BulkEditBooks
 from filter_book_class import FilterBook
+from booklist_model import *
+from db_worker import DatabaseWorker
+from reminder_scheduler import ReminderScheduler
+from stats_dashboard import StatsDashboard
+from library import Library
+from filter_query import compile_filter, check_plan, FilterSyntaxError
+from startup_timer import StartupTimer
+from ui_cache import load_ui
 from shared import *
 
-helper = SqliteHelper("booklist.db")
+DATABASE = "booklist.db"
+UNDO_LIMIT = 20 #deletes and edits kept for Undo
+SEARCH_TIP = 'Words to search for, or a filter query such as author:"Stephen King" rating>=4 genre:(Horror|Thriller) -series:""'
 
 class MainWindow(QtWidgets.QMainWindow):
     """
@@ -19,170 +30,538 @@ class MainWindow(QtWidgets.QMainWindow):
     BUTTONS FOR USER INTERACTION:
         Booklist Table on left of screen:
             Add Book
-                Activates AddBook class when clicked
+                Activates AddBook class when clicked (the dialog is built the first time it is needed)
             Update Book
-                Activates UpdateBook class when clicked
+                Activates UpdateBook class when clicked (built on first use), or BulkEditBooks when several books are selected
             Delete Book
-                Activates DeleteBook class when clicked
+                Activates DeleteBook class when clicked (built on first use); deletes every selected book
+            Undo
+                Puts back the books changed by the last delete or update (also Ctrl+Z)
             Filter Booklist
-                Activates FilterBook class when clicked
+                Activates FilterBook class when clicked (built on first use)
+            Statistics
+                Shows or hides the StatsDashboard dock (built on first use)
         
-        Reminders Table on right of screen:
+        Reminders Table on right of screen (reminders that have not been announced yet):
             Add Reminder 
                 Clicking on this button calls the add_event() method
             Delete Reminder
                 Clicking on this button calls the delete_event() method
 
+        Search box above the booklist:
+            Typing in the box calls search_books() once the user pauses, limiting the booklist to matching books.
+            Plain words search titles, authors, series, genres and notes; filter queries such as
+            author:"Stephen King" rating>=4 genre:(Horror|Thriller) -series:"" are also understood (see filter_query.py)
+            The box turns yellow when SQLite has to read every book for the filter instead of seeking an index.
+
+        Booklist rows:
+            Ctrl+click and Shift+click select several books for Update Book and Delete Book.
+
+        Booklist column headings:
+            Clicking a heading sorts the booklist by that column in SQLite (every column except Notes).
+            Ctrl+End jumps to the end of the sorted list and Ctrl+Home back to the start.
+
     FUNCTIONS:
-        __init__(self) 
-            Sets up the main window, buttons, and imports the database details and relevant UI files for initial program load
+        __init__(self, startup = None, database = DATABASE, query_stats = None, query_cache = None) 
+            Sets up the main window, buttons, and imports the database details and relevant UI files for initial program load.
+            All database work is queued on a DatabaseWorker so the window stays responsive while SQLite runs.
+            Only the main screen is loaded here; the dialogs are built the first time their button is clicked.
+
+        open_add_form(self), open_update_form(self), confirm_delete(self), open_filter_wizard(self)
+            Build the AddBook, UpdateBook (or BulkEditBooks), DeleteBook or FilterBook dialog on first use and open it
+
+        add_undo(self, snapshot)
+            Keeps the BookSnapshot returned by a delete or update so the change can be undone
+
+        undo_last(self)
+            Queues a request that writes the books of the most recent snapshot back
+
+        toggle_dashboard(self, checked)
+            Builds the statistics dashboard on first use and shows or hides it
+
+        first_data_loaded(self, result)
+            Called once the first windows of books and reminders have been delivered; ends the startup timing
+
+        sort_indicator_changed(self, column, order)
+            Puts the sort arrow back on the current column when the user clicks a column that cannot be sorted
+
+        booklist_scrolled(self, value)
+            Reads the window above the first loaded book when the user scrolls to the top after jumping to the end
+
+        keep_scroll_position(self, count)
+            Moves the scroll bar down by the number of rows inserted above the visible ones
+
+        jump_to_end(self), jump_to_start(self)
+            Show the last or first window of the sorted booklist
+
+        notify_release(self, reminders)
+            Called by the ReminderScheduler when release dates arrive; shows a notification and archives the reminders
         
         getRowId(self)
             Returns the current row of the booklist
         
         getBookId(self)
             Returns the text for book item's ID number at index 0 in the current row
+
+        getBookIds(self)
+            Returns the ids of the selected books, in id order
+
+        getBookDetails(self)
+            Returns the full record for the book in the current row
         
         load_calendar(self)
-            Loads the calendar table from the database and enables the Delete Reminder button 
+            Reloads the reminders model from the database and enables the Delete Reminder button 
             if there is at least 1 entry in the table. The Add Reminder Button is automatically enabled.
         
         load_data(self)
-            Loads the books table from the database for the booklist table on the main screen. After loading data for the main booklist, it calls load_calendar().
+            Reloads the booklist model from the database for the booklist table on the main screen. After loading data for the main booklist, it calls load_calendar().
         
         clear_data(self)
-            Systematically removes existing data from the booklist table and the reminders table on the main screen by iterating through each table and clearing the selection for each table row.
+            Drops the rows held by the booklist model and the reminders model on the main screen.
         
         refresh_data(self)
-            Calls the clear_data() method followed by the load_data() method to refresh the screen for the user each time a book or reminder is added or modified.
+            Calls the clear_data() method followed by the load_data() method to rebuild both tables from the database.
+
+        apply_changes(self, changes)
+            Called with the worker's change events after every committed write; patches only the affected rows in the booklist and reminders tables.
+
+        update_button_states(self)
+            Enables or disables the buttons that need at least one book or reminder in the tables.
         
         add_event(self)
             Called when the user clicks on the Add Reminder button. 
             Opens a dialog box for the user to input title, author, and release date for an upcoming book. 
             Details from the dialog box are added into the reminders table.
         
+        search_books(self)
+            Limits the booklist to the books that match the words or filter query in the search box (all books when the box is empty).
+
+        show_search_plan(self, plan)
+            Marks the search box when the filter in it reads every book (full_scan) instead of seeking an index.
+
         delete_event(self)
             Called when the user clicks on the Delte Reminder button. 
             
             Raises AttributeError if no book is selected before clicking the Delete Reminder button
                 Please select a book.
+
+        closeEvent(self, event)
+            Waits for the queued database requests to finish and stops the worker before the window closes
     """
 
-    def __init__(self):
+    def __init__(self, startup = None, database = DATABASE, query_stats = None, query_cache = None):
         """Sets up the main window, buttons, and imports the database details and relevant UI files for initial program load
+
+        Parameters:
+            startup (StartupTimer) - timer started by main.py; the UI load, database open and first data load phases are marked on it
+            database (string) - database file to open
+            query_stats (QueryStats) - collects the timing of every query the worker runs; None to leave instrumentation off
+            query_cache (QueryCache) - keeps the results of repeated reads until a write changes their tables; None for no cache
         """
 
         super(MainWindow, self).__init__()
+        self.startup = startup if startup is not None else StartupTimer()
 
-        uic.loadUi("mainscreen_calendar.ui", self)
-        self.reminder = uic.loadUi("set_reminder.ui")
-        self.reminder.setWindowFlags(self.reminder.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        load_ui("mainscreen_calendar.ui", self)
+        self.reminder = None
+        self.startup.mark("UI load")
+
+        self.worker = DatabaseWorker(database)
+        self.worker.start()
+        if query_stats is not None:
+            self.worker.submit(SqliteHelper.enable_instrumentation, query_stats)
+        self.worker.submit(SqliteHelper.migrate) #runs before any of the reads queued below
+        if query_cache is not None:
+            self.worker.submit(SqliteHelper.enable_cache, query_cache)
+        self.library = Library(self.worker.helper) #keeps the near-duplicate index current from the first write
+        self.startup.mark("DB open")
+
+        self.book_model = BooklistModel(self.worker, "books", BOOK_COLUMNS, BOOK_HEADERS, sort_columns = BOOK_SORT_COLUMNS)
+        self.booklist_db.setModel(self.book_model)
         self.booklist_db.hideColumn(0)
+
+        self.book_header = self.booklist_db.horizontalHeader()
+        self.book_header.setSortIndicator(0, Qt.AscendingOrder) #id order, as the model is created
+        self.booklist_db.setSortingEnabled(True) #header clicks call book_model.sort(), which reloads in SQLite order
+        self.book_header.sortIndicatorChanged.connect(self.sort_indicator_changed)
+        self.booklist_db.verticalScrollBar().valueChanged.connect(self.booklist_scrolled)
+        self.book_model.rows_prepended.connect(self.keep_scroll_position)
+        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+End"), self.booklist_db, self.jump_to_end, context = Qt.WidgetWithChildrenShortcut)
+        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+Home"), self.booklist_db, self.jump_to_start, context = Qt.WidgetWithChildrenShortcut)
+
+        self.reminder_model = BooklistModel(self.worker, "calendar", CALENDAR_COLUMNS, CALENDAR_HEADERS, order = "date", where = "archived = 0")
+        self.reminders_table.setModel(self.reminder_model)
         self.reminders_table.hideColumn(0)
 
-        self.add_details = AddBook(self, helper)
-        self.delete_book = DeleteBook(self, helper)
-        self.update_details = UpdateBook(self, helper)
-        self.filter_books = FilterBook(helper)
+        self.reminder_header = self.reminders_table.horizontalHeader()       
+        self.reminder_header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
+        self.reminder_header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents) 
+        self.reminder_header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents) 
+        self.reminder_header.setSectionResizeMode(3, QtWidgets.QHeaderView.Stretch) 
+
+        for model in (self.book_model, self.reminder_model):
+            model.modelReset.connect(self.update_button_states)
+            model.rowsInserted.connect(self.update_button_states)
+            model.rowsRemoved.connect(self.update_button_states)
+
+        self.add_details = None
+        self.delete_book = None
+        self.update_details = None
+        self.bulk_edit = None
+        self.undo_snapshots = []
+        self.filter_books = None
+        self.dashboard = None
+
+        self.statsButton = QtWidgets.QPushButton("Statistics", self)
+        self.statsButton.setCheckable(True)
+        self.horizontalLayout_3.insertWidget(0, self.statsButton)
+        self.statsButton.toggled.connect(self.toggle_dashboard)
+
+        self.undoButton = QtWidgets.QPushButton("Undo", self)
+        self.undoButton.setEnabled(False)
+        self.horizontalLayout_3.insertWidget(1, self.undoButton)
+        self.undoButton.clicked.connect(self.undo_last)
+        QtWidgets.QShortcut(QtGui.QKeySequence.Undo, self, self.undo_last)
 
         self.Close_Button.clicked.connect(self.close)
-        self.addButton.clicked.connect(self.add_details.open_add_form)  
-        self.deleteButton.clicked.connect(self.delete_book.confirm_ok)
-        self.updateButton.clicked.connect(self.update_details.update_book)
-        self.filterButton.clicked.connect(self.filter_books.filter_book_by_category)
+        self.addButton.clicked.connect(self.open_add_form)  
+        self.deleteButton.clicked.connect(self.confirm_delete)
+        self.updateButton.clicked.connect(self.open_update_form)
+        self.filterButton.clicked.connect(self.open_filter_wizard)
         self.btn_addReminder.clicked.connect(self.add_event)
         self.btn_deleteReminder.clicked.connect(self.delete_event)
 
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250) #wait for the user to pause typing
+        self.search_timer.timeout.connect(self.search_books)
+        self.searchBox.textChanged.connect(self.search_timer.start)
+        self.searchBox.setToolTip(SEARCH_TIP)
+        self.search_palette = self.searchBox.palette() #restored when a filter can use an index again
+
+        self.worker.changes_ready.connect(self.apply_changes)
+
         self.load_data()
+        self.worker.submit(lambda helper: None, callback = self.first_data_loaded) #delivered after the windows queued by load_data()
+
+        self.tray_icon = None
+        self.scheduler = ReminderScheduler(self.worker)
+        self.scheduler.reminders_due.connect(self.notify_release)
+        self.scheduler.start()
         self.show()
 
+    def first_data_loaded(self, result):
+        """Called once the first windows of books and reminders have been delivered; ends the startup timing"""
+
+        self.startup.finish("first data load")
+
+    def sort_indicator_changed(self, column, order):
+        """Puts the sort arrow back on the current column when the user clicks a column that cannot be sorted"""
+
+        if self.book_model.columns[column] not in self.book_model.sort_columns:
+            self.book_header.setSortIndicator(self.book_model.order_index,
+                Qt.DescendingOrder if self.book_model.descending else Qt.AscendingOrder)
+
+    def booklist_scrolled(self, value):
+        """Reads the window above the first loaded book when the user scrolls to the top after jumping to the end"""
+
+        if value == self.booklist_db.verticalScrollBar().minimum() and self.book_model.can_fetch_previous():
+            self.book_model.fetch_previous()
+
+    def keep_scroll_position(self, count):
+        """Moves the scroll bar down by the number of rows inserted above the visible ones, so the same books stay in view"""
+
+        scroll_bar = self.booklist_db.verticalScrollBar()
+        if self.booklist_db.verticalScrollMode() == QtWidgets.QAbstractItemView.ScrollPerItem:
+            scroll_bar.setValue(scroll_bar.value() + count)
+        else:
+            scroll_bar.setValue(scroll_bar.value() + count * self.booklist_db.verticalHeader().defaultSectionSize())
+
+    def jump_to_end(self):
+        """Shows the last window of the sorted booklist; it is read straight from the end of the index"""
+
+        self.booklist_db.clearSelection()
+        self.book_model.jump_to_end()
+        self.worker.submit(lambda helper: None, callback = lambda result: self.booklist_db.scrollToBottom()) #after the window arrives
+
+    def jump_to_start(self):
+        """Shows the first window of the sorted booklist"""
+
+        self.booklist_db.clearSelection()
+        self.book_model.reload()
+        self.booklist_db.scrollToTop()
+
+    def notify_release(self, reminders):
+        """Called by the ReminderScheduler when release dates arrive; shows a notification and archives the reminders.
+
+        The notification is a system tray message where the desktop has a tray, and a status bar message otherwise.
+        Archived reminders leave the reminders table and are not announced again.
+
+        Parameters:
+            reminders (list of tuples) - (id, date, title, author) reminders that are due
+        """
+
+        lines = ["%s by %s (%s)" % (title, author, date) for reminder_id, date, title, author in reminders[:5]]
+        if len(reminders) > 5:
+            lines.append("and %d more" % (len(reminders) - 5))
+        heading = "New release" if len(reminders) == 1 else "%d new releases" % len(reminders)
+
+        if QtWidgets.QSystemTrayIcon.isSystemTrayAvailable():
+            if self.tray_icon is None:
+                icon = self.windowIcon()
+                if icon.isNull():
+                    icon = self.style().standardIcon(QtWidgets.QStyle.SP_MessageBoxInformation)
+                self.tray_icon = QtWidgets.QSystemTrayIcon(icon, self)
+                self.tray_icon.show()
+            self.tray_icon.showMessage("MyBookMgr - " + heading, "\n".join(lines))
+        else:
+            self.statusbar.showMessage(heading + ": " + "; ".join(lines))
+
+        self.worker.submit(SqliteHelper.archive_reminders, [reminder[0] for reminder in reminders])
+
+    def open_add_form(self):
+        """Builds the AddBook dialog on first use and opens it"""
+
+        if self.add_details is None:
+            self.add_details = AddBook(self, self.worker)
+        self.add_details.open_add_form()
+
+    def open_update_form(self):
+        """Builds the UpdateBook dialog on first use and opens it with the selected book.
+        When several books are selected, the BulkEditBooks form is opened instead to set details on all of them.
+        """
+
+        book_ids = self.getBookIds() if self.booklist_db.selectionModel().hasSelection() else []
+        if len(book_ids) > 1:
+            if self.bulk_edit is None:
+                self.bulk_edit = BulkEditBooks(self, self.worker)
+            self.bulk_edit.edit_books(book_ids)
+            return
+
+        if self.update_details is None:
+            self.update_details = UpdateBook(self, self.worker)
+        self.update_details.update_book()
+
+    def confirm_delete(self):
+        """Builds the DeleteBook dialog on first use and asks the user to confirm deleting the selected books"""
+
+        if self.delete_book is None:
+            self.delete_book = DeleteBook(self, self.worker)
+        self.delete_book.confirm_ok()
+
+    def open_filter_wizard(self):
+        """Builds the FilterBook wizard on first use and opens it"""
+
+        if self.filter_books is None:
+            self.filter_books = FilterBook(self.worker)
+        self.filter_books.filter_book_by_category()
+
+    def add_undo(self, snapshot):
+        """Keeps the BookSnapshot returned by a delete or update so the change can be undone.
+
+        Only the last UNDO_LIMIT snapshots are kept. Each one covers a whole bulk delete or edit.
+
+        Parameters:
+            snapshot (BookSnapshot) - books as they were before the change, from SqliteHelper.delete_books() or update_books()
+        """
+
+        if len(snapshot.rows) == 0:
+            return
+        self.undo_snapshots.append(snapshot)
+        del self.undo_snapshots[:-UNDO_LIMIT]
+        self.undoButton.setEnabled(True)
+
+        action = "Deleted" if snapshot.operation == "delete" else "Updated"
+        count = len(snapshot.rows)
+        self.statusbar.showMessage("%s %d book%s - Ctrl+Z to undo" % (action, count, "" if count == 1 else "s"))
+
+    def undo_last(self):
+        """Queues a request that writes the books of the most recent snapshot back (SqliteHelper.restore_books()).
+
+        The main window is patched by the change listener as for any other write.
+        """
+
+        if len(self.undo_snapshots) == 0:
+            return
+        snapshot = self.undo_snapshots.pop()
+        self.undoButton.setEnabled(len(self.undo_snapshots) > 0)
+
+        count = len(snapshot.rows)
+        self.worker.submit(SqliteHelper.restore_books, snapshot,
+            callback = lambda result: self.statusbar.showMessage("Restored %d book%s" % (count, "" if count == 1 else "s")),
+            error = lambda error: show_message("Error", "The change could not be undone: " + str(error)))
+
+    def toggle_dashboard(self, checked):
+        """Builds the statistics dashboard on first use and shows or hides it.
+
+        Parameters:
+            checked (bool) - state of the Statistics button
+        """
+
+        if self.dashboard is None:
+            if not checked:
+                return
+            self.dashboard = StatsDashboard(self.worker, self)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.dashboard)
+            self.dashboard.visibilityChanged.connect(self.statsButton.setChecked) #closing the dock releases the button
+        self.dashboard.setVisible(checked)
+
     def getRowId(self):
         """Returns the current row of the booklist"""
         
-        return self.booklist_db.currentRow()
+        return self.booklist_db.currentIndex().row()
 
     def getBookId(self): 
-        """Returns the text for book item's ID number at index 0 in the current row"""
+        """Returns the text for book item's ID number at index 0 in the current row
+
+        Raises AttributeError if no book is selected (the same error the callers already handle)
+        """
         
-        return self.booklist_db.item(self.getRowId(), 0).text()
+        book_id = self.book_model.row_id(self.getRowId())
+        if book_id is None:
+            raise AttributeError("No book selected")
+        return str(book_id)
 
-    def load_calendar(self):
-        """Loads the calendar table from the database and enables the Delete Reminder button 
-        if there is at least 1 entry in the table. The Add Reminder Button is automatically enabled.
+    def getBookIds(self):
+        """Returns the ids of the selected books, in id order
+
+        Raises AttributeError if no book is selected
         """
 
-        helper.create_calendar_table()
+        book_ids = sorted(set(self.book_model.row_id(index.row()) for index in self.booklist_db.selectionModel().selectedRows()) - {None})
+        if len(book_ids) == 0:
+            book_ids = [int(self.getBookId())] #the current row, when the selection was cleared
+        return book_ids
 
-        calendar_reminder = helper.select("SELECT * FROM calendar ORDER BY date ASC")
+    def getBookDetails(self):
+        """Returns the full record (id, title, author, rating, genre, series, notes) for the book in the current row
 
-        for row_num, event in enumerate(calendar_reminder):
-            self.reminders_table.insertRow(row_num)
-            for col_num, data in enumerate(event):
-                cell = QtWidgets.QTableWidgetItem(str(data))
-                self.reminders_table.setItem(row_num, col_num, cell)
-        
-        if len(calendar_reminder) == 0:
-            self.btn_deleteReminder.setEnabled(False)
-        else:
-            self.btn_deleteReminder.setEnabled(True)     
+        Raises AttributeError if no book is selected
+        """
 
-        self.reminder_header = self.reminders_table.horizontalHeader()       
-        self.reminder_header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeToContents)
-        self.reminder_header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeToContents) 
-        self.reminder_header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeToContents) 
-        self.reminder_header.setSectionResizeMode(3, QtWidgets.QHeaderView.Stretch) 
+        book = self.book_model.row_data(self.getRowId())
+        if book is None:
+            raise AttributeError("No book selected")
+        return book
+
+    def load_calendar(self):
+        """Reloads the reminders model from the database and enables the Delete Reminder button 
+        if there is at least 1 entry in the table. The Add Reminder Button is automatically enabled.
+        Archived reminders (releases that have already been announced) are left out.
+        Only the first window of reminders is read; the view fetches more as the user scrolls.
+        The buttons are updated again when the worker delivers the rows.
+        """
+
+        self.reminder_model.reload()
+        self.update_button_states()
     
     def load_data(self):
-        """Loads the books table from the database for the booklist table on the main screen. 
+        """Reloads the booklist model from the database for the booklist table on the main screen. 
+        Only the first window of books is read; the view fetches more as the user scrolls.
         After loading data for the main booklist, it calls load_calendar().
         """
         
-        helper.create_table()
-        
-        table_of_books = helper.select("SELECT * FROM books ORDER BY id") #refers to "books" table in db 
+        self.book_model.reload()
+        self.load_calendar()
+
+    def search_books(self):
+        """Limits the booklist to the books that match the words or filter query in the search box (all books when the box is empty).
+        Each word is matched as a prefix against the full-text index on title, author, series, genre and notes;
+        field terms such as rating>=4 are compiled by filter_query.py. Text that is not a valid query yet (e.g. an
+        unclosed quote while the user is still typing) is searched as plain words.
+        A search that is still running when the user types again is superseded by the new one.
+        The query plan of a filter is checked on the worker and shown by show_search_plan().
+        """
 
-        if len(table_of_books) == 0:
-            self.deleteButton.setEnabled(False)
-            self.updateButton.setEnabled(False)
-            self.filterButton.setEnabled(False)
+        try:
+            compiled = compile_filter(self.searchBox.text())
+            condition, parameters = compiled.condition, compiled.parameters
+        except FilterSyntaxError:
+            condition, parameters = SqliteHelper.search_condition(self.searchBox.text())
+        self.booklist_db.clearSelection()
+        self.book_model.set_query(condition, parameters)
+        self.update_button_states()
+
+        if condition:
+            self.worker.submit(check_plan, condition, parameters, self.book_model.order, callback = self.show_search_plan, key = "search plan")
         else:
-            self.deleteButton.setEnabled(True)
-            self.updateButton.setEnabled(True)
-            self.filterButton.setEnabled(True)
-        
-        for row_num, book in enumerate(table_of_books):
-            self.booklist_db.insertRow(row_num)
-            for col_num, data in enumerate(book):
-                cell = QtWidgets.QTableWidgetItem(str(data))
-                self.booklist_db.setItem(row_num, col_num, cell)
-        
-        self.load_calendar()
+            self.show_search_plan(None)
+
+    def show_search_plan(self, plan):
+        """Marks the search box when the filter in it reads every book (full_scan) instead of seeking an index.
+
+        The box turns yellow and its tooltip lists the plan steps; a filter that seeks an index, or an empty box,
+        puts back the normal colour and tooltip.
+
+        Parameters:
+            plan (FilterPlan) - from filter_query.check_plan(); None when there is no filter
+        """
+
+        if plan is None or not plan.full_scan:
+            self.searchBox.setPalette(self.search_palette)
+            self.searchBox.setToolTip(SEARCH_TIP)
+            return
+
+        palette = self.searchBox.palette()
+        palette.setColor(QtGui.QPalette.Base, QtGui.QColor('lightyellow'))
+        self.searchBox.setPalette(palette)
+        self.searchBox.setToolTip("full_scan: SQLite reads every book for this filter instead of seeking an index\n"
+            + "\n".join(plan.steps) + "\n\n" + SEARCH_TIP)
+
+    def update_button_states(self):
+        """Enables or disables the buttons that need at least one book or reminder in the tables."""
+
+        has_books = self.book_model.rowCount() > 0
+        self.deleteButton.setEnabled(has_books)
+        self.updateButton.setEnabled(has_books)
+        self.filterButton.setEnabled(has_books)
+
+        self.btn_deleteReminder.setEnabled(self.reminder_model.rowCount() > 0)
 
     def clear_data(self):
-        """Systematically removes existing data from the booklist table and the reminders table on the main screen by iterating through each table and clearing the selection for each table row.
+        """Drops the rows held by the booklist model and the reminders model on the main screen.
         """
         
         self.booklist_db.clearSelection()
-        while (self.booklist_db.rowCount() > 0):
-            self.booklist_db.removeRow(0) 
-            self.booklist_db.clearSelection()
+        self.book_model.clear()
         
         self.reminders_table.clearSelection()
-        while (self.reminders_table.rowCount() > 0):
-            self.reminders_table.removeRow(0) 
-            self.reminders_table.clearSelection()
+        self.reminder_model.clear()
 
     def refresh_data(self):
-        """Calls the clear_data() method followed by the load_data() method to refresh the screen for the user each time a book or reminder is added or modified."""
+        """Calls the clear_data() method followed by the load_data() method to rebuild both tables from the database."""
         self.clear_data()
         self.load_data()
 
+    def apply_changes(self, changes):
+        """Called with the worker's change events after every committed write; patches only the affected rows in the booklist and reminders tables.
+
+        Parameters:
+            changes (list of RowChange) - row-level changes reported by SqliteHelper
+        """
+
+        self.book_model.apply_changes(changes)
+        self.reminder_model.apply_changes(changes)
+
+        #a view that has shown every loaded row may need the next window now that rows were removed
+        if self.book_model.canFetchMore() and self.book_model.rowCount() < self.book_model.window_size:
+            self.book_model.fetchMore()
+        if self.reminder_model.canFetchMore() and self.reminder_model.rowCount() < self.reminder_model.window_size:
+            self.reminder_model.fetchMore()
+
+        self.update_button_states()
+
     def add_event(self):
         """Called when the user clicks on the Add Reminder button. 
             Opens a dialog box for the user to input title, author, and release date for an upcoming book. 
             Details from the dialog box are added into the reminders table.
+            The dialog is built the first time it is needed.
         """
 
+        if self.reminder is None:
+            self.reminder = load_ui("set_reminder.ui")
+            self.reminder.setWindowFlags(self.reminder.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+
         self.reminder.buttonBox_reminder.rejected.connect(self.reminder.reject)
         self.reminder.buttonBox_reminder.accepted.connect(self.reminder.accept)
 
@@ -192,8 +571,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         early_cancel = self.reminder.exec_() 
 
-        title = remove_punctuation(self.reminder.lineEdit.text()).title()
-        author = remove_punctuation(self.reminder.lineEdit_2.text()).title()
+        title, author = clean_reminder_details(self.reminder.lineEdit.text(), self.reminder.lineEdit_2.text())
         date = self.reminder.dateEdit.date().toString('yyyy-MM-dd')
         
         if early_cancel == QDialog.Rejected:
@@ -201,8 +579,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
         elif title.strip(" ") != "" and author.strip(" ") != "":
                 event = (title, author, date)
-                helper.insert("INSERT INTO calendar (title, author, date) VALUES (?, ?, ?)", event)
-                self.refresh_data()
+                self.worker.submit(SqliteHelper.insert, "INSERT INTO calendar (title, author, date) VALUES (?, ?, ?)", event)
         
         else: 
             show_message("Error", "Enter valid details.")
@@ -214,11 +591,19 @@ class MainWindow(QtWidgets.QMainWindow):
                 Please select a book.
         """
         try:
-            event_id = self.reminders_table.item(self.reminders_table.currentRow(), 0).text()
-            helper.delete("DELETE FROM calendar WHERE id="+event_id)
-            self.refresh_data()
+            event_id = self.reminder_model.row_id(self.reminders_table.currentIndex().row())
+            if event_id is None:
+                raise AttributeError("No reminder selected")
+            self.worker.submit(SqliteHelper.delete, "DELETE FROM calendar WHERE id="+str(event_id))
         
         except AttributeError:
             show_message("Error", "Please select a book")
             self.refresh_data()
-            pass
\ No newline at end of file
+            pass
+
+    def closeEvent(self, event):
+        """Waits for the queued database requests to finish and stops the worker before the window closes"""
+
+        self.scheduler.stop()
+        self.worker.stop()
+        super(MainWindow, self).closeEvent(event)
\ No newline at end of file
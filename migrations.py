@@ -0,0 +1,272 @@
+"""Versioned schema changes for booklist.db.
+
+The schema version is stored in SQLite's PRAGMA user_version. Each migration runs once, in order, in its own
+transaction (SqliteHelper.transaction()), and bumps user_version when it commits, so older booklist.db files are brought forward the next
+time the program starts and a failed migration leaves the file at the last good version.
+
+To change the schema, append a new function to MIGRATIONS; never edit one that has already shipped.
+
+FUNCTIONS:
+    migrate(helper)
+        Runs every migration newer than the database's user_version and returns the new version
+
+    schema_version(helper)
+        Returns the database's current user_version
+"""
+
+from normalize import normalize_many
+import duplicates
+import book_stats
+
+def create_base_tables(c):
+    """Version 1: the books and calendar tables as created by earlier versions of the program."""
+
+    c.execute("""CREATE TABLE IF NOT EXISTS books (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL,
+        rating INTEGER NOT NULL,
+        genre TEXT NOT NULL,
+        series TEXT NOT NULL,
+        notes TEXT NOT NULL
+        )""")
+    c.execute("""CREATE TABLE IF NOT EXISTS calendar (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        title TEXT NOT NULL,
+        author TEXT NOT NULL
+        )""")
+
+def create_lookup_indexes(c):
+    """Version 2: indexes for the duplicate check, the filter wizard and the reminders list."""
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_title_author ON books (title, author)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_author ON books (author)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_genre ON books (genre)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_series ON books (series)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_rating ON books (rating)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_calendar_date ON calendar (date)")
+
+def drop_filter_results_table(c):
+    """Version 3: the filter wizard no longer copies matches into a results table, so remove any left behind."""
+
+    c.execute("DROP TABLE IF EXISTS results")
+
+def add_normalized_keys(c):
+    """Version 4: title_norm/author_norm comparison keys for the duplicate check, backfilled for existing books.
+
+    The keys get a unique index. A library that already holds two books with the same keys (entered before
+    this check existed) gets a plain index instead, so the upgrade never deletes anything the user entered.
+    The index itself records which one was made: SqliteHelper.duplicate_keys() lists the books while it is not
+    UNIQUE (stats --check reports them), and restore_unique_keys() makes it UNIQUE once they are gone.
+    """
+
+    c.execute("ALTER TABLE books ADD COLUMN title_norm TEXT NOT NULL DEFAULT ''")
+    c.execute("ALTER TABLE books ADD COLUMN author_norm TEXT NOT NULL DEFAULT ''")
+
+    reader = c.connection.cursor()
+    reader.execute("SELECT id, title, author FROM books")
+    while True:
+        books = reader.fetchmany(5000)
+        if len(books) == 0:
+            break
+        titles = normalize_many(book[1] for book in books)
+        authors = normalize_many(book[2] for book in books)
+        c.executemany("UPDATE books SET title_norm = ?, author_norm = ? WHERE id = ?", zip(titles, authors, (book[0] for book in books)))
+
+    c.execute("SELECT 1 FROM books GROUP BY title_norm, author_norm HAVING COUNT(*) > 1 LIMIT 1")
+    if c.fetchone() is None:
+        c.execute("CREATE UNIQUE INDEX idx_books_norm ON books (title_norm, author_norm)")
+    else:
+        c.execute("CREATE INDEX idx_books_norm ON books (title_norm, author_norm)")
+
+def add_full_text_index(c):
+    """Version 5: FTS5 index over title, author, series, genre and notes, kept in sync with books by triggers.
+
+    books_fts is an external-content table, so the text is not stored twice; the triggers use the FTS5
+    'delete' command to remove the old tokens before the new ones are added. The prefix indexes make
+    "ste*" style queries a lookup instead of a scan of the term list.
+    """
+
+    c.execute("""CREATE VIRTUAL TABLE books_fts USING fts5(
+        title, author, series, genre, notes,
+        content = 'books', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )""")
+    c.execute("""CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts (rowid, title, author, series, genre, notes)
+        VALUES (NEW.id, NEW.title, NEW.author, NEW.series, NEW.genre, NEW.notes);
+        END""")
+    c.execute("""CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, series, genre, notes)
+        VALUES ('delete', OLD.id, OLD.title, OLD.author, OLD.series, OLD.genre, OLD.notes);
+        END""")
+    c.execute("""CREATE TRIGGER books_fts_update AFTER UPDATE OF title, author, series, genre, notes ON books BEGIN
+        INSERT INTO books_fts (books_fts, rowid, title, author, series, genre, notes)
+        VALUES ('delete', OLD.id, OLD.title, OLD.author, OLD.series, OLD.genre, OLD.notes);
+        INSERT INTO books_fts (rowid, title, author, series, genre, notes)
+        VALUES (NEW.id, NEW.title, NEW.author, NEW.series, NEW.genre, NEW.notes);
+        END""")
+    c.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+
+def add_duplicate_signatures(c):
+    """Version 6: locality-sensitive hash buckets used to find near-duplicate books, backfilled for existing books.
+
+    Rows for a deleted book are removed by a trigger; new books are indexed when they are inserted.
+    """
+
+    c.execute("""CREATE TABLE book_signatures (
+        book_id INTEGER NOT NULL,
+        band INTEGER NOT NULL,
+        bucket INTEGER NOT NULL
+        )""")
+    c.execute("CREATE INDEX idx_book_signatures_bucket ON book_signatures (band, bucket)")
+    c.execute("CREATE INDEX idx_book_signatures_book ON book_signatures (book_id)")
+    c.execute("""CREATE TRIGGER book_signatures_delete AFTER DELETE ON books BEGIN
+        DELETE FROM book_signatures WHERE book_id = OLD.id;
+        END""")
+
+    reader = c.connection.cursor()
+    reader.execute("SELECT id, title, author FROM books")
+    while True:
+        books = reader.fetchmany(5000)
+        if len(books) == 0:
+            break
+        duplicates.index_books(c, books)
+
+def add_reminder_archive(c):
+    """Version 7: an archived flag for reminders whose release has been announced, with an index for date windows.
+
+    Reminders dated before today are archived by the upgrade, so the first start does not announce every
+    release the user has already seen.
+    """
+
+    c.execute("ALTER TABLE calendar ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX idx_calendar_archived_date ON calendar (archived, date)")
+    c.execute("UPDATE calendar SET archived = 1 WHERE date < date('now', 'localtime')")
+
+def add_title_index(c):
+    """Version 8: an index on title alone, so the booklist can be read in (title, id) order a page at a time.
+
+    The (title, author) index cannot serve ORDER BY title, id without sorting, because author sits between the
+    title and the rowid.
+    """
+
+    c.execute("CREATE INDEX IF NOT EXISTS idx_books_title ON books (title)")
+
+def add_book_stats(c):
+    """Version 9: the book_stats summary table, kept current by triggers on books and backfilled from the books already entered.
+
+    Each category's row for the old value loses the book and the row for the new value gains it; rows left with
+    no books are deleted through the (category, books) index, so a trigger never scans the table. The update
+    trigger only fires when a counted column really changes, so editing notes or a title costs nothing.
+    """
+
+    c.execute("""CREATE TABLE book_stats (
+        category TEXT NOT NULL,
+        value NOT NULL,
+        books INTEGER NOT NULL,
+        rating_total INTEGER NOT NULL,
+        PRIMARY KEY (category, value)
+        ) WITHOUT ROWID""")
+    c.execute("CREATE INDEX idx_book_stats_books ON book_stats (category, books DESC, value)")
+
+    add_book = """INSERT INTO book_stats (category, value, books, rating_total) VALUES
+        ('author', NEW.author, 1, NEW.rating), ('genre', NEW.genre, 1, NEW.rating),
+        ('series', NEW.series, 1, NEW.rating), ('rating', NEW.rating, 1, NEW.rating)
+        ON CONFLICT (category, value) DO UPDATE SET books = books + 1, rating_total = rating_total + excluded.rating_total;"""
+    remove_book = """UPDATE book_stats SET books = books - 1, rating_total = rating_total - OLD.rating WHERE category = 'author' AND value = OLD.author;
+        UPDATE book_stats SET books = books - 1, rating_total = rating_total - OLD.rating WHERE category = 'genre' AND value = OLD.genre;
+        UPDATE book_stats SET books = books - 1, rating_total = rating_total - OLD.rating WHERE category = 'series' AND value = OLD.series;
+        UPDATE book_stats SET books = books - 1, rating_total = rating_total - OLD.rating WHERE category = 'rating' AND value = OLD.rating;
+        DELETE FROM book_stats WHERE category IN ('author', 'genre', 'series', 'rating') AND books = 0;"""
+
+    c.execute("CREATE TRIGGER book_stats_insert AFTER INSERT ON books BEGIN " + add_book + " END")
+    c.execute("CREATE TRIGGER book_stats_delete AFTER DELETE ON books BEGIN " + remove_book + " END")
+    c.execute("""CREATE TRIGGER book_stats_update AFTER UPDATE OF author, genre, series, rating ON books
+        WHEN OLD.author IS NOT NEW.author OR OLD.genre IS NOT NEW.genre OR OLD.series IS NOT NEW.series OR OLD.rating IS NOT NEW.rating
+        BEGIN """ + remove_book + " " + add_book + " END")
+    book_stats.rebuild(c)
+
+def rebuild_duplicate_signatures(c):
+    """Version 10: duplicate signatures in the current band layout (title-only MinHash with the author in the bucket,
+    title word, main title and whole title bands), recomputed from the saved titles.
+
+    The saved titles have lost their subtitle punctuation, so books entered before this version only have
+    their whole title as a main title; books added from now on keep the subtitle from the title as typed.
+    The bucket index gains book_id, so the cluster report and the lookups read the buckets from the index alone.
+    """
+
+    c.execute("DROP INDEX idx_book_signatures_bucket")
+    c.execute("DELETE FROM book_signatures")
+    reader = c.connection.cursor()
+    reader.execute("SELECT id, title, author FROM books")
+    while True:
+        books = reader.fetchmany(5000)
+        if len(books) == 0:
+            break
+        duplicates.index_books(c, books)
+    c.execute("CREATE INDEX idx_book_signatures_bucket ON book_signatures (band, bucket, book_id)")
+
+def add_deletion_signatures(c):
+    """Version 11: one-letter-deletion buckets for books whose title is a single word (duplicates.DELETION_BAND).
+
+    Only the new rows are added; the other bands are unchanged.
+    """
+
+    reader = c.connection.cursor()
+    reader.execute("SELECT id, title, author FROM books")
+    while True:
+        books = reader.fetchmany(5000)
+        if len(books) == 0:
+            break
+        c.executemany(duplicates.SIGNATURE_INSERT, (row for book in books for row in duplicates.deletion_rows(*book)))
+
+MIGRATIONS = [
+    create_base_tables,
+    create_lookup_indexes,
+    drop_filter_results_table,
+    add_normalized_keys,
+    add_full_text_index,
+    add_duplicate_signatures,
+    add_reminder_archive,
+    add_title_index,
+    add_book_stats,
+    rebuild_duplicate_signatures,
+    add_deletion_signatures,
+]
+
+#only the program's own tables: statistics gathered on the FTS5 shadow tables while they are nearly empty
+#lead the planner into full scans inside FTS5 once the index grows
+ANALYZE_TABLES = ("books", "calendar", "book_stats")
+
+def schema_version(helper):
+    """Returns the database's current user_version"""
+
+    return helper.conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(helper):
+    """Runs every migration newer than the database's user_version and returns the new version.
+
+    ANALYZE is run on ANALYZE_TABLES after any migration so the query planner has statistics for the new indexes.
+
+    Raises RuntimeError if the database was written by a newer version of the program
+    """
+
+    version = schema_version(helper)
+    if version > len(MIGRATIONS):
+        raise RuntimeError("booklist.db schema version %d is newer than this program supports (%d)" % (version, len(MIGRATIONS)))
+
+    if version == len(MIGRATIONS):
+        return version
+
+    c = helper.conn.cursor()
+    for number, migration in enumerate(MIGRATIONS[version:], start = version + 1):
+        with helper.transaction():
+            migration(c)
+            c.execute("PRAGMA user_version = %d" % number)
+
+    with helper.transaction():
+        for table in ANALYZE_TABLES:
+            c.execute("ANALYZE " + table)
+    return len(MIGRATIONS)
@@ -0,0 +1,303 @@
+import argparse, json, sys
+from library import open_library
+from export_books import EXPORT_FORMATS, EXPORT_TABLES
+from SqliteHelper import FILTER_CATEGORIES
+from book_stats import STATS_CATEGORIES
+from query_stats import QueryStats
+
+"""Command-line interface to a MyBookMgr database, for scripts, cron and batch jobs.
+
+Does not import PyQt5, so it starts quickly and runs without a display. Books are printed one per line with
+tab-separated fields (id, title, author, rating, genre, series, notes).
+
+    python mybookmgr.py add "The Shining" "Stephen King" --rating 5 --genre Horror
+    python mybookmgr.py import goodreads_library_export.csv
+    python mybookmgr.py export books.jsonl
+    python mybookmgr.py export library.csv.gz --tables books calendar
+    python mybookmgr.py export backup.db
+    python mybookmgr.py search steph king
+    python mybookmgr.py filter genre Horror
+    python mybookmgr.py query 'author:"Stephen King" rating>=4 -series:""'
+    python mybookmgr.py query 'genre:(Horror|Thriller) title:a..m' --explain
+    python mybookmgr.py stats --json
+    python mybookmgr.py stats --category author --limit 25
+    python mybookmgr.py stats --check
+    python mybookmgr.py reminders add "Holly" "Stephen King" 2026-09-05
+    python mybookmgr.py reminders upcoming 14
+
+Add --query-stats FILE (.json, or .prom for the Prometheus textfile collector) to time every query the command
+runs, and --slow-log FILE to append the queries slower than --slow-ms to a JSON Lines file.
+
+Exit status is 0 on success, 1 if a book was not added because it is already in the library,
+and 2 for bad arguments.
+
+FUNCTIONS:
+    main(argv = None)
+        Parses the command line, runs the command and returns the exit status
+"""
+
+def print_rows(rows):
+    """Prints rows as tab-separated lines"""
+
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+
+def command_add(library, args):
+    """Adds one book; returns 1 if it is a duplicate (or similar to a book, unless --force is given)"""
+
+    result = library.add_book(args.title, args.author, args.rating, args.genre, args.series, args.notes, allow_similar = args.force)
+    if result.book_id is not None:
+        print(result.book_id)
+        return 0
+
+    if len(result.duplicates) > 0:
+        print("Already in the library: " + ", ".join(str(book_id) for book_id in result.duplicates), file = sys.stderr)
+    else:
+        print("Looks like a book already in the library (use --force to add it anyway):", file = sys.stderr)
+        for score, book_id, title, author in result.similar:
+            print("    %d\t%s\t%s\t%.2f" % (book_id, title, author, score), file = sys.stderr)
+    return 1
+
+def command_import(library, args):
+    """Imports a file and prints the import report"""
+
+    def print_progress(report):
+        print("{0.read} read, {0.inserted} added, {0.duplicates} duplicates, {0.skipped} skipped ({1:.0f} records/s)".format(report, report.rate), file = sys.stderr)
+
+    print_progress(library.import_file(args.path, args.format, args.batch_size, print_progress if args.verbose else None))
+    return 0
+
+def command_export(library, args):
+    """Exports tables to files, the whole database to a copy, or one table to standard output"""
+
+    if args.path == "-":
+        if len(args.tables) != 1:
+            print("Only one table can be written to standard output", file = sys.stderr)
+            return 2
+        count = library.export(sys.stdout, args.format or "csv", args.tables[0], not args.no_snapshot)
+        print("%d rows exported" % count, file = sys.stderr)
+        return 0
+
+    def print_progress(report):
+        print("{0} rows ({1:.0f} rows/s)".format(sum(report.rows.values()), report.rate), file = sys.stderr)
+
+    report = library.export_file(args.path, args.format, args.tables, True if args.gzip else None, not args.no_snapshot,
+        print_progress if args.verbose else None)
+    for table, count in sorted(report.rows.items()):
+        print("%d %s rows exported" % (count, table), file = sys.stderr)
+    return 0
+
+def command_search(library, args):
+    """Prints the books that best match the search words"""
+
+    print_rows(library.search(" ".join(args.words), args.limit))
+    return 0
+
+def command_filter(library, args):
+    """Prints the books whose category equals the value"""
+
+    print_rows(library.filter(args.category, args.value))
+    return 0
+
+def command_query(library, args):
+    """Prints the books that match a filter query, or its query plan with --explain"""
+
+    expression = " ".join(args.words)
+    if args.explain:
+        plan = library.explain_query(expression)
+        for step in plan.steps:
+            print(step)
+        if plan.full_scan:
+            print("The plan walks every book instead of seeking an index for the query", file = sys.stderr)
+        return 0
+
+    after = 0
+    while args.limit is None or args.limit > 0:
+        page_size = 1000 if args.limit is None else min(args.limit, 1000)
+        normalized, books = library.query(expression, after, page_size)
+        print_rows(books)
+        if len(books) < page_size:
+            break
+        after = books[-1][0]
+        if args.limit is not None:
+            args.limit -= len(books)
+    return 0
+
+def command_stats(library, args):
+    """Prints the library totals, one category's statistics, or checks or rebuilds the summary they are read from"""
+
+    if args.rebuild:
+        print("%d summary rows rebuilt" % library.rebuild_stats(), file = sys.stderr)
+        if library.restore_unique_keys():
+            print("title/author index is UNIQUE again", file = sys.stderr)
+        return 0
+
+    if args.check:
+        mismatches = library.check_stats()
+        for mismatch in mismatches:
+            print("%s %r: %d books, rating total %d expected; %d, %d stored" % ((mismatch.category, mismatch.value) +
+                mismatch.expected + mismatch.found))
+        if mismatches:
+            print("Run stats --rebuild to recompute the summary", file = sys.stderr)
+
+        duplicates = library.duplicate_keys()
+        for title_norm, author_norm, book_ids in duplicates:
+            print("books %s share the title %r and author %r" % (", ".join(str(book_id) for book_id in book_ids), title_norm, author_norm))
+        if duplicates:
+            print("The title/author index is not UNIQUE because of these books; delete the extra copies, then run stats --rebuild",
+                file = sys.stderr)
+        return 1 if mismatches or duplicates else 0
+
+    if args.category:
+        rows = library.category_stats(args.category, args.limit, not args.by_value)
+        if args.json:
+            print(json.dumps([list(row) for row in rows], indent = 2))
+        else:
+            print_rows(rows)
+        return 0
+
+    stats = library.stats(args.limit or 10)
+    if args.json:
+        print(json.dumps(stats, indent = 2))
+        return 0
+
+    print("books\t%d" % stats["books"])
+    print("reminders\t%d" % stats["reminders"])
+    print("average rating\t%s" % stats["average_rating"])
+    for rating, count in sorted(stats["ratings"].items()):
+        print("rating %s\t%d" % (rating, count))
+    for category, key in (("author", "authors"), ("genre", "genres"), ("series", "series")):
+        for value, count, average in stats[key]:
+            print("%s %s\t%d\t%s" % (category, value, count, average))
+    return 0
+
+def command_reminders(library, args):
+    """Lists, adds, deletes or archives reminders"""
+
+    if args.action == "add":
+        if len(args.values) != 3:
+            print("reminders add needs TITLE AUTHOR DATE", file = sys.stderr)
+            return 2
+        print(library.add_reminder(*args.values))
+
+    elif args.action == "delete":
+        if len(args.values) != 1:
+            print("reminders delete needs ID", file = sys.stderr)
+            return 2
+        if not library.delete_reminder(args.values[0]):
+            print("No reminder with id " + args.values[0], file = sys.stderr)
+            return 1
+
+    elif args.action == "archive":
+        if len(args.values) != 1:
+            print("reminders archive needs ID", file = sys.stderr)
+            return 2
+        if not library.archive_reminder(args.values[0]):
+            print("No reminder with id " + args.values[0], file = sys.stderr)
+            return 1
+
+    elif args.action == "upcoming":
+        print_rows(library.upcoming_reminders(int(args.values[0]) if args.values else 30))
+
+    elif args.action == "overdue":
+        print_rows(library.overdue_reminders())
+
+    elif args.action == "archived":
+        print_rows(library.archived_reminders())
+
+    else:
+        print_rows(library.reminders())
+    return 0
+
+def build_parser():
+    """Returns the argparse parser for every command"""
+
+    parser = argparse.ArgumentParser(prog = "mybookmgr", description = "Manage a MyBookMgr book list from the command line")
+    parser.add_argument("--db", default = "booklist.db", help = "database file (default booklist.db)")
+    parser.add_argument("--query-stats", metavar = "FILE", help = "write query timings to FILE (.prom for Prometheus text, JSON otherwise)")
+    parser.add_argument("--slow-log", metavar = "FILE", help = "append queries slower than --slow-ms to FILE as JSON lines")
+    parser.add_argument("--slow-ms", type = float, default = 100, help = "slow-query threshold in milliseconds (default 100)")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    add = commands.add_parser("add", help = "add a book")
+    add.add_argument("title")
+    add.add_argument("author")
+    add.add_argument("--rating", type = int, default = 0)
+    add.add_argument("--genre", default = "")
+    add.add_argument("--series", default = "")
+    add.add_argument("--notes", default = "")
+    add.add_argument("--force", action = "store_true", help = "add even if it looks like a book already in the library")
+    add.set_defaults(run = command_add)
+
+    imports = commands.add_parser("import", help = "import a CSV, JSON or Goodreads export")
+    imports.add_argument("path")
+    imports.add_argument("--format", choices = ("csv", "goodreads", "json"), help = "input format (detected when omitted)")
+    imports.add_argument("--batch-size", type = int, default = 5000)
+    imports.add_argument("--verbose", action = "store_true", help = "print progress after every batch")
+    imports.set_defaults(run = command_import)
+
+    export = commands.add_parser("export", help = "export the books and reminders, or copy the whole database")
+    export.add_argument("path", nargs = "?", default = "-", help = "output file: .csv, .jsonl or .db, optionally .gz (standard output when omitted)")
+    export.add_argument("--format", choices = EXPORT_FORMATS, help = "output format (from the file name when omitted; csv for standard output)")
+    export.add_argument("--tables", nargs = "+", choices = sorted(EXPORT_TABLES), default = ["books"], help = "tables exported (default books)")
+    export.add_argument("--gzip", action = "store_true", help = "compress the output (implied by a .gz file name)")
+    export.add_argument("--no-snapshot", action = "store_true", help = "read the live tables instead of a consistent snapshot")
+    export.add_argument("--verbose", action = "store_true", help = "print progress while exporting")
+    export.set_defaults(run = command_export)
+
+    search = commands.add_parser("search", help = "full-text search on title, author, series, genre and notes")
+    search.add_argument("words", nargs = "+")
+    search.add_argument("--limit", type = int, default = 50)
+    search.set_defaults(run = command_search)
+
+    filters = commands.add_parser("filter", help = "list the books with an exact author, rating, genre or series")
+    filters.add_argument("category", choices = FILTER_CATEGORIES)
+    filters.add_argument("value")
+    filters.set_defaults(run = command_filter)
+
+    query = commands.add_parser("query", help = "list the books that match a filter query, e.g. 'author:king* rating>=4 -series:\"\"'")
+    query.add_argument("words", nargs = "+", help = "the query (see filter_query.py); several arguments are joined with spaces")
+    query.add_argument("--limit", type = int, help = "number of books printed (default all)")
+    query.add_argument("--explain", action = "store_true", help = "print the EXPLAIN QUERY PLAN steps instead of the books")
+    query.set_defaults(run = command_query)
+
+    stats = commands.add_parser("stats", help = "print library totals, or check or rebuild the statistics summary")
+    stats.add_argument("--json", action = "store_true")
+    stats.add_argument("--category", choices = STATS_CATEGORIES, help = "list the books and average rating for every value of one category")
+    stats.add_argument("--limit", type = int, help = "number of values listed (largest first)")
+    stats.add_argument("--by-value", action = "store_true", help = "list --category values in order instead of largest first")
+    stats.add_argument("--check", action = "store_true",
+        help = "compare the summary with the books and list books sharing a title and author; exit status 1 if any are found")
+    stats.add_argument("--rebuild", action = "store_true",
+        help = "recompute the summary from the books, and make the title/author index UNIQUE again if no books share it")
+    stats.set_defaults(run = command_stats)
+
+    reminders = commands.add_parser("reminders", help = "list, add, delete or archive release reminders")
+    reminders.add_argument("action", nargs = "?", choices = ("list", "add", "delete", "archive", "upcoming", "overdue", "archived"), default = "list")
+    reminders.add_argument("values", nargs = "*", help = "TITLE AUTHOR DATE for add, ID for delete and archive, DAYS for upcoming (default 30)")
+    reminders.set_defaults(run = command_reminders)
+
+    return parser
+
+def main(argv = None):
+    """Parses the command line, runs the command and returns the exit status"""
+
+    args = build_parser().parse_args(argv)
+    library = open_library(args.db, "bulk-load" if args.command == "import" else "desktop")
+    stats = None
+    if args.query_stats or args.slow_log:
+        stats = QueryStats(args.slow_ms, args.slow_log, capture_plans = True)
+        library.helper.enable_instrumentation(stats)
+    try:
+        return args.run(library, args)
+    except ValueError as e:
+        print(str(e), file = sys.stderr)
+        return 2
+    finally:
+        library.helper.close()
+        if stats is not None and args.query_stats:
+            stats.write(args.query_stats)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import string
+
+"""Text normalization shared by the forms, the importer and the duplicate check.
+
+Punctuation is removed with str.translate, which does the work in a single pass in C instead of
+building the result one character at a time.
+
+FUNCTIONS:
+    remove_punctuation(category)
+        Removes punctuation from a string or a tuple of values
+
+    normalize_key(text)
+        Returns the comparison key for a title or author: no punctuation, case-folded, single spaces
+
+    normalize_many(values)
+        Returns the comparison keys for many values at once
+
+    book_key(title, author)
+        Returns the (title_norm, author_norm) pair stored with each book
+"""
+
+PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+
+def remove_punctuation(category):
+    """Removes punctuation from a string or a tuple of values.
+
+    Every item is converted to a string and the items are joined together before the punctuation is removed,
+    so a row such as ("Horror",) returned by a query gives "Horror".
+
+    Parameters:
+        category (string or tuple) - value(s) to clean
+
+    Returns string of all characters that are not punctuation
+    """
+
+    if isinstance(category, str):
+        return category.translate(PUNCTUATION_TABLE)
+    return "".join(str(item) for item in category).translate(PUNCTUATION_TABLE)
+
+def normalize_key(text):
+    """Returns the comparison key for a title or author: no punctuation, case-folded, single spaces.
+
+    "The Shining!" and "the  shining" both give "the shining".
+    """
+
+    return " ".join(str(text).translate(PUNCTUATION_TABLE).casefold().split())
+
+def normalize_many(values):
+    """Returns the comparison keys for many values at once (used by the importer for whole batches).
+
+    Parameters:
+        values (iterable) - titles or authors
+
+    Returns list of keys in the same order
+    """
+
+    table = PUNCTUATION_TABLE
+    return [" ".join(str(value).translate(table).casefold().split()) for value in values]
+
+def book_key(title, author):
+    """Returns the (title_norm, author_norm) pair stored with each book"""
+
+    return (normalize_key(title), normalize_key(author))
@@ -0,0 +1,230 @@
+import re, sys, threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+"""Optional cache of the rows returned by SqliteHelper.select() and sort_items(), invalidated table by table on commit.
+
+The cache is off unless a QueryCache is given to SqliteHelper.enable_cache(). Results are keyed by the SQL text and
+its parameters. Every table has a generation counter; a commit through the helper bumps the counters of the tables
+it wrote (and of the tables that triggers keep in step with them, see DERIVED_TABLES) and drops only the results
+that read one of them, so editing a book leaves the cached reminders in place.
+
+A result is stored with the generations of its tables from before the query ran. If a commit lands while the
+query is running, the result is not stored, so a read that raced a write can never be served after it.
+
+Only writes made through the helper are seen. Another program writing the same database file is not, which
+is why the cache is opt-in.
+
+    cache = QueryCache(max_bytes = 32 * 1024 * 1024)
+    helper.enable_cache(cache)
+    ...
+    print(cache.stats())
+
+FUNCTIONS:
+    query_tables(query)
+        Returns the tables a SELECT reads, or None if its result must not be cached
+
+    written_table(query)
+        Returns the table an INSERT, UPDATE or DELETE statement writes, or None
+
+    result_size(rows, limit)
+        Returns the approximate memory used by a list of rows, or None once it passes limit
+"""
+
+#tables written by triggers whenever books is written (see migrations.py)
+DERIVED_TABLES = {
+    "books": ("books_fts", "book_signatures", "book_stats"),
+}
+
+TABLE_NAME = re.compile(r"\b(?:FROM|JOIN)\s+(?:main\.)?([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+WRITTEN_TABLE = re.compile(r"^\s*(?:INSERT|REPLACE|UPDATE|DELETE)\b(?:\s+OR\s+\w+)?(?:\s+INTO|\s+FROM)?\s+(?:main\.)?([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+UNCACHEABLE = re.compile(r"\btemp\.|\brandom\s*\(|'now'|\bchanges\s*\(|\blast_insert_rowid\s*\(", re.IGNORECASE)
+
+CacheStats = namedtuple("CacheStats", ["hits", "misses", "entries", "bytes", "evictions", "invalidations"])
+CacheStats.__doc__ = """Counters of a QueryCache.
+
+    hits (int) - lookups answered from the cache
+    misses (int) - lookups that ran the query
+    entries (int) - results held now
+    bytes (int) - approximate memory used by the results held now
+    evictions (int) - results dropped to stay under max_bytes
+    invalidations (int) - results dropped because a commit wrote one of their tables
+"""
+
+@lru_cache(maxsize = 1024) #the same few statements run over and over
+def query_tables(query):
+    """Returns the tables a SELECT reads as a frozenset, or None if its result must not be cached.
+
+    Statements that are not SELECTs, read temporary tables or call functions whose value changes between runs
+    (random(), 'now', changes()) are never cached.
+    """
+
+    if not re.match(r"\s*(?:SELECT|WITH)\b", query, re.IGNORECASE) or UNCACHEABLE.search(query):
+        return None
+    tables = frozenset(name.lower() for name in TABLE_NAME.findall(query))
+    return tables or None
+
+@lru_cache(maxsize = 1024)
+def written_table(query):
+    """Returns the table an INSERT, UPDATE or DELETE statement writes, or None"""
+
+    match = WRITTEN_TABLE.match(query)
+    return match.group(1).lower() if match else None
+
+def result_size(rows, limit):
+    """Returns the approximate memory used by a list of rows, or None once it passes limit.
+
+    Counts the list, the row tuples and their values; values shared between rows are counted every time,
+    so the estimate errs on the high side.
+    """
+
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+        if size > limit:
+            return None
+    return size
+
+
+class QueryCache:
+    """LRU cache of query results with per-table generations and a memory bound; safe to share between threads.
+
+    METHODS:
+        __init__(self, max_bytes = 32 * 1024 * 1024, max_result_fraction = 0.25)
+            Sets the memory bound and the largest share of it one result may take
+
+        lookup(self, query, parameters)
+            Returns (rows, ticket): the cached rows or None, and the ticket store() needs after a miss
+
+        store(self, ticket, rows)
+            Keeps the rows of a query that missed, unless one of its tables was written while it ran
+
+        invalidate(self, tables)
+            Bumps the generations of the tables (and the tables derived from them) and drops the results that read them
+
+        clear(self)
+            Drops every result
+
+        stats(self)
+            Returns a CacheStats with the hit, miss and eviction counts and the memory in use
+    """
+
+    def __init__(self, max_bytes = 32 * 1024 * 1024, max_result_fraction = 0.25):
+        """Sets the memory bound and the largest share of it one result may take.
+
+        Parameters:
+            max_bytes (int) - approximate memory the cached results may use
+            max_result_fraction (float) - a result larger than this share of max_bytes is not cached, so one
+                large read (e.g. every book) cannot push out everything else
+        """
+
+        self.max_bytes = max_bytes
+        self.max_result_bytes = int(max_bytes * max_result_fraction)
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() #(query, parameters): (rows tuple, tables, size), least recently used first
+        self.table_keys = {} #table: set of keys of the results that read it
+        self.generations = {} #table: number of commits that wrote it
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def lookup(self, query, parameters):
+        """Returns (rows, ticket): the cached rows (a new list) or None, and the ticket store() needs after a miss.
+
+        The ticket is None when the result cannot be cached (see query_tables()) or its parameters cannot be hashed.
+
+        Parameters:
+            query (string) - SELECT statement
+            parameters (tuple) - bound parameters; None for a statement without any
+        """
+
+        tables = query_tables(query)
+        if tables is None:
+            return None, None
+        key = (query, tuple(parameters) if parameters is not None else None)
+        try:
+            hash(key)
+        except TypeError:
+            return None, None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return list(entry[0]), None
+            self.misses += 1
+            return None, (key, tables, tuple(self.generations.get(table, 0) for table in sorted(tables)))
+
+    def store(self, ticket, rows):
+        """Keeps the rows of a query that missed, unless one of its tables was written while it ran.
+
+        Parameters:
+            ticket (tuple) - returned by lookup() before the query ran
+            rows (list) - the query's rows; copied, so the caller may change the list
+        """
+
+        key, tables, generations = ticket
+        size = result_size(rows, self.max_result_bytes)
+        if size is None:
+            return
+        rows = tuple(rows)
+
+        with self.lock:
+            if tuple(self.generations.get(table, 0) for table in sorted(tables)) != generations:
+                return #a commit wrote one of the tables after the query started
+            if key in self.entries:
+                self.drop(key)
+            self.entries[key] = (rows, tables, size)
+            self.bytes += size
+            for table in tables:
+                self.table_keys.setdefault(table, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self.drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def drop(self, key):
+        """Removes one result; the caller holds the lock"""
+
+        rows, tables, size = self.entries.pop(key)
+        self.bytes -= size
+        for table in tables:
+            keys = self.table_keys.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def invalidate(self, tables):
+        """Bumps the generations of the tables (and the tables derived from them) and drops the results that read them.
+
+        Parameters:
+            tables (iterable of strings) - tables written by a commit
+        """
+
+        written = set()
+        for table in tables:
+            table = table.lower()
+            written.add(table)
+            written.update(DERIVED_TABLES.get(table, ()))
+
+        with self.lock:
+            for table in written:
+                self.generations[table] = self.generations.get(table, 0) + 1
+                for key in list(self.table_keys.pop(table, ())):
+                    if key in self.entries:
+                        self.drop(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        """Drops every result; used when the cache is (re)enabled, since writes made while it was off were not seen"""
+
+        with self.lock:
+            self.entries.clear()
+            self.table_keys.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns a CacheStats with the hit, miss and eviction counts and the memory in use"""
+
+        with self.lock:
+            return CacheStats(self.hits, self.misses, len(self.entries), self.bytes, self.evictions, self.invalidations)
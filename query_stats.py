@@ -0,0 +1,250 @@
+import json, os, re, threading, time
+from collections import deque
+from functools import lru_cache
+
+"""Optional timing of the SQL run through SqliteHelper: per-statement histograms, a slow-query log and query plans.
+
+Instrumentation is off unless a QueryStats is given to SqliteHelper.enable_instrumentation(); while it is off
+each helper method pays for one attribute check. Statements are grouped by their text with literals replaced
+by "?" and IN lists collapsed, so "DELETE FROM books WHERE id=5" and "... id=6" share one entry.
+
+    stats = QueryStats(slow_ms = 50, slow_log = "slow_queries.jsonl", capture_plans = True)
+    helper.enable_instrumentation(stats)
+    ...
+    stats.write("query_stats.prom")   #Prometheus textfile collector format
+    stats.write("query_stats.json")
+
+FUNCTIONS:
+    statement_key(query)
+        Returns the statement text used to group executions of the same query
+
+    query_plan(conn, query, parameters = ())
+        Returns the EXPLAIN QUERY PLAN steps for a query without running it
+"""
+
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0) #histogram upper bounds in seconds
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize = 1024) #the same few statements run over and over
+def statement_key(query):
+    """Returns the statement text used to group executions of the same query.
+
+    Whitespace is collapsed, string and number literals become "?", and lists of placeholders become "(?...)".
+    """
+
+    key = WHITESPACE.sub(" ", query).strip()
+    key = STRING_LITERAL.sub("?", key)
+    key = NUMBER_LITERAL.sub("?", key)
+    return IN_LIST.sub("(?...)", key)
+
+def query_plan(conn, query, parameters = ()):
+    """Returns the EXPLAIN QUERY PLAN steps for a query without running it.
+
+    Parameters:
+        conn (sqlite3.Connection) - connection to plan the query on
+        query (string) - SQL text with the same placeholders as when it runs
+        parameters (tuple) - bound parameters
+
+    Returns list of plan steps as strings, indented by depth, or [error message] if the query cannot be planned
+    """
+
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + query, tuple(parameters)).fetchall()
+    except Exception as e: #sqlite3.Error, or a parameter count that does not match
+        return ["cannot explain: " + str(e)]
+
+    depth = {0: -1}
+    steps = []
+    for node, parent, unused, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        steps.append("  " * depth[node] + detail)
+    return steps
+
+def prometheus_label(text):
+    """Escapes a label value for the Prometheus text format"""
+
+    return text.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", " ")
+
+
+class QueryStats:
+    """Collects timings for statements run through one or more SqliteHelpers; safe to share between threads.
+
+    METHODS:
+        __init__(self, slow_ms = 100, slow_log = None, redact = True, capture_plans = False)
+            Sets the slow-query threshold, log file, parameter redaction and plan capture
+
+        record(self, method, query, parameters, seconds, rows, conn = None)
+            Adds one execution to the statement's histogram and logs it if it was slow
+
+        slow_queries(self)
+            Returns the most recent slow queries, oldest first
+
+        snapshot(self)
+            Returns every statement's totals and histogram as a dictionary
+
+        prometheus(self)
+            Returns the statistics in the Prometheus text exposition format
+
+        write(self, path)
+            Writes the statistics to a file, as Prometheus text if the name ends in .prom and as JSON otherwise
+
+        reset(self)
+            Forgets every recorded execution
+    """
+
+    def __init__(self, slow_ms = 100, slow_log = None, redact = True, capture_plans = False):
+        """Sets the slow-query threshold, log file, parameter redaction and plan capture.
+
+        Parameters:
+            slow_ms (float) - executions that take at least this many milliseconds are slow
+            slow_log (string) - file that slow queries are appended to as JSON lines; None to keep them in memory only
+            redact (bool) - log only the types of the parameters, never their values (titles, notes, ...)
+            capture_plans (bool) - store the query plan of a statement the first time it is slow
+        """
+
+        self.slow_seconds = slow_ms / 1000.0
+        self.slow_log = slow_log
+        self.redact = redact
+        self.capture_plans = capture_plans
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forgets every recorded execution"""
+
+        with self.lock:
+            self.statements = {} #(method, statement key): totals dictionary
+            self.recent_slow = deque(maxlen = 100)
+            self.started = time.time()
+
+    def describe_parameters(self, parameters):
+        """Returns the parameters as logged: their type names when redacting, otherwise their values (long text shortened)"""
+
+        if parameters is None:
+            return []
+        if self.redact:
+            return [type(value).__name__ for value in parameters]
+        return [value[:80] if isinstance(value, str) else value for value in parameters]
+
+    def record(self, method, query, parameters, seconds, rows, conn = None):
+        """Adds one execution to the statement's histogram and logs it if it was slow.
+
+        Parameters:
+            method (string) - SqliteHelper method that ran the query, e.g. "sort_items"
+            query (string) - SQL text
+            parameters (tuple) - bound parameters (first row for executemany), or None
+            seconds (float) - wall time of the execution, including fetching the rows
+            rows (int) - rows returned by a select or changed by a write
+            conn (sqlite3.Connection) - connection the query ran on, used to capture the plan of a slow query
+        """
+
+        key = statement_key(query)
+        slow = seconds >= self.slow_seconds
+
+        with self.lock:
+            entry = self.statements.get((method, key))
+            if entry is None:
+                entry = self.statements[(method, key)] = {"method": method, "statement": key, "count": 0, "seconds": 0.0,
+                    "max_seconds": 0.0, "rows": 0, "slow": 0, "buckets": [0] * (len(BUCKETS) + 1), "plan": None}
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            for bucket, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                bucket = len(BUCKETS)
+            entry["buckets"][bucket] += 1
+            if not slow:
+                return
+            entry["slow"] += 1
+            needs_plan = self.capture_plans and conn is not None and entry["plan"] is None
+
+        plan = None
+        if needs_plan:
+            plan = query_plan(conn, query, parameters or ())
+            with self.lock:
+                entry["plan"] = plan
+
+        event = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "method": method, "sql": key if self.redact else query,
+            "parameters": self.describe_parameters(parameters), "ms": round(seconds * 1000, 3), "rows": rows}
+        if plan is not None:
+            event["plan"] = plan
+
+        with self.lock:
+            self.recent_slow.append(event)
+            if self.slow_log:
+                try:
+                    with open(self.slow_log, "a", encoding = "utf-8") as log_file:
+                        log_file.write(json.dumps(event, default = str) + "\n")
+                except OSError as e:
+                    print("Could not write the slow-query log: " + str(e))
+
+    def slow_queries(self):
+        """Returns the most recent slow queries (up to 100), oldest first"""
+
+        with self.lock:
+            return list(self.recent_slow)
+
+    def snapshot(self):
+        """Returns every statement's totals and histogram as a dictionary, slowest total first"""
+
+        with self.lock:
+            statements = [dict(entry, buckets = list(entry["buckets"])) for entry in self.statements.values()]
+            started = self.started
+
+        statements.sort(key = lambda entry: entry["seconds"], reverse = True)
+        for entry in statements:
+            entry["mean_ms"] = round(entry["seconds"] * 1000 / entry["count"], 3)
+            entry["max_ms"] = round(entry["max_seconds"] * 1000, 3)
+            entry["buckets"] = dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], entry["buckets"]))
+
+        return {"since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)), "slow_ms": self.slow_seconds * 1000,
+            "statements": statements, "slow_queries": self.slow_queries()}
+
+    def prometheus(self):
+        """Returns the statistics in the Prometheus text exposition format (a histogram per method and statement)"""
+
+        with self.lock:
+            entries = [dict(entry, buckets = list(entry["buckets"])) for entry in self.statements.values()]
+
+        lines = ["# HELP mybookmgr_query_seconds Time spent running SQL through SqliteHelper.",
+            "# TYPE mybookmgr_query_seconds histogram"]
+        for entry in entries:
+            labels = 'method="%s",statement="%s"' % (entry["method"], prometheus_label(entry["statement"][:200]))
+            cumulative = 0
+            for bound, count in zip(BUCKETS, entry["buckets"]):
+                cumulative += count
+                lines.append('mybookmgr_query_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+            lines.append('mybookmgr_query_seconds_bucket{%s,le="+Inf"} %d' % (labels, entry["count"]))
+            lines.append("mybookmgr_query_seconds_sum{%s} %.6f" % (labels, entry["seconds"]))
+            lines.append("mybookmgr_query_seconds_count{%s} %d" % (labels, entry["count"]))
+
+        for name, field, help_text in (("mybookmgr_query_rows_total", "rows", "Rows returned or changed."),
+                ("mybookmgr_slow_queries_total", "slow", "Executions slower than the slow-query threshold.")):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s counter" % name)
+            for entry in entries:
+                lines.append('%s{method="%s",statement="%s"} %d' % (name, entry["method"], prometheus_label(entry["statement"][:200]), entry[field]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Writes the statistics to a file, as Prometheus text if the name ends in .prom and as JSON otherwise.
+
+        The file is written under a temporary name and renamed, so a collector never reads half a file.
+        """
+
+        if path.endswith(".prom"):
+            text = self.prometheus()
+        else:
+            text = json.dumps(self.snapshot(), indent = 2, default = str)
+
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding = "utf-8") as stats_file:
+            stats_file.write(text)
+        os.replace(temporary, path)
@@ -0,0 +1,132 @@
+import datetime, heapq
+from PyQt5 import QtCore
+from SqliteHelper import SqliteHelper
+
+"""Tells the main window when a reminder's release date arrives.
+
+Only the reminders that are not archived and fall due before the horizon (the next few days) are read, into
+a heap ordered by release time. One single-shot QTimer is set for the earliest of them, so while the program
+is idle nothing runs until a release is due; the cost of a reminder far in the future is nothing until the
+horizon reaches it. The heap is read again when the horizon passes and whenever a write touches the calendar
+table, which is cheap because the query is a range scan on the (archived, date) index.
+"""
+
+HORIZON_DAYS = 7
+MAX_WAIT_MS = 60 * 60 * 1000 #QTimer runs on a monotonic clock, so wake up hourly to notice suspend or clock changes
+
+
+class ReminderScheduler(QtCore.QObject):
+    """Fires reminders_due with the reminders whose release date has arrived.
+
+    A reminder is due from midnight (local time) at the start of its date. Reminders that were already due
+    when the program started are delivered together straight after the first read.
+
+    METHODS:
+        __init__(self, worker, horizon_days = HORIZON_DAYS)
+            Creates the timer and listens for changes to the calendar table
+
+        start(self)
+            Reads the reminders due before the horizon and sets the timer
+
+        stop(self)
+            Stops the timer
+
+        set_reminders(self, reminders)
+            Replaces the heap with the reminders read by the worker and sets the timer for the earliest one
+
+        fire_due(self)
+            Pops every reminder that is now due, emits reminders_due with them and sets the timer for the next one
+
+        apply_changes(self, changes)
+            Reads the reminders again when a write touched the calendar table
+    """
+
+    reminders_due = QtCore.pyqtSignal(object) #list of (id, date, title, author) tuples
+
+    def __init__(self, worker, horizon_days = HORIZON_DAYS):
+        """Creates the timer and listens for changes to the calendar table.
+
+        Parameters:
+            worker: reference to the DatabaseWorker that owns the sqlite connection
+            horizon_days (int) - how far ahead reminders are read into the heap
+        """
+
+        super(ReminderScheduler, self).__init__()
+        self.worker = worker
+        self.horizon_days = horizon_days
+        self.heap = [] #(release time, id, reminder)
+        self.horizon = None #release times up to here are in the heap
+        self.running = False
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.fire_due)
+        self.worker.changes_ready.connect(self.apply_changes)
+
+    @staticmethod
+    def release_time(date):
+        """Returns the local datetime at which a reminder dated yyyy-MM-dd is due"""
+
+        return datetime.datetime.combine(datetime.date.fromisoformat(date), datetime.time())
+
+    def start(self):
+        """Reads the reminders due before the horizon and sets the timer"""
+
+        self.running = True
+        self.horizon = datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days = self.horizon_days), datetime.time())
+        last_date = (self.horizon.date() - datetime.timedelta(days = 1)).isoformat()
+        self.worker.submit(SqliteHelper.reminders_between, "", last_date, callback = self.set_reminders, key = self)
+
+    def stop(self):
+        """Stops the timer"""
+
+        self.running = False
+        self.timer.stop()
+
+    def set_reminders(self, reminders):
+        """Replaces the heap with the reminders read by the worker and sets the timer for the earliest one.
+
+        Parameters:
+            reminders (list of tuples) - (id, date, title, author) reminders that are not archived, due before the horizon
+        """
+
+        heap = []
+        for reminder in reminders:
+            try:
+                heap.append((self.release_time(reminder[1]), reminder[0], reminder))
+            except ValueError:
+                print("Reminder %d has an invalid date: %r" % (reminder[0], reminder[1]))
+        heapq.heapify(heap)
+        self.heap = heap
+        self.fire_due()
+
+    def fire_due(self):
+        """Pops every reminder that is now due, emits reminders_due with them and sets the timer for the next one"""
+
+        if not self.running:
+            return
+
+        now = datetime.datetime.now()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[2])
+        if due:
+            self.reminders_due.emit(due)
+
+        if now >= self.horizon:
+            self.start() #moves the horizon on; set_reminders() sets the timer again
+            return
+
+        wake = self.heap[0][0] if self.heap else self.horizon
+        wait = (min(wake, self.horizon) - now).total_seconds() * 1000
+        self.timer.start(int(max(0, min(wait + 1, MAX_WAIT_MS))))
+
+    def apply_changes(self, changes):
+        """Reads the reminders again when a write touched the calendar table.
+
+        Parameters:
+            changes (list of RowChange) - changes reported by SqliteHelper after a commit
+        """
+
+        if self.running and any(change.table == "calendar" for change in changes):
+            self.start()
@@ -0,0 +1,361 @@
+import argparse, asyncio, json, re, signal, sys
+from http import HTTPStatus
+from itertools import islice
+from urllib.parse import parse_qsl, unquote, urlsplit
+from library import Library, EXPORT_COLUMNS
+from library_pool import LibraryPool
+
+"""HTTP/JSON server for many MyBookMgr libraries at once, built on asyncio and the standard library only.
+
+Every library is a booklist.db-style file in one folder (alice.db is the library "alice"). The files are
+opened through a LibraryPool, so only the recently used ones are held open, SQLite runs on a bounded thread
+pool and the writes to one library run one at a time. Connections are kept alive between requests.
+
+    python server.py --root libraries --port 8765
+    curl http://127.0.0.1:8765/libraries/alice/search?q=king
+
+ROUTES (every body is JSON; books are objects with id, title, author, rating, genre, series and notes):
+    GET    /status                                      pool size and counters
+    GET    /libraries/{name}/books?after=0&limit=100    a page of books in id order; "next" is the after for the next page
+    POST   /libraries/{name}/books                      add a book: 201 with its id, or 409 with the duplicates and similar books
+    GET    /libraries/{name}/books/{id}                 one book
+    PATCH  /libraries/{name}/books/{id}                 change rating, genre, series or notes
+    DELETE /libraries/{name}/books/{id}                 delete a book
+    GET    /libraries/{name}/search?q=...&limit=50      full-text search, best match first
+    GET    /libraries/{name}/filter?category=...&value=...&limit=100
+    GET    /libraries/{name}/query?q=...&after=0&limit=100&explain=1
+                                                        books matching a filter query (see filter_query.py), in id order;
+                                                        "query" is the normalized query, "plan" the EXPLAIN QUERY PLAN steps
+    GET    /libraries/{name}/stats                      totals from the statistics summary
+    GET    /libraries/{name}/reminders?view=all         view is all, upcoming (with days=30), overdue or archived
+    POST   /libraries/{name}/reminders                  add a reminder (title, author, date): 201 with its id
+    DELETE /libraries/{name}/reminders/{id}             delete a reminder
+    POST   /libraries/{name}/reminders/{id}/archive     archive a reminder ({"archived": false} makes it active again)
+
+Errors are returned as {"error": message} with status 400 for bad input, 404 for a missing library, book or
+reminder, 405 for a method a route does not have and 500 if SQLite fails.
+"""
+
+MAX_HEADER_BYTES = 16384
+MAX_BODY_BYTES = 1024 * 1024
+MAX_PAGE = 1000
+REMINDER_COLUMNS = ("id", "date", "title", "author")
+BOOK_FIELDS = ("title", "author", "rating", "genre", "series", "notes", "allow_similar")
+UPDATE_FIELDS = ("rating", "genre", "series", "notes")
+
+ROUTES = [
+    ("/status", {"GET": "status"}),
+    ("/libraries/(?P<library>[^/]+)/books", {"GET": "list_books", "POST": "add_book"}),
+    ("/libraries/(?P<library>[^/]+)/books/(?P<id>\\d+)", {"GET": "get_book", "PATCH": "update_book", "DELETE": "delete_book"}),
+    ("/libraries/(?P<library>[^/]+)/search", {"GET": "search"}),
+    ("/libraries/(?P<library>[^/]+)/filter", {"GET": "filter_books"}),
+    ("/libraries/(?P<library>[^/]+)/query", {"GET": "query_books"}),
+    ("/libraries/(?P<library>[^/]+)/stats", {"GET": "stats"}),
+    ("/libraries/(?P<library>[^/]+)/reminders", {"GET": "list_reminders", "POST": "add_reminder"}),
+    ("/libraries/(?P<library>[^/]+)/reminders/(?P<id>\\d+)", {"DELETE": "delete_reminder"}),
+    ("/libraries/(?P<library>[^/]+)/reminders/(?P<id>\\d+)/archive", {"POST": "archive_reminder"}),
+]
+ROUTES = [(re.compile("^" + pattern + "$"), methods) for pattern, methods in ROUTES]
+
+def book_object(book):
+    """Returns a book tuple as a JSON object"""
+
+    return dict(zip(EXPORT_COLUMNS, book))
+
+def filter_page(library, category, value, limit):
+    """Returns the first limit books that match a filter, closing the cursor behind them (runs on the thread pool)"""
+
+    books = library.filter(category, value)
+    try:
+        return list(islice(books, limit))
+    finally:
+        books.close()
+
+def query_page(library, expression, after, limit, explain):
+    """Returns the normalized query, a page of the books that match it and its plan if asked for (runs on the thread pool)"""
+
+    normalized, books = library.query(expression, after, limit)
+    return normalized, books, library.explain_query(expression) if explain else None
+
+def reminder_view(library, view, days):
+    """Returns the reminders for one view of the reminders list (runs on the thread pool)"""
+
+    if view == "upcoming":
+        return library.upcoming_reminders(days)
+    if view == "overdue":
+        return library.overdue_reminders()
+    if view == "archived":
+        return library.archived_reminders()
+    return library.reminders()
+
+
+class HttpError(Exception):
+    """An error response with its HTTP status"""
+
+    def __init__(self, status, message):
+        super(HttpError, self).__init__(message)
+        self.status = status
+
+
+class BookServer:
+    """Answers HTTP requests for the libraries in a LibraryPool.
+
+    METHODS:
+        __init__(self, pool)
+            Stores the pool the requests are run on
+
+        handle_connection(self, reader, writer)
+            Serves the requests on one connection until the client closes it or asks for it to be closed
+
+        read_request(self, reader)
+            Reads one request and returns (method, target, body, keep_alive), or None when the client has closed the connection
+
+        dispatch(self, method, target, body)
+            Finds the route for a request, runs it and returns (status, response object)
+
+        respond(self, writer, status, payload, keep_alive)
+            Writes a JSON response
+
+        status, list_books, add_book, get_book, update_book, delete_book, search, filter_books, query_books, stats,
+        list_reminders, add_reminder, delete_reminder, archive_reminder
+            Route handlers; each is called as handler(match, query, body) and returns (status, response object)
+    """
+
+    def __init__(self, pool):
+        """Stores the pool the requests are run on.
+
+        Parameters:
+            pool (LibraryPool) - open libraries, thread pool and write locks
+        """
+
+        self.pool = pool
+
+    async def handle_connection(self, reader, writer):
+        """Serves the requests on one connection until the client closes it or asks for it to be closed"""
+
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except HttpError as e:
+                    await self.respond(writer, e.status, {"error": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, target, body, keep_alive = request
+                status, payload = await self.dispatch(method, target, body)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass #the client went away
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """Reads one request and returns (method, target, body, keep_alive), or None when the client has closed the connection.
+
+        Raises HttpError for a request that cannot be parsed or is too large
+        """
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(400, "Incomplete request")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "Request header too large")
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise HttpError(400, "Bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        length = headers.get("content-length", "0")
+        if not length.isdigit():
+            raise HttpError(400, "Bad Content-Length")
+        if int(length) > MAX_BODY_BYTES:
+            raise HttpError(413, "Request body too large")
+        body = await reader.readexactly(int(length)) if int(length) > 0 else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return method, target, body, keep_alive
+
+    async def dispatch(self, method, target, body):
+        """Finds the route for a request, runs it and returns (status, response object)"""
+
+        url = urlsplit(target)
+        try:
+            for pattern, methods in ROUTES:
+                match = pattern.match(url.path)
+                if match is None:
+                    continue
+                if method not in methods:
+                    raise HttpError(405, "Method not allowed")
+                if body:
+                    try:
+                        body = json.loads(body)
+                    except ValueError:
+                        raise HttpError(400, "The body is not valid JSON")
+                    if not isinstance(body, dict):
+                        raise HttpError(400, "The body must be a JSON object")
+                return await getattr(self, methods[method])(match, dict(parse_qsl(url.query)), body or {})
+            raise HttpError(404, "No route for " + url.path)
+        except HttpError as e:
+            return e.status, {"error": str(e)}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except LookupError as e:
+            return 404, {"error": str(e.args[0]) if e.args else "Not found"}
+        except Exception as e:
+            print("Request failed: %s %s: %r" % (method, target, e), file = sys.stderr)
+            return 500, {"error": "Internal error"}
+
+    async def respond(self, writer, status, payload, keep_alive):
+        """Writes a JSON response (no body for 204)"""
+
+        body = b"" if status == 204 else json.dumps(payload, ensure_ascii = False).encode("utf-8")
+        head = "HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: %d\r\n%s\r\n" % (
+            status, HTTPStatus(status).phrase, len(body), "" if keep_alive else "Connection: close\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    def run(self, match, function, *args, write = False):
+        """Runs function(library, *args) for the library named in the route on the pool"""
+
+        return self.pool.run(unquote(match.group("library")), function, *args, write = write)
+
+    @staticmethod
+    def limit(query, default):
+        """Returns the limit query parameter, between 1 and MAX_PAGE"""
+
+        return max(1, min(int(query.get("limit", default)), MAX_PAGE))
+
+    @staticmethod
+    def fields(body, allowed):
+        """Returns the body's fields, rejecting any that the route does not take"""
+
+        unknown = set(body) - set(allowed)
+        if unknown:
+            raise HttpError(400, "Unknown fields: " + ", ".join(sorted(unknown)))
+        return body
+
+    async def status(self, match, query, body):
+        return 200, self.pool.stats()
+
+    async def list_books(self, match, query, body):
+        books = await self.run(match, Library.books, int(query.get("after", 0)), self.limit(query, 100))
+        return 200, {"books": [book_object(book) for book in books], "next": books[-1][0] if books else None}
+
+    async def add_book(self, match, query, body):
+        result = await self.run(match, lambda library: library.add_book(**self.fields(body, BOOK_FIELDS)), write = True)
+        if result.book_id is None:
+            return 409, {"error": "The book is already in the library", "duplicates": result.duplicates,
+                "similar": [{"score": round(score, 3), "id": book_id, "title": title, "author": author} for score, book_id, title, author in result.similar]}
+        return 201, {"id": result.book_id}
+
+    async def get_book(self, match, query, body):
+        book = await self.run(match, Library.book, int(match.group("id")))
+        if book is None:
+            raise HttpError(404, "No book with id " + match.group("id"))
+        return 200, book_object(book)
+
+    async def update_book(self, match, query, body):
+        fields = self.fields(body, UPDATE_FIELDS)
+        if not await self.run(match, lambda library: library.update_book(int(match.group("id")), **fields), write = True):
+            raise HttpError(404, "No book with id " + match.group("id"))
+        return 200, {"id": int(match.group("id"))}
+
+    async def delete_book(self, match, query, body):
+        if not await self.run(match, Library.delete_book, int(match.group("id")), write = True):
+            raise HttpError(404, "No book with id " + match.group("id"))
+        return 204, None
+
+    async def search(self, match, query, body):
+        books = await self.run(match, Library.search, query.get("q", ""), self.limit(query, 50))
+        return 200, {"books": [book_object(book) for book in books]}
+
+    async def filter_books(self, match, query, body):
+        if "category" not in query or "value" not in query:
+            raise HttpError(400, "filter needs category and value")
+        books = await self.run(match, filter_page, query["category"], query["value"], self.limit(query, 100))
+        return 200, {"books": [book_object(book) for book in books]}
+
+    async def query_books(self, match, query, body):
+        explain = query.get("explain", "") not in ("", "0", "false")
+        normalized, books, plan = await self.run(match, query_page, query.get("q", ""), int(query.get("after", 0)), self.limit(query, 100), explain)
+        result = {"query": normalized, "books": [book_object(book) for book in books], "next": books[-1][0] if books else None}
+        if plan is not None:
+            result["plan"] = plan.steps
+            result["full_scan"] = plan.full_scan
+        return 200, result
+
+    async def stats(self, match, query, body):
+        return 200, await self.run(match, Library.stats)
+
+    async def list_reminders(self, match, query, body):
+        view = query.get("view", "all")
+        if view not in ("all", "upcoming", "overdue", "archived"):
+            raise HttpError(400, "view must be all, upcoming, overdue or archived")
+        reminders = await self.run(match, reminder_view, view, int(query.get("days", 30)))
+        return 200, {"reminders": [dict(zip(REMINDER_COLUMNS, reminder)) for reminder in reminders]}
+
+    async def add_reminder(self, match, query, body):
+        fields = self.fields(body, ("title", "author", "date"))
+        if len(fields) != 3:
+            raise HttpError(400, "A reminder needs a title, an author and a date")
+        return 201, {"id": await self.run(match, Library.add_reminder, fields["title"], fields["author"], fields["date"], write = True)}
+
+    async def delete_reminder(self, match, query, body):
+        if not await self.run(match, Library.delete_reminder, int(match.group("id")), write = True):
+            raise HttpError(404, "No reminder with id " + match.group("id"))
+        return 204, None
+
+    async def archive_reminder(self, match, query, body):
+        archived = bool(self.fields(body, ("archived",)).get("archived", True))
+        if not await self.run(match, Library.archive_reminder, int(match.group("id")), archived, write = True):
+            raise HttpError(404, "No reminder with id " + match.group("id"))
+        return 200, {"id": int(match.group("id")), "archived": archived}
+
+
+async def serve(directory, host = "127.0.0.1", port = 8765, capacity = 64, idle_seconds = 300, threads = 8, create = False):
+    """Runs the server until it is cancelled (Ctrl+C or SIGTERM), then closes every library"""
+
+    try:
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass #Windows has no SIGTERM handler; Ctrl+C still stops the server
+    pool = LibraryPool(directory, capacity, idle_seconds, threads, create)
+    pool.start()
+    listener = await asyncio.start_server(BookServer(pool).handle_connection, host, port, limit = MAX_HEADER_BYTES)
+    print("Serving the libraries in %s on http://%s:%d" % (directory, host, port), file = sys.stderr)
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve many MyBookMgr libraries over HTTP/JSON")
+    parser.add_argument("--root", default = "libraries", help = "folder with one .db file per library (default libraries)")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--capacity", type = int, default = 64, help = "libraries kept open (default 64)")
+    parser.add_argument("--idle", type = float, default = 300, help = "seconds before an unused library is closed (default 300)")
+    parser.add_argument("--threads", type = int, default = 8, help = "threads running SQLite work (default 8)")
+    parser.add_argument("--create", action = "store_true", help = "create a library the first time it is used")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.root, args.host, args.port, args.capacity, args.idle, args.threads, args.create))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
@@ -1,42 +1,50 @@
-from PyQt5 import QtCore, QtGui, QtWidgets, uic
-from PyQt5.QtWidgets import *
-import string
+from normalize import remove_punctuation
 
 """These functions are used by multiple classes in the program so they are together in this file.
+Only show_message() needs Qt, and it imports it when called, so the command-line tools can use the rest
+without loading PyQt5.
 
 FUNCTIONS:
     remove_punctuation(category)
-        Removes punctuation from a list of tuples.
+        Removes punctuation from a string or a tuple of values (defined in normalize.py).
+
+    clean_book_details(title, author, rating, genre, series, notes)
+        Applies the same clean-up to a book's details that the Add Book form does.
+
+    clean_reminder_details(title, author)
+        Applies the same clean-up to a reminder's title and author that the Add Reminder dialog does.
 
     show_message(title = "Error", message = "Please input data")
         Pop-up window with brief message to user when exception is raised
 
 """
 
-def remove_punctuation(category):
-    """Removes punctuation from a list of tuples.
+def clean_book_details(title, author, rating, genre, series, notes):
+    """Applies the same clean-up to a book's details that the Add Book form does.
+
+    Punctuation is removed from title, author, genre and series, and they are converted to title case.
+    Rating is converted to an integer (0 if it is blank).
+
+    Returns tuple of (title, author, rating, genre, series, notes)
+
+    Raises ValueError if the rating is not a whole number
+    """
+
+    title = remove_punctuation(str(title)).title()
+    author = remove_punctuation(str(author)).title()
+    rating = int(rating) if str(rating).strip() != "" else 0
+    genre = remove_punctuation(str(genre).title())
+    series = remove_punctuation(str(series).title())
+
+    return (title, author, rating, genre, series, str(notes))
 
-    Accepts a list of tuples and iterates through each character in each item of the tuple to remove punctuation. 
-    When the method finds a character that is not punctuation, it saves it into a new string called word.
-    
-    Parameters:
-        category (list of tuples) - accepts a list of tuples to iterate through
-    
-    Variables: 
-        word (string) - created from all characters in iterated tuple that is not punctuation
+def clean_reminder_details(title, author):
+    """Applies the same clean-up to a reminder's title and author that the Add Reminder dialog does.
 
-    Returns string of all characters from the tuple that is not punctuation
+    Returns tuple of (title, author) without punctuation, in title case
     """
 
-    word = ""
-    for item in category:
-        item = str(item) 
-            
-        for char in item:
-            if char not in string.punctuation:
-                word += char
-            
-    return word
+    return (remove_punctuation(str(title)).title(), remove_punctuation(str(author)).title())
 
 def show_message(title = "Error", message = "Please input data"):
     """Pop-up window with brief message to user when exception is raised.
@@ -45,4 +53,5 @@ def show_message(title = "Error", message = "Please input data"):
         title (string) - default is "Error"
         message (string) - default is "Please input data"
     """
+    from PyQt5.QtWidgets import QMessageBox
     QMessageBox.information(None, title, message)
@@ -0,0 +1,61 @@
+import time
+
+"""Breaks the time from program start to the first rows on screen down by phase.
+
+Run the program as "python main.py --startup-report" to print the report once the first window of books and
+reminders has been delivered.
+"""
+
+
+class StartupTimer:
+    """Records how long each startup phase took.
+
+    METHODS:
+        __init__(self, verbose = False)
+            Starts the clock
+
+        mark(self, phase)
+            Records the time since the previous mark as the duration of the phase
+
+        finish(self, phase)
+            Marks the last phase and prints the report if the timer is verbose
+
+        report(self)
+            Returns the phases, their durations and the running total as printable text
+    """
+
+    def __init__(self, verbose = False):
+        """Starts the clock.
+
+        Parameters:
+            verbose (bool) - print the report when finish() is called
+        """
+
+        self.verbose = verbose
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = [] #(phase, seconds) in the order they were marked
+
+    def mark(self, phase):
+        """Records the time since the previous mark as the duration of the phase"""
+
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self, phase):
+        """Marks the last phase and prints the report if the timer is verbose"""
+
+        self.mark(phase)
+        if self.verbose:
+            print(self.report())
+
+    def report(self):
+        """Returns the phases, their durations and the running total as printable text"""
+
+        lines = ["%-20s %10s %10s" % ("phase", "ms", "total ms")]
+        total = 0.0
+        for phase, seconds in self.phases:
+            total += seconds
+            lines.append("%-20s %10.1f %10.1f" % (phase, seconds * 1000, total * 1000))
+        return "\n".join(lines)
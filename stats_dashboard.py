@@ -0,0 +1,149 @@
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import Qt
+from book_stats import STATS_CATEGORIES
+
+"""Statistics dock for the main window: totals, and books and average rating by author, genre, series and rating.
+
+Everything shown is read from the book_stats summary (see book_stats.py) in one worker request, so opening or
+refreshing the dashboard takes the same time for a hundred books as for a million. While the dock is visible it
+is refreshed shortly after a write to books is committed; while it is hidden it only notes that it is out of date.
+
+FUNCTIONS:
+    read_dashboard(helper, limit = DASHBOARD_ROWS)
+        Returns the totals and the largest values of each category, read from the book_stats summary
+"""
+
+DASHBOARD_ROWS = 25
+DASHBOARD_TABS = (("author", "Authors", "Author"), ("genre", "Genres", "Genre"), ("series", "Series", "Series"), ("rating", "Ratings", "Rating"))
+
+def read_dashboard(helper, limit = DASHBOARD_ROWS):
+    """Returns the totals and the largest values of each category, read from the book_stats summary.
+
+    Runs on the DatabaseWorker thread.
+
+    Parameters:
+        helper (SqliteHelper) - the worker's helper
+        limit (int) - number of authors, genres and series read
+
+    Returns dictionary with books, average_rating and {category: [(value, books, average rating), ...]}
+    """
+
+    books, average = helper.book_totals()
+    stats = {"books": books, "average_rating": average}
+    for category, tab, heading in DASHBOARD_TABS:
+        if category == "rating":
+            stats[category] = helper.category_stats(category, by_count = False)
+        else:
+            stats[category] = helper.category_stats(category, limit)
+    return stats
+
+
+class StatsDashboard(QtWidgets.QDockWidget):
+    """Dock widget that shows the library statistics and keeps them current.
+
+    METHODS:
+        __init__(self, worker, parent = None, limit = DASHBOARD_ROWS)
+            Builds the totals label and one table per category and listens for the worker's change events
+
+        refresh(self)
+            Asks the worker for the statistics; a refresh still queued is superseded
+
+        show_stats(self, stats)
+            Fills the totals label and the tables with the statistics read by read_dashboard()
+
+        apply_changes(self, changes)
+            Schedules a refresh when a committed write touched books, or marks the dashboard out of date while it is hidden
+
+        showEvent(self, event)
+            Refreshes the dashboard when it is shown after missing changes
+    """
+
+    def __init__(self, worker, parent = None, limit = DASHBOARD_ROWS):
+        """Builds the totals label and one table per category and listens for the worker's change events.
+
+        Parameters:
+            worker: reference to the DatabaseWorker that owns the sqlite connection
+            parent (QWidget) - main window the dock belongs to
+            limit (int) - number of authors, genres and series listed
+        """
+
+        super(StatsDashboard, self).__init__("Statistics", parent)
+        self.setObjectName("statsDashboard")
+        self.worker = worker
+        self.limit = limit
+        self.stale = True
+
+        contents = QtWidgets.QWidget(self)
+        layout = QtWidgets.QVBoxLayout(contents)
+        self.totals_label = QtWidgets.QLabel("Loading statistics...", contents)
+        layout.addWidget(self.totals_label)
+
+        self.tabs = QtWidgets.QTabWidget(contents)
+        self.tables = {}
+        for category, tab, heading in DASHBOARD_TABS:
+            table = QtWidgets.QTableWidget(0, 3, self.tabs)
+            table.setHorizontalHeaderLabels((heading, "Books", "Average rating"))
+            table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+            table.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+            table.verticalHeader().hide()
+            table.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+            self.tabs.addTab(table, tab)
+            self.tables[category] = table
+        layout.addWidget(self.tabs)
+        self.setWidget(contents)
+
+        self.refresh_timer = QtCore.QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.setInterval(300) #one refresh for a burst of writes
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.worker.changes_ready.connect(self.apply_changes)
+
+    def refresh(self):
+        """Asks the worker for the statistics; a refresh still queued is superseded"""
+
+        self.stale = False
+        self.worker.submit(read_dashboard, self.limit, callback = self.show_stats, key = self)
+
+    def show_stats(self, stats):
+        """Fills the totals label and the tables with the statistics read by read_dashboard().
+
+        Parameters:
+            stats (dictionary) - result of read_dashboard()
+        """
+
+        if stats["books"] == 0:
+            self.totals_label.setText("No books yet")
+        else:
+            self.totals_label.setText("%d books, average rating %.2f" % (stats["books"], stats["average_rating"]))
+
+        for category, table in self.tables.items():
+            rows = stats[category]
+            table.setRowCount(len(rows))
+            for row, (value, books, average) in enumerate(rows):
+                for column, text in enumerate((str(value) if str(value) != "" else "(none)", str(books), "%.2f" % average)):
+                    item = QtWidgets.QTableWidgetItem(text)
+                    if column > 0:
+                        item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                    table.setItem(row, column, item)
+
+    def apply_changes(self, changes):
+        """Schedules a refresh when a committed write touched books, or marks the dashboard out of date while it is hidden.
+
+        Parameters:
+            changes (list of RowChange) - changes reported by SqliteHelper after a commit
+        """
+
+        if not any(change.table == "books" and (change.operation != "update" or set(change.columns) & set(STATS_CATEGORIES))
+                for change in changes):
+            return
+        if self.isVisible():
+            self.refresh_timer.start()
+        else:
+            self.stale = True
+
+    def showEvent(self, event):
+        """Refreshes the dashboard when it is shown after missing changes"""
+
+        super(StatsDashboard, self).showEvent(event)
+        if self.stale:
+            self.refresh()
@@ -0,0 +1,132 @@
+import os, shutil, tempfile, unittest
+import duplicates
+from duplicates import within_edits, same_author, similarity, signature_rows, deletion_rows, DELETION_BAND
+from library import open_library
+
+"""Tests for the near-duplicate detection in duplicates.py: the typo and author rules, the buckets a typo must
+share with the original title, and the add-time check and cluster report on a real (temporary) database.
+
+    python -m unittest test_duplicates
+"""
+
+ONE_WORD_TITLES = ("The Shining", "Carrie", "Misery", "It", "Dune", "Emma", "Rebecca", "Dracula", "Frankenstein",
+    "Beloved", "Matilda", "Holes", "Twilight", "Atonement", "Persuasion", "Jaws", "Coraline", "Christine", "Cujo", "Outlander")
+
+def typo_variants(word):
+    """Returns every word one typing mistake away from word: a letter left out, added, changed or swapped with the next"""
+
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    variants = set()
+    for i in range(len(word) + 1):
+        variants.update(word[:i] + letter + word[i:] for letter in letters)
+        if i < len(word):
+            variants.add(word[:i] + word[i + 1:])
+            variants.update(word[:i] + letter + word[i + 1:] for letter in letters)
+        if i + 1 < len(word):
+            variants.add(word[:i] + word[i + 1] + word[i] + word[i + 2:])
+    variants.discard(word)
+    return sorted(variant for variant in variants if variant.strip())
+
+def buckets(title, author):
+    return set((band, bucket) for book_id, band, bucket in signature_rows(None, title, author))
+
+
+class WithinEditsTest(unittest.TestCase):
+
+    def test_one_mistake(self):
+        for typo in ("Misrey", "Misey", "Miserry", "Misary"):
+            self.assertTrue(within_edits("misery", typo.lower(), 1), typo)
+
+    def test_two_mistakes_need_a_limit_of_two(self):
+        self.assertFalse(within_edits("misery", "mysary", 1))
+        self.assertTrue(within_edits("misery", "mysary", 2))
+
+    def test_empty_and_equal(self):
+        self.assertTrue(within_edits("", "", 0))
+        self.assertTrue(within_edits("it", "it", 0))
+        self.assertTrue(within_edits("", "a", 1))
+        self.assertFalse(within_edits("", "ab", 1))
+
+
+class SameAuthorTest(unittest.TestCase):
+
+    def test_middle_name_and_typo(self):
+        self.assertTrue(same_author("king stephen", "e king stephen"))
+        self.assertTrue(same_author("king stephen", "king stephan"))
+
+    def test_different_people(self):
+        self.assertFalse(same_author("a sanderson sarah", "g sanderson sarah"))
+        self.assertFalse(same_author("c james jones", "c james johnson"))
+        self.assertFalse(same_author("hoover i matthew", "h hoover michael"))
+
+
+class ScoreTest(unittest.TestCase):
+
+    def test_typo_and_subtitle(self):
+        self.assertGreater(similarity("The Shining", "Stephen King", "The Shinning", "Stephen King"), 0)
+        self.assertGreater(similarity("The Shining: A Novel", "Stephen King", "The Shining", "King, Stephen"), 0)
+        self.assertGreater(similarity("Pet Semetary", "Stephen King", "Pet Sematary", "Stephen E King"), 0)
+
+    def test_distinct_titles(self):
+        self.assertEqual(similarity("Children Of The Moon", "Anna Lee", "Children Of The Thorn", "Anna Lee"), 0)
+        self.assertEqual(similarity("Carrie", "Stephen King", "Christine", "Stephen King"), 0)
+        self.assertEqual(similarity("The Shining", "Stephen King", "The Shining", "Jack Torrance"), 0)
+
+
+class SignatureTest(unittest.TestCase):
+
+    def test_one_word_typos_share_a_bucket(self):
+        #regression: a one-word title only had the MinHash bands to catch a typo, and about a quarter of them missed
+        for title in ONE_WORD_TITLES:
+            article = "The " if title.startswith("The ") else ""
+            original = buckets(title, "Stephen King")
+            for variant in typo_variants(title[len(article):].lower()):
+                typed = article + variant.title()
+                self.assertTrue(original & buckets(typed, "Stephen King"), typed + " shares no bucket with " + title)
+
+    def test_deletion_band_only_for_one_word_titles(self):
+        self.assertEqual(deletion_rows(1, "Pet Sematary", "Stephen King"), [])
+        rows = deletion_rows(1, "The Shining", "Stephen King")
+        self.assertEqual(len(rows), len("shining") + 1)
+        self.assertTrue(all(band == DELETION_BAND for book_id, band, bucket in rows))
+
+    def test_typed_and_saved_titles_agree(self):
+        self.assertEqual(deletion_rows(1, "The Shining!", "Stephen King"), deletion_rows(1, "the shining", "King, Stephen"))
+
+
+class LibraryTest(unittest.TestCase):
+    """add_book() and clusters() on a temporary database"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.library = open_library(os.path.join(self.folder, "booklist.db"))
+
+    def tearDown(self):
+        self.library.helper.close()
+        shutil.rmtree(self.folder)
+
+    def test_add_warns_about_one_word_typo(self):
+        first = self.library.add_book("The Shining", "Stephen King")
+        result = self.library.add_book("The Shinning", "Stephen King")
+        self.assertIsNone(result.book_id)
+        self.assertEqual([match[1] for match in result.similar], [first.book_id])
+
+    def test_add_warns_about_subtitle(self):
+        first = self.library.add_book("The Shining", "Stephen King")
+        result = self.library.add_book("The Shining: A Novel", "Stephen King")
+        self.assertEqual([match[1] for match in result.similar], [first.book_id])
+
+    def test_add_accepts_different_book(self):
+        self.library.add_book("Children Of The Moon", "Anna Lee")
+        self.assertIsNotNone(self.library.add_book("Children Of The Thorn", "Anna Lee").book_id)
+
+    def test_clusters_do_not_chain(self):
+        for author in ("Matthew I Hoover", "Michael I Hoover", "Michael H Hoover"):
+            self.library.add_book("Before The Dream", author, allow_similar = True)
+        groups = duplicates.DuplicateIndex(self.library.helper).clusters()
+        for group in groups:
+            self.assertEqual(len(set(book[2] for book in group)), 1, group)
+
+
+if __name__ == "__main__":
+    unittest.main()
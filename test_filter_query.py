@@ -0,0 +1,132 @@
+import os, random, shutil, sqlite3, tempfile, unittest
+from filter_query import parse_filter, format_filter, compile_tree, compile_filter, check_plan, FilterSyntaxError
+from library import open_library
+
+"""Tests for the filter query language in filter_query.py: parsing to the normalized tree, the sqlite conditions it
+compiles to, NOT written as ranges (checked against plain NOT on a table with NULLs) and the query plans
+check_plan() reports on a real (temporary) database.
+
+    python -m unittest test_filter_query
+"""
+
+def plain_not(tree):
+    """Returns the (condition, parameters) for a tree with every NOT compiled as NOT (...), for comparison"""
+
+    if tree[0] == "not":
+        condition, parameters = plain_not(tree[1])
+        return "NOT (" + condition + ")", parameters
+    if tree[0] in ("and", "or"):
+        parts = [plain_not(child) for child in tree[1]]
+        joiner = " AND " if tree[0] == "and" else " OR "
+        return joiner.join("(" + condition + ")" for condition, parameters in parts), sum((parameters for condition, parameters in parts), ())
+    return compile_tree(tree)
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_values_are_cleaned(self):
+        self.assertEqual(parse_filter('author:"stephen king"'), ("cmp", "author", "=", "Stephen King"))
+        self.assertEqual(parse_filter("author:steph*"), ("prefix", "author", "Steph"))
+        self.assertEqual(parse_filter("genre:(Thriller|horror)"), ("in", "genre", ("Horror", "Thriller")))
+
+    def test_spacing_and_case_normalize(self):
+        self.assertEqual(parse_filter("rating >= 4  genre:horror"), parse_filter("rating>=4 genre:Horror"))
+        self.assertEqual(format_filter(parse_filter("rating >= 4  genre:horror")), "rating>=4 genre:Horror")
+
+    def test_nested_groups_flatten(self):
+        self.assertEqual(parse_filter("genre:Horror (rating:5 rating:5)"), parse_filter("genre:Horror rating:5"))
+        self.assertEqual(parse_filter("NOT NOT genre:Horror"), parse_filter("genre:Horror"))
+
+    def test_format_round_trip(self):
+        for query in ('author:"Stephen King"', "author:Steph*", "rating:3..5", "rating:4..", "genre:(Horror|Thriller)",
+                'author:King* (rating:5 OR genre:Horror) -notes:""', "king shining"):
+            tree = parse_filter(query)
+            self.assertEqual(parse_filter(format_filter(tree)), tree, query)
+
+    def test_empty_query(self):
+        self.assertIsNone(parse_filter("   "))
+        self.assertEqual(compile_filter("").condition, "")
+
+    def test_syntax_errors(self):
+        for query in ('author:"king', "color:red", "rating:abc", "(genre:Horror", "rating>="):
+            with self.assertRaises(FilterSyntaxError, msg = query) as raised:
+                parse_filter(query)
+            self.assertIsInstance(raised.exception, ValueError)
+        with self.assertRaises(FilterSyntaxError) as raised:
+            parse_filter('author:"king')
+        self.assertEqual(raised.exception.position, 7)
+
+
+class CompileTest(unittest.TestCase):
+
+    def assertCompiles(self, query, condition, parameters):
+        self.assertEqual(compile_tree(parse_filter(query)), (condition, parameters), query)
+
+    def test_index_forms(self):
+        self.assertCompiles("genre:Horror rating>=4", "genre = ? AND rating >= ?", ("Horror", 4))
+        self.assertCompiles("genre:(Horror|Thriller)", "genre IN (?, ?)", ("Horror", "Thriller"))
+        self.assertCompiles("rating:3..5", "rating BETWEEN ? AND ?", (3, 5))
+        self.assertCompiles("rating:4..", "rating >= ?", (4,))
+
+    def test_prefix_is_a_range_not_like(self):
+        self.assertCompiles("author:steph*", "author >= ? AND author < ?", ("Steph", "Stepi"))
+
+    def test_words_share_one_match(self):
+        self.assertCompiles("king shining", "id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)", ('"king"* "shining"*',))
+
+    def test_not_is_written_as_ranges(self):
+        self.assertCompiles("-genre:Horror", "genre < ? OR genre > ?", ("Horror", "Horror"))
+        self.assertCompiles('-series:""', "series > ?", ("",))
+        self.assertCompiles("rating!=0", "rating < ? OR rating > ?", (0, 0))
+        self.assertCompiles("-rating:(3|4)", "rating < ? OR rating > ?", (3, 4))
+        self.assertCompiles("-author:steph*", "author < ? OR author >= ?", ("Steph", "Stepi"))
+
+    def test_not_inside_and_is_grouped(self):
+        self.assertCompiles('genre:(Horror|Thriller) -series:""', "genre IN (?, ?) AND series > ?", ("Horror", "Thriller", ""))
+        self.assertCompiles("-(king OR genre:Horror) rating:3",
+            "(NOT (id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)) AND (genre < ? OR genre > ?)) AND rating = ?",
+            ('"king"*', "Horror", "Horror", 3))
+
+    def test_not_matches_plain_not(self):
+        connection = sqlite3.connect(":memory:")
+        connection.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT, author TEXT, rating INTEGER, genre TEXT, series TEXT, notes TEXT)")
+        chooser = random.Random(7)
+        values = ["", "A", "Horror", "Thriller", "Hz", "Steph", "Stephen", "Stepi", None]
+        for i in range(2000):
+            connection.execute("INSERT INTO books VALUES (NULL, ?, ?, ?, ?, ?, ?)", [chooser.choice(values) for j in range(2)] +
+                [chooser.choice([0, 1, 3, 4, 5, None])] + [chooser.choice(values) for j in range(3)])
+        for query in ("-genre:Horror", '-series:""', "rating!=0", "-rating:(3|5)", "-rating:(3|4)", "NOT title:A..M", "-author:steph*",
+                "-(genre:Horror rating>=4)", "-(title:Hz OR genre:Horror) rating:3", "rating!=0 OR -genre:A", "-genre:(Horror|Thriller)",
+                "-rating<3", '-notes:""'):
+            tree = parse_filter(query)
+            rewritten = connection.execute("SELECT id FROM books WHERE " + compile_tree(tree)[0], compile_tree(tree)[1]).fetchall()
+            condition, parameters = plain_not(tree)
+            self.assertEqual(rewritten, connection.execute("SELECT id FROM books WHERE " + condition, parameters).fetchall(), query)
+        connection.close()
+
+
+class PlanTest(unittest.TestCase):
+    """check_plan() on a temporary database"""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.library = open_library(os.path.join(self.folder, "booklist.db"))
+
+    def tearDown(self):
+        self.library.helper.close()
+        shutil.rmtree(self.folder)
+
+    def full_scan(self, query, order = "id"):
+        compiled = compile_filter(query)
+        return check_plan(self.library.helper, compiled.condition, compiled.parameters, order).full_scan
+
+    def test_indexed_fields_seek(self):
+        for query in ("genre:Horror", "author:steph*", "genre:(Horror|Thriller)", "rating:3..5", 'genre:Horror -series:""'):
+            self.assertFalse(self.full_scan(query), query)
+
+    def test_notes_scans(self):
+        self.assertTrue(self.full_scan('notes:"signed"'))
+
+
+if __name__ == "__main__":
+    unittest.main()
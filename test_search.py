@@ -0,0 +1,43 @@
+import os, shutil, tempfile, unittest
+from SqliteHelper import BOOK_INSERT
+from library import open_library
+
+"""Tests for the search box's full-text search (SqliteHelper.search()): ranking by the bm25 weights over every
+match, however many there are, on a real (temporary) database.
+
+    python -m unittest test_search
+"""
+
+class SearchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.library = open_library(os.path.join(self.folder, "booklist.db"))
+
+    def tearDown(self):
+        self.library.helper.close()
+        shutil.rmtree(self.folder)
+
+    def add_books(self, count):
+        self.library.helper.insert_many(BOOK_INSERT, (("Tales Of Place %d" % i, "Writer %d" % i, 3, "Fantasy", "", "",
+            "tales of place %d" % i, "writer %d" % i) for i in range(count)))
+
+    def test_newest_exact_match_ranks_first(self):
+        #more matches than a page, and the best one added last
+        self.add_books(6000)
+        book_id = self.library.add_book("Of", "Nobody").book_id
+        results = self.library.search("of", 10)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(results[0][0], book_id)
+
+    def test_title_counts_more_than_notes(self):
+        in_notes = self.library.add_book("Carrie", "Stephen King", notes = "a misery of a read").book_id
+        in_title = self.library.add_book("Misery", "Stephen King").book_id
+        self.assertEqual([book[0] for book in self.library.search("misery")], [in_title, in_notes])
+
+    def test_no_words(self):
+        self.assertEqual(self.library.search("  "), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import importlib.util, io, os
+from PyQt5 import QtWidgets, uic
+
+"""Loads Qt Designer .ui files from Python modules generated once and cached on disk.
+
+uic.loadUi() parses the .ui XML every time a window is built. load_ui() instead compiles each .ui file with
+uic.compileUi() into __uicache__/<name>_ui.py the first time it is needed, and after that only imports the
+module (from its cached bytecode) and runs its setupUi(). The generated module records the size and
+modification time of the .ui file it came from, so editing a form in Qt Designer rebuilds it on the next load.
+If the cache cannot be written, the form is loaded with uic.loadUi() as before.
+
+FUNCTIONS:
+    load_ui(ui_file, widget = None)
+        Builds the form on the widget (or on a new widget of the form's top-level class) and returns the widget
+
+    compiled_module(ui_file)
+        Returns the generated module for a .ui file, compiling it first if it is missing or out of date
+"""
+
+CACHE_DIRECTORY = "__uicache__"
+
+loaded_modules = {} #generated module path: module, for forms built more than once
+
+def cache_path(ui_file):
+    """Returns the path of the generated module for a .ui file"""
+
+    folder, name = os.path.split(os.path.abspath(ui_file))
+    return os.path.join(folder, CACHE_DIRECTORY, os.path.splitext(name)[0] + "_ui.py")
+
+def source_stamp(ui_file):
+    """Returns the size and modification time of a .ui file as a string stored in its generated module"""
+
+    status = os.stat(ui_file)
+    return "%d:%d" % (status.st_mtime_ns, status.st_size)
+
+def cached_stamp(path):
+    """Returns the source stamp written on the first line of a generated module, or None if there is no module"""
+
+    try:
+        with open(path, encoding = "utf-8") as module_file:
+            first_line = module_file.readline()
+    except OSError:
+        return None
+
+    if not first_line.startswith("SOURCE_STAMP = "):
+        return None
+    return first_line[len("SOURCE_STAMP = "):].strip().strip("'")
+
+def compile_ui(ui_file, path, stamp):
+    """Generates the Python module for a .ui file with uic.compileUi().
+
+    The top-level widget class and the generated form class are written into the module next to the
+    source stamp, so load_ui() does not have to read the XML again. The file is written under a temporary
+    name and renamed, so a program starting at the same time never imports half a module.
+    """
+
+    from xml.etree import ElementTree #only needed when a form is (re)compiled
+
+    top_level = ElementTree.parse(ui_file).getroot().find("widget")
+    code = io.StringIO()
+    uic.compileUi(ui_file, code)
+
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding = "utf-8") as module_file:
+        module_file.write("SOURCE_STAMP = '%s'\n" % stamp)
+        module_file.write("WIDGET_CLASS = '%s'\n" % top_level.get("class"))
+        module_file.write("FORM_CLASS = 'Ui_%s'\n" % top_level.get("name"))
+        module_file.write(code.getvalue())
+    os.replace(temporary, path)
+
+def compiled_module(ui_file):
+    """Returns the generated module for a .ui file, compiling it first if it is missing or out of date.
+
+    Raises OSError if the .ui file cannot be read or the cache directory cannot be written
+    """
+
+    path = cache_path(ui_file)
+    stamp = source_stamp(ui_file)
+
+    module = loaded_modules.get(path)
+    if module is not None and module.SOURCE_STAMP == stamp:
+        return module
+
+    if cached_stamp(path) != stamp:
+        compile_ui(ui_file, path, stamp)
+
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    loaded_modules[path] = module
+    return module
+
+def load_ui(ui_file, widget = None):
+    """Builds the form on the widget (or on a new widget of the form's top-level class) and returns the widget.
+
+    Works like uic.loadUi(ui_file, widget): every named child of the form becomes an attribute of the widget.
+
+    Parameters:
+        ui_file (string) - Qt Designer file
+        widget (QWidget) - widget to build the form on, e.g. self in a QDialog subclass; None to create one
+    """
+
+    try:
+        module = compiled_module(ui_file)
+    except OSError as e:
+        print("Could not use the compiled form for " + ui_file + ": " + str(e))
+        return uic.loadUi(ui_file, widget)
+
+    if widget is None:
+        widget = getattr(QtWidgets, module.WIDGET_CLASS)()
+
+    form = getattr(module, module.FORM_CLASS)()
+    form.setupUi(widget)
+    for name, value in vars(form).items():
+        setattr(widget, name, value)
+    return widget
@@ -3,36 +3,40 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QPalette
 from SqliteHelper import *
+from ui_cache import load_ui
 from shared import *
 
 class UpdateBook:
     """Updates the book details in the booklist as per user input.
     
     METHODS: 
-        __init__(self, window, helper)
+        __init__(self, window, worker)
             Loads the book_details form with the existing data from the database and sets the title/author fields as read-only
         
         update_book(self)
             Pulls the existing details from the database into the dialog window.
         
         update_details(self)
-            Overwrites the existing data for rating, genre, series, and notes and updates the database with this new data.       
+            Overwrites the existing data for rating, genre, series, and notes and updates the database with this new data; the edit can be undone.       
     """
 
-    def __init__(self, window, helper):
+    def __init__(self, window, worker):
         """Loads the book_details form with the existing data from the database and sets the title/author fields as read-only
         
         Parameters: 
             window: reference to the main screen created by MainWindow class
-            helper: reference to the sqlite object created by SqliteHelper class
+            worker: reference to the DatabaseWorker that owns the sqlite connection
         """
         
         super(UpdateBook, self).__init__()
         self.window = window
-        self.helper = helper
-        self.details_form = uic.loadUi("book_details_form.ui")
+        self.worker = worker
+        self.details_form = load_ui("book_details_form.ui")
         self.details_form.setWindowTitle("MyBookMgr - Update Book Details")
         self.details_form.setWindowFlags(self.details_form.windowFlags() & ~Qt.WindowContextHelpButtonHint)
+        #connected once: the form is reused, and each extra connection would queue another update and undo snapshot per OK
+        self.details_form.buttonBox.rejected.connect(self.details_form.reject)
+        self.details_form.buttonBox.accepted.connect(self.update_details)
         
         self.palette_title = self.details_form.lineEdit.palette()
         self.palette_title.setColor(QtGui.QPalette.Base, QtGui.QColor('lightgrey'))
@@ -48,27 +52,20 @@ class UpdateBook:
         Raises Attribute Error if no book is selected in table when button is clicked
             Please select a book
         """
-        self.details_form.buttonBox.rejected.connect(self.details_form.reject)
-        self.details_form.buttonBox.accepted.connect(self.update_details)
         
         try:
             self.selected_row = self.window.getRowId()
-            self.title = self.window.booklist_db.item(self.selected_row, 1).text()
-            self.author = self.window.booklist_db.item(self.selected_row, 2).text()
-            self.rating = self.window.booklist_db.item(self.selected_row, 3).text()    
-            self.genre = self.window.booklist_db.item(self.selected_row, 4).text()
-            self.series = self.window.booklist_db.item(self.selected_row, 5).text()    
-            self.notes = self.window.booklist_db.item(self.selected_row, 6).text()
+            self.book_id, self.title, self.author, self.rating, self.genre, self.series, self.notes = self.window.getBookDetails()
     
-            self.details_form.lineEdit.setText(self.title)
+            self.details_form.lineEdit.setText(str(self.title))
             self.details_form.lineEdit.setReadOnly(True)
-            self.details_form.lineEdit_2.setText(self.author)
+            self.details_form.lineEdit_2.setText(str(self.author))
             self.details_form.lineEdit_2.setReadOnly(True)
 
             self.details_form.spinBox.setValue(int(self.rating))
-            self.details_form.lineEdit_3.setText(self.genre)
-            self.details_form.lineEdit_4.setText(self.series)
-            self.details_form.lineEdit_5.setText(self.notes)
+            self.details_form.lineEdit_3.setText(str(self.genre))
+            self.details_form.lineEdit_4.setText(str(self.series))
+            self.details_form.lineEdit_5.setText(str(self.notes))
             
             self.early_cancel = self.details_form.exec_()
 
@@ -95,8 +92,8 @@ class UpdateBook:
             self.series = remove_punctuation(self.details_form.lineEdit_4.text().title())
             self.notes = self.details_form.lineEdit_5.text()
 
-            self.helper.update("UPDATE books SET rating=?, genre=?, series=?, notes=? WHERE id=$book_id", (self.rating, self.genre, self.series, self.notes, self.book_id))
-            self.window.refresh_data()
+            self.worker.submit(SqliteHelper.update_books, [int(self.book_id)], {"rating": self.rating, "genre": self.genre, "series": self.series, "notes": self.notes},
+                callback = self.window.add_undo) #main window is patched by the change listener
             self.details_form.close()
                     
         except AttributeError: 